@@ -0,0 +1,207 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from TimeSeriesForecaster import HealthScoreState, TimeSeriesForecaster
+
+CHUNK_BYTES = 1 << 18   # 分块计算时每块临时数组的大小
+
+
+class BatchTimeSeriesForecaster:
+    def __init__(self, data: np.ndarray, T: int, T_prime: int, mask: np.ndarray = None, β=0.5, dtype=None):
+        """
+        批量预测器：一次向量化计算 N 条序列（如一个片区内的全部设备）。
+        :param data: 输入数据，形状为 (N, T+T', C, V)
+        :param T: 过去时间步长
+        :param T_prime: 预测时间步长
+        :param mask: 可选的有效时间步掩码，形状为 (N, T+T')，用于长度不一的序列；
+                     无效时间步不参与均值和标准差，也不会被判为异常
+        :param β: 上下界的标准差倍数
+        :param dtype: 可选的计算精度，np.float32 时数据和结果均为 float32，内存减半（累积和仍用 float64）
+        """
+        self.data = data if dtype is None else np.asarray(data, dtype=dtype)
+        self.T = T
+        self.T_prime = T_prime
+        self.N, self.C, self.V = data.shape[0], data.shape[2], data.shape[3]
+        self.reference = T
+        self.mask = mask
+        self.β = β
+
+    @classmethod
+    def from_series(cls, series, T, T_prime, **kwargs):
+        """
+        由长度不一的序列构造批量预测器：每条序列取最后 T+T' 步，不足的在前面补零并置掩码。
+        :param series: 序列列表，每个形状为 (L_i, C, V)
+        """
+        window_size = T + T_prime
+        C, V = series[0].shape[1], series[0].shape[2]
+        data = np.zeros((len(series), window_size, C, V), dtype=kwargs.get('dtype') or np.float64)
+        mask = np.zeros((len(series), window_size), dtype=bool)
+        for i, values in enumerate(series):
+            values = values[-window_size:]
+            data[i, window_size - len(values):] = values
+            mask[i, window_size - len(values):] = True
+        return cls(data, T, T_prime, mask=mask, **kwargs)
+
+    def _chunk_size(self):
+        """
+        每次计算的序列条数，使一块 (n, T+T', C, V) 的 float64 临时数组约为 CHUNK_BYTES。
+        """
+        series_bytes = (self.T_prime + self.reference) * self.C * self.V * 8
+        return max(1, CHUNK_BYTES // series_bytes)
+
+    def _compute_bounds(self, β=0.5, start=0, end=None):
+        """
+        基于累积和计算序列 [start, end) 全部时刻的滑动窗口均值与上下界。
+        :return: 下界 (n, T', C, V), 上界 (n, T', C, V)
+        """
+        length = self.T_prime + self.reference - 1
+        r = self.reference
+        data = self.data[start:end, :length].astype(np.float64)
+        shift = data[:, :1].copy()  # 平移数据以减小累积和的数值误差
+        data -= shift
+        mask = None if self.mask is None else self.mask[start:end, :length]
+        if mask is not None:
+            data *= mask[:, :, np.newaxis, np.newaxis]
+
+        # 窗口 t 覆盖 [t, t+r)，窗口和为 cum[t+r-1] - cum[t-1]
+        cum_x = np.cumsum(data, axis=1)
+        window_sum = cum_x[:, r - 1:].copy()
+        window_sum[:, 1:] -= cum_x[:, :-r]
+        del cum_x
+        np.square(data, out=data)
+        cum_x2 = np.cumsum(data, axis=1, out=data)
+        window_sum2 = cum_x2[:, r - 1:].copy()
+        window_sum2[:, 1:] -= cum_x2[:, :-r]
+
+        if mask is None:
+            mean = window_sum / r
+            var = window_sum2 / r
+        else:
+            cum_n = np.cumsum(mask, axis=1)
+            count = cum_n[:, r - 1:].copy()
+            count[:, 1:] -= cum_n[:, :-r]
+            safe_count = np.maximum(count, 1)[:, :, np.newaxis, np.newaxis]
+            mean = window_sum / safe_count
+            var = window_sum2 / safe_count
+        var -= mean * mean
+        std = np.sqrt(np.maximum(var, 0, out=var), out=var)
+        if mask is None:
+            mean += shift
+        else:
+            mean = np.where(count[:, :, np.newaxis, np.newaxis] > 0, mean + shift, 0)
+        std *= β
+        lower_bound, upper_bound = mean - std, mean + std
+        if self.data.dtype == np.float32:
+            return lower_bound.astype(np.float32), upper_bound.astype(np.float32)
+        return lower_bound, upper_bound
+
+    def history_weighted(self):
+        """
+        :return: (N, T, C)，表示加权后的历史数据
+        """
+        history_data = self.data[:, :self.T]
+        valid_counts = np.sum(history_data != 0, axis=-1)
+        valid_counts[valid_counts == 0] = 1
+        return np.sum(history_data, axis=-1) / valid_counts.astype(history_data.dtype)
+
+    def forward(self):
+        """
+        执行批量前向预测，按 _chunk_size 分块计算以限制临时数组的大小
+        :return: weighted_result, weighted_lower_bound, weighted_upper_bound，形状均为 (N, T', C)
+        """
+        weighted_sum = TimeSeriesForecaster._compute_weighted_sum
+        chunk = self._chunk_size()
+        results = ([], [], [])
+        for start in range(0, self.N, chunk):
+            end = min(start + chunk, self.N)
+            lower_bound, upper_bound = self._compute_bounds(self.β, start, end)
+            results[0].append(weighted_sum(self.data[start:end, self.T:]))
+            results[1].append(weighted_sum(lower_bound))
+            results[2].append(weighted_sum(upper_bound))
+        return tuple(np.concatenate(parts) for parts in results)
+
+    def detect_anomalies(self, weighted_result, weighted_lower_bound, weighted_upper_bound):
+        """
+        :return: 异常检测结果，形状为 (N, T', C)；掩码无效的时间步不判为异常
+        """
+        is_anomaly = ((weighted_result < weighted_lower_bound) |
+                      (weighted_result > weighted_upper_bound)).astype(int)
+        if self.mask is not None:
+            is_anomaly *= self.mask[:, self.T:, np.newaxis]
+        return is_anomaly
+
+    def compute_health_score(self, is_anomaly, alpha=0.9, beta=0.5, gamma=0.1):
+        """
+        批量计算健康性评分，与 TimeSeriesForecaster.compute_health_score 逐条计算的结果一致。
+        :param is_anomaly: (N, T', C)
+        :return: (N, T')
+        """
+        return HealthScoreState(alpha, beta, gamma).update_batch(is_anomaly)
+
+    def run(self):
+        """
+        一次完成预测、异常检测和健康性评分。
+        :return: (weighted_result, lower_bound, upper_bound, is_anomaly, health_score)
+        """
+        weighted_result, lower_bound, upper_bound = self.forward()
+        is_anomaly = self.detect_anomalies(weighted_result, lower_bound, upper_bound)
+        return weighted_result, lower_bound, upper_bound, is_anomaly, self.compute_health_score(is_anomaly)
+
+
+def _run_shard(shard, T, T_prime, mask, β):
+    return BatchTimeSeriesForecaster(np.asarray(shard), T, T_prime, mask=mask, β=β).run()
+
+
+def iter_sharded(data, T, T_prime, mask=None, β=0.5, shard_size=128, processes=None):
+    """
+    将 N 条序列按 shard_size 分片，在进程池中并行计算，按顺序逐片返回结果。
+    data 可以是 np.memmap，每次只有正在计算的分片被读入内存。
+    :param processes: 进程数，默认为 CPU 核数；为 1 时在当前进程中计算
+    :return: 逐片产生 run() 的结果
+    """
+    bounds = [(start, min(start + shard_size, len(data))) for start in range(0, len(data), shard_size)]
+    shard_mask = lambda start, end: None if mask is None else mask[start:end]
+    if processes == 1:
+        for start, end in bounds:
+            yield _run_shard(data[start:end], T, T_prime, shard_mask(start, end), β)
+        return
+
+    processes = processes or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        # 最多同时提交 2 倍进程数的分片，限制内存占用
+        pending = []
+        for start, end in bounds:
+            pending.append(executor.submit(
+                _run_shard, np.asarray(data[start:end]), T, T_prime, shard_mask(start, end), β))
+            if len(pending) >= 2 * processes:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+
+def forecast_sharded(data, T, T_prime, mask=None, β=0.5, shard_size=128, processes=None):
+    """
+    分片并行计算并拼接结果，返回值同 BatchTimeSeriesForecaster.run()。
+    """
+    results = list(iter_sharded(data, T, T_prime, mask, β, shard_size, processes))
+    return tuple(np.concatenate(parts) for parts in zip(*results))
+
+
+if __name__ == '__main__':
+    # 与 TimeSeriesForecaster 逐条计算的结果对比
+    N, T, T_prime, C, V = 64, 16, 32, 3, 4
+    data = np.random.rand(N, T + T_prime, C, V)
+
+    batch_results = BatchTimeSeriesForecaster(data, T, T_prime).run()
+    sharded_results = forecast_sharded(data, T, T_prime, shard_size=16, processes=2)
+
+    max_error = 0.0
+    for n in range(N):
+        forecaster = TimeSeriesForecaster(data[n], T, T_prime)
+        result, lower_bound, upper_bound = forecaster.forward()
+        anomalies = forecaster.detect_anomalies(result, lower_bound, upper_bound)
+        health_score = forecaster.compute_health_score(anomalies)
+        for batch, single in zip(batch_results, (result, lower_bound, upper_bound, anomalies, health_score)):
+            max_error = max(max_error, np.abs(batch[n] - single).max())
+    print("Max error vs. TimeSeriesForecaster:", max_error)
+    print("Sharded matches batch:", all(np.allclose(a, b) for a, b in zip(batch_results, sharded_results)))
@@ -0,0 +1,165 @@
+import numpy as np
+from TimeSeriesForecaster import TimeSeriesForecaster, HealthScoreState
+
+
+class OnlineForecaster:
+    def __init__(self, T: int, C: int, V: int, β=0.5, alpha=0.9, beta=0.5, gamma=0.1,
+                 refresh_interval=1024):
+        """
+        在线预测器：逐个时间步接收数据，维护长度为 T 的滑动窗口和
+        每个 (C, V) 通道的窗口和与平方和，每步更新代价为 O(C·V)。
+        结果与 TimeSeriesForecaster 在连续窗口上的结果一致。
+        :param T: 过去时间步长（滑动窗口长度）
+        :param C: 通道数
+        :param V: 每个通道的分量数
+        :param β: 上下界的标准差倍数
+        :param alpha: 健康性评分中异常事件的影响权重
+        :param beta: 健康性评分中异常持续时间的权重
+        :param gamma: 健康性评分的时间衰减系数
+        :param refresh_interval: 每隔多少步从窗口重新精确计算一次和，防止累积误差
+        """
+        self.T = T
+        self.C, self.V = C, V
+        self.β = β
+        self.refresh_interval = refresh_interval
+        self.window = np.zeros((T, C, V))   # 环形缓冲区
+        self.count = 0                      # 已接收的时间步数
+        self.shift = None                   # 平移量，减小窗口和的数值误差
+        self.sum_x = np.zeros((C, V))
+        self.sum_x2 = np.zeros((C, V))
+        self.health_state = HealthScoreState(alpha, beta, gamma)
+
+    def _refresh_sums(self):
+        """
+        由窗口内容重新精确计算窗口和与平方和。
+        """
+        centered = self.window - self.shift
+        self.sum_x = np.sum(centered, axis=0)
+        self.sum_x2 = np.sum(centered * centered, axis=0)
+
+    def _bounds(self):
+        """
+        由当前窗口和计算上下界。
+        :return: 下界 (C, V), 上界 (C, V)
+        """
+        mean = self.sum_x / self.T
+        var = np.maximum(self.sum_x2 / self.T - mean * mean, 0)
+        std = np.sqrt(var)
+        mean = mean + self.shift
+        return mean - self.β * std, mean + self.β * std
+
+    def _push(self, sample):
+        """
+        将新样本放入窗口，同时移出最旧的样本。
+        """
+        slot = self.count % self.T
+        old = self.window[slot] - self.shift
+        new = sample - self.shift
+        if self.count >= self.T:
+            self.sum_x -= old
+            self.sum_x2 -= old * old
+        self.sum_x += new
+        self.sum_x2 += new * new
+        self.window[slot] = sample
+        self.count += 1
+        if self.count >= self.T and self.count % self.refresh_interval == 0:
+            self._refresh_sums()
+
+    @property
+    def ready(self):
+        """
+        窗口是否已填满，填满后才能给出上下界。
+        """
+        return self.count >= self.T
+
+    def update(self, sample):
+        """
+        接收一个新的时间步并返回该步的预测结果。
+        :param sample: 新时间步的数据，形状为 (C, V)
+        :return: 窗口未填满时返回 None；否则返回字典：
+            - weighted_result: (C,) 加权后的预测值
+            - lower_bound: (C,) 加权后的下界
+            - upper_bound: (C,) 加权后的上界
+            - is_anomaly: (C,) 异常检测结果
+            - health_score: 健康性评分
+        """
+        sample = np.asarray(sample, dtype=np.float64)
+        if self.shift is None:
+            self.shift = sample.copy()
+
+        result = None
+        if self.ready:
+            lower_bound, upper_bound = self._bounds()
+            weighted = TimeSeriesForecaster._compute_weighted_sum(
+                np.stack([sample, lower_bound, upper_bound]))
+            weighted_result, weighted_lower_bound, weighted_upper_bound = weighted
+            is_anomaly = ((weighted_result < weighted_lower_bound) |
+                          (weighted_result > weighted_upper_bound)).astype(int)
+            result = {
+                'weighted_result': weighted_result,
+                'lower_bound': weighted_lower_bound,
+                'upper_bound': weighted_upper_bound,
+                'is_anomaly': is_anomaly,
+                'health_score': self.health_state.update(is_anomaly)
+            }
+
+        self._push(sample)
+        return result
+
+
+class OnlineForecasterPool:
+    def __init__(self, T: int, C: int, V: int, **kwargs):
+        """
+        按设备编号管理多个在线预测器，用于持续为大量设备评分。
+        :param T: 过去时间步长
+        :param C: 通道数
+        :param V: 每个通道的分量数
+        :param kwargs: 传给 OnlineForecaster 的其它参数
+        """
+        self.T, self.C, self.V = T, C, V
+        self.kwargs = kwargs
+        self.forecasters = {}
+
+    def get(self, device_id):
+        """
+        获取（必要时创建）某个设备的在线预测器。
+        """
+        forecaster = self.forecasters.get(device_id)
+        if forecaster is None:
+            forecaster = OnlineForecaster(self.T, self.C, self.V, **self.kwargs)
+            self.forecasters[device_id] = forecaster
+        return forecaster
+
+    def update(self, device_id, sample):
+        """
+        为某个设备送入一个新时间步，返回值同 OnlineForecaster.update。
+        """
+        return self.get(device_id).update(sample)
+
+    def remove(self, device_id):
+        """
+        移除某个设备的状态。
+        """
+        self.forecasters.pop(device_id, None)
+
+
+if __name__ == '__main__':
+    # 与 TimeSeriesForecaster 的滑动窗口结果对比
+    T, T_prime, C, V, M = 5, 3, 4, 3, 41
+    data = np.random.rand(M, C, V)
+
+    online = OnlineForecaster(T, C, V)
+    online_results = [online.update(sample) for sample in data]
+
+    max_error = 0.0
+    for start in range(0, M - T - T_prime + 1, T_prime):
+        forecaster = TimeSeriesForecaster(data[start:start + T + T_prime], T, T_prime)
+        weighted_result, lower_bound, upper_bound = forecaster.forward()
+        for t in range(T_prime):
+            step = online_results[start + T + t]
+            max_error = max(max_error,
+                            np.abs(step['weighted_result'] - weighted_result[t]).max(),
+                            np.abs(step['lower_bound'] - lower_bound[t]).max(),
+                            np.abs(step['upper_bound'] - upper_bound[t]).max())
+    print("Max error vs. TimeSeriesForecaster:", max_error)
+    print("Last health score:", online_results[-1]['health_score'])
@@ -2,24 +2,52 @@ import numpy as np
 
 
 class TimeSeriesForecaster:
-    def __init__(self, data: np.ndarray, T: int, T_prime: int):
+    def __init__(self, data: np.ndarray, T: int, T_prime: int, dtype=None):
         """
         初始化预测器。
         :param data: 输入数据，形状为 (T+T', C, V)
         :param T: 过去时间步长
         :param T_prime: 预测时间步长
         :param reference: 向前参考时间步长，默认为 T
+        :param dtype: 可选的计算精度，np.float32 时数据和结果均为 float32（累积和仍用 float64）
         """
-        self.data = data
+        self.data = data if dtype is None else np.asarray(data, dtype=dtype)
         self.T = T
         self.T_prime = T_prime
         self.C, self.V = data.shape[1], data.shape[2]
         self.reference = T
         self.β = 0.5
 
-    def _compute_bounds(self, β=0.5):
+    def _compute_bounds(self, β=0.5, mode="vectorized"):
         """
             计算每个时刻 T' 使用前 T 步的均值和上下界。
+            基于 x 与 x² 的累积和一次性求出所有滑动窗口的均值和标准差。
+            :param mode: "vectorized" 为向量化实现，"reference" 为逐步循环的参考实现
+            :return: 下界 (T', C, V), 上界 (T', C, V)
+            """
+        if mode == "reference":
+            return self._compute_bounds_reference(β)
+        data = self.data[:self.T_prime + self.reference - 1].astype(np.float64)
+        shift = data[0]  # 平移数据以减小累积和的数值误差，方差不受影响
+        data = data - shift
+        zeros = np.zeros((1, self.C, self.V))
+        cum_x = np.concatenate([zeros, np.cumsum(data, axis=0)])
+        cum_x2 = np.concatenate([zeros, np.cumsum(data * data, axis=0)])
+        window_sum = cum_x[self.reference:] - cum_x[:-self.reference]
+        window_sum2 = cum_x2[self.reference:] - cum_x2[:-self.reference]
+        mean = window_sum / self.reference
+        var = np.maximum(window_sum2 / self.reference - mean * mean, 0)  # 消除舍入误差带来的负方差
+        std = np.sqrt(var)
+        mean = mean + shift
+        lower_bound = mean - β * std
+        upper_bound = mean + β * std
+        if self.data.dtype == np.float32:
+            return lower_bound.astype(np.float32), upper_bound.astype(np.float32)
+        return lower_bound, upper_bound
+
+    def _compute_bounds_reference(self, β=0.5):
+        """
+            逐步循环计算上下界的参考实现，用于校验向量化结果。
             :return: 下界 (T', C, V), 上界 (T', C, V)
             """
         lower_bound = np.zeros((self.T_prime, self.C, self.V))
@@ -40,10 +68,11 @@ class TimeSeriesForecaster:
         history_data = self.data[:self.T, :, :]
         valid_counts = np.sum(history_data != 0, axis=-1)
         valid_counts[valid_counts == 0] = 1
-        weighted_history = np.sum(history_data, axis=-1) / valid_counts
+        weighted_history = np.sum(history_data, axis=-1) / valid_counts.astype(history_data.dtype)
         return weighted_history
 
-    def _compute_weighted_sum(self, data: np.ndarray):
+    @staticmethod
+    def _compute_weighted_sum(data: np.ndarray):
         """
         计算加权 V 维度并得到 T'*C 维度的数据。
         :param data: 输入数据，形状为 (T', C, V)
@@ -55,7 +84,7 @@ class TimeSeriesForecaster:
         valid_counts[valid_counts == 0] = 1  # 避免除零
 
         weighted_data = np.sum(data * valid_mask, axis=-1) / \
-            valid_counts.squeeze(-1)  # 对 V 维度求加权平均
+            valid_counts.squeeze(-1).astype(data.dtype)  # 对 V 维度求加权平均，保持输入精度
         return weighted_data
 
     def detect_anomalies(self, weighted_result, weighted_lower_bound, weighted_upper_bound):
@@ -71,25 +100,19 @@ class TimeSeriesForecaster:
                    (weighted_result > weighted_upper_bound)] = 1
         return is_anomaly
 
-    def compute_health_score(self, is_anomaly, alpha=0.9, beta=0.5, gamma=0.1):
+    def compute_health_score(self, is_anomaly, alpha=0.9, beta=0.5, gamma=0.1, state=None):
         """
-        计算实时健康性评分
+        计算实时健康性评分，基于累积和，复杂度 O(T'·C)
         :param is_anomaly: 异常检测结果，形状为 (T_prime, C)
         :param alpha: 异常事件对健康性评分的影响权重
         :param beta: 异常持续时间的权重
         :param gamma: 时间衰减系数
+        :param state: 可选的 HealthScoreState，传入时接续上一个窗口的持续时间与衰减状态
         :return: 实时健康性评分，形状为 (T_prime,)
         """
-        y, C = is_anomaly.shape
-        health_score = 100 * np.ones(y)
-
-        for t in range(1, y):
-            duration = np.sum(is_anomaly[:t, :], axis=0)
-            simultaneous_anomalies = np.sum(is_anomaly[t, :])
-            health_score[t] = 100 - alpha * (beta * np.sum(duration) + (
-                1 - beta) * simultaneous_anomalies) * np.exp(-gamma * (t - 1))
-
-        return health_score
+        if state is None:
+            state = HealthScoreState(alpha, beta, gamma)
+        return state.update_batch(is_anomaly)
 
     def forward(self):
         """
@@ -107,6 +130,61 @@ class TimeSeriesForecaster:
         return weighted_result, weighted_lower_bound, weighted_upper_bound
 
 
+class HealthScoreState:
+    """
+    跨窗口的健康性评分状态。每次 update_batch 送入的时间步作为一个窗口，窗口内按原公式评分，
+    时间衰减从窗口内第一个有历史的时间步算起；之前各窗口的异常持续时间按指数衰减累计，
+    每经过一个窗口乘以 exp(-γ·y)，再加上该窗口的持续时间。持续异常的数据流在之后的窗口中
+    评分仍低于 100，而不会随全局时间步衰减到 100。第一个窗口的评分与原公式一致，
+    每个时间步的更新代价为 O(C)。
+    """
+
+    def __init__(self, alpha=0.9, beta=0.5, gamma=0.1):
+        """
+        :param alpha: 异常事件对健康性评分的影响权重
+        :param beta: 异常持续时间的权重
+        :param gamma: 时间衰减系数
+        """
+        self.alpha = alpha
+        self.beta = beta
+        self.gamma = gamma
+        self.t = 0                  # 已评分的时间步数
+        self.total_duration = 0     # 之前各窗口衰减累计的异常持续时间（所有通道）
+
+    def update(self, is_anomaly_row):
+        """
+        送入一个时间步的异常检测结果，返回该步的健康性评分。
+        :param is_anomaly_row: 形状为 (C,)
+        :return: 健康性评分（float）
+        """
+        return float(self.update_batch(np.asarray(is_anomaly_row)[np.newaxis, :])[0])
+
+    def update_batch(self, is_anomaly):
+        """
+        送入一个窗口连续多个时间步的异常检测结果。
+        :param is_anomaly: 形状为 (T_prime, C)；也可以带前导的批维度 (N, T_prime, C)，
+                           此时状态按序列分别累计
+        :return: 健康性评分，形状为 (T_prime,) 或 (N, T_prime)
+        """
+        y = is_anomaly.shape[-2]
+        simultaneous_anomalies = np.sum(is_anomaly, axis=-1)
+        # 第 i 步之前的持续时间（不含第 i 步），包括之前各窗口衰减后的累计值
+        window_duration = np.cumsum(simultaneous_anomalies, axis=-1) - simultaneous_anomalies
+        duration = np.asarray(self.total_duration)[..., np.newaxis] + window_duration
+        # 没有历史时窗口的第 0 步评分为 100，衰减从第 1 步算起
+        first = 0 if self.t > 0 else 1
+        steps = np.arange(y) - first
+        health_score = 100 - self.alpha * (self.beta * duration + (
+            1 - self.beta) * simultaneous_anomalies) * np.exp(-self.gamma * steps)
+        health_score[..., steps < 0] = 100
+
+        if y > 0:
+            self.total_duration = np.asarray(self.total_duration) * np.exp(-self.gamma * y) + \
+                window_duration[..., -1] + simultaneous_anomalies[..., -1]
+        self.t += y
+        return health_score.astype(np.float64)
+
+
 if __name__ == '__main__':
     # 生成测试数据集
     T, T_prime, C, V = 16, 32, 3, 4  # 设定维度大小
@@ -0,0 +1,357 @@
+# anomaly_events.py
+"""
+导入时物化的异常事件与健康性快照：每次导入或追加后，按设备将读数重采样到固定步长的网格上，
+用 BatchTimeSeriesForecaster 计算各窗口的异常，写入带索引的表，查询时不再重新计算。
+
+    store.anomaly_events   (table_name, device_code, site_name, site_code, start_time, end_time,
+                            steps, max_deviation, min_health_score)   —— 连续异常的时间步合并为一个区间
+    store.health_snapshots (table_name, device_code, site_name, site_code, window_index, time,
+                            health_score, min_health_score, anomaly_steps, steps, total_duration)
+                           —— 每个窗口一条，steps/total_duration 为该窗口的 HealthScoreState
+    store.anomaly_state    (table_name, device_code, grid_start, windows, params)
+
+窗口 k 覆盖网格点 [kT', kT'+T+T')，预测其中后 T' 个点，各窗口的预测区间首尾相接。
+追加数据的最早时间为 time_from 时，只有结束点不早于 time_from 的窗口会变化（重采样沿用上一次读数），
+因此只删除并重新计算末尾的这些窗口；跨越重算起点的异常区间连同其所在的窗口一起重算。
+健康性评分按窗口计算，每个窗口从新的 HealthScoreState 开始，快照只取决于窗口本身，
+与增量重算从哪个窗口开始无关。
+PostgreSQL 下保存在 store 模式中，嵌入式模式下保存在 DuckDB 中。
+"""
+import logging
+import re
+import threading
+import time
+from datetime import timedelta
+import numpy as np
+from sqlalchemy import text
+import db as db_module
+from db import db, INTERNAL_SCHEMA
+from BatchTimeSeriesForecaster import BatchTimeSeriesForecaster
+from TimeSeriesForecaster import HealthScoreState
+from prediction_input import (device_time_ranges, last_complete_reading_time, stream_device_readings,
+                              resample_readings, VALUE_COLUMNS, DEFAULT_STEP)
+
+SCHEMA = INTERNAL_SCHEMA
+SITE_COLUMNS = ('隐患点名称', '隐患点编号')
+SCHEMA_SQL = f"""
+CREATE SCHEMA IF NOT EXISTS {SCHEMA};
+CREATE TABLE IF NOT EXISTS {SCHEMA}.anomaly_events (
+    table_name TEXT NOT NULL,
+    device_code TEXT NOT NULL,
+    site_name TEXT,
+    site_code TEXT,
+    start_time TIMESTAMP NOT NULL,
+    end_time TIMESTAMP NOT NULL,
+    steps INTEGER NOT NULL,
+    max_deviation DOUBLE PRECISION,
+    min_health_score DOUBLE PRECISION,
+    PRIMARY KEY (table_name, device_code, start_time)
+);
+CREATE INDEX IF NOT EXISTS anomaly_events_device_time ON {SCHEMA}.anomaly_events (device_code, start_time);
+CREATE INDEX IF NOT EXISTS anomaly_events_site_time ON {SCHEMA}.anomaly_events (site_name, start_time);
+CREATE INDEX IF NOT EXISTS anomaly_events_time ON {SCHEMA}.anomaly_events (start_time);
+CREATE TABLE IF NOT EXISTS {SCHEMA}.health_snapshots (
+    table_name TEXT NOT NULL,
+    device_code TEXT NOT NULL,
+    site_name TEXT,
+    site_code TEXT,
+    window_index INTEGER NOT NULL,
+    time TIMESTAMP NOT NULL,
+    health_score DOUBLE PRECISION,
+    min_health_score DOUBLE PRECISION,
+    anomaly_steps INTEGER,
+    steps BIGINT,
+    total_duration BIGINT,
+    PRIMARY KEY (table_name, device_code, window_index)
+);
+CREATE INDEX IF NOT EXISTS health_snapshots_device_time ON {SCHEMA}.health_snapshots (device_code, time);
+CREATE INDEX IF NOT EXISTS health_snapshots_site_time ON {SCHEMA}.health_snapshots (site_name, time);
+CREATE TABLE IF NOT EXISTS {SCHEMA}.anomaly_state (
+    table_name TEXT NOT NULL,
+    device_code TEXT NOT NULL,
+    grid_start TIMESTAMP NOT NULL,
+    windows INTEGER NOT NULL,
+    params TEXT NOT NULL,
+    PRIMARY KEY (table_name, device_code)
+)
+"""
+EVENT_COLUMNS = ['table_name', 'device_code', 'site_name', 'site_code', 'start_time', 'end_time',
+                 'steps', 'max_deviation', 'min_health_score']
+SNAPSHOT_COLUMNS = ['table_name', 'device_code', 'site_name', 'site_code', 'window_index', 'time',
+                    'health_score', 'min_health_score', 'anomaly_steps', 'steps', 'total_duration']
+
+_settings = {'enabled': True, 'T': 144, 'T_prime': 36, 'step': DEFAULT_STEP, 'beta': 0.5}
+_lock = threading.Lock()
+_table_locks = {}           # 同一表格的计算串行执行，后台任务并行时不会交错写入同一设备的窗口
+_schema_ready = False
+_PARAM_PATTERN = re.compile(r'(?<![:\w]):(\w+)')
+
+
+def configure(config):
+    """
+    按配置设置窗口参数：ANOMALY_EVENTS、ANOMALY_T、ANOMALY_T_PRIME、ANOMALY_STEP、ANOMALY_BETA。
+    """
+    _settings.update({
+        'enabled': config.get('ANOMALY_EVENTS', True),
+        'T': int(config.get('ANOMALY_T', 144)),
+        'T_prime': int(config.get('ANOMALY_T_PRIME', 36)),
+        'step': int(config.get('ANOMALY_STEP', DEFAULT_STEP)),
+        'beta': float(config.get('ANOMALY_BETA', 0.5)),
+    })
+
+
+def enabled():
+    """
+    事件表需要 PostgreSQL 的模式或嵌入式存储，其他数据库下不启用。
+    """
+    if not _settings['enabled']:
+        return False
+    if db_module.embedded_only:
+        return True
+    return db.session.get_bind().dialect.name == 'postgresql'
+
+
+def _execute(sql, params=None):
+    """
+    在保存事件表的数据库中执行：嵌入式模式为 DuckDB（参数写作 $name），否则为 PostgreSQL。
+    """
+    if db_module.embedded_only:
+        return db_module.analytics_store.execute(_PARAM_PATTERN.sub(r'$\1', sql), params)
+    result = db.session.execute(text(sql), params or {})
+    return result.fetchall() if result.returns_rows else []
+
+
+def _insert(table, columns, rows):
+    if db_module.embedded_only:
+        db_module.analytics_store.insert_rows(f"{SCHEMA}.{table}", columns, rows)
+    elif rows:
+        db.session.execute(
+            text(f"INSERT INTO {SCHEMA}.{table} ({', '.join(columns)}) "
+                 f"VALUES ({', '.join(':' + column for column in columns)})"),
+            [dict(zip(columns, row)) for row in rows])
+
+
+def _commit():
+    if not db_module.embedded_only:
+        db.session.commit()
+
+
+def ensure_schema():
+    """
+    创建事件表、快照表、状态表和索引（幂等）。
+    """
+    global _schema_ready
+    with _lock:
+        if _schema_ready:
+            return
+        for statement in SCHEMA_SQL.split(';'):
+            if statement.strip():
+                _execute(statement)
+        _commit()
+        _schema_ready = True
+
+
+def materialize(table_name, headers, time_from=None):
+    """
+    导入或追加后更新该表的异常事件与健康性快照。
+    :param headers: 表格的列，缺少设备编号、时间或采集值时跳过
+    :param time_from: 追加数据的最早时间，只重新计算受影响的末尾窗口；为 None 时重新计算全部设备
+    :return: 更新的设备数
+    """
+    if not enabled() or not {'设备编号', '时间', *VALUE_COLUMNS} <= set(headers):
+        return 0
+    ensure_schema()
+    with _lock:
+        table_lock = _table_locks.setdefault(table_name, threading.Lock())
+    with table_lock:
+        return _materialize(table_name, headers, time_from)
+
+
+def _materialize(table_name, headers, time_from):
+    start_time = time.perf_counter()
+    site_columns = [column for column in SITE_COLUMNS if column in headers]
+    devices = device_time_ranges(table_name, site_columns, time_from)
+    windows = 0
+    for device, first_time, last_time, *site in devices:
+        site = dict(zip(site_columns, (None if value is None else str(value) for value in site)))
+        windows += _update_device(table_name, str(device), first_time, last_time,
+                                  site.get('隐患点名称'), site.get('隐患点编号'), time_from)
+    logging.info(f"Anomaly events updated: {table_name} devices={len(devices)} windows={windows} "
+                 f"elapsed={time.perf_counter() - start_time:.3f}s")
+    return len(devices)
+
+
+def _update_device(table_name, device, first_time, last_time, site_name, site_code, time_from):
+    """
+    重新计算某设备从第一个受影响窗口开始的全部窗口。
+    :return: 计算的窗口数
+    """
+    T, T_prime, β = _settings['T'], _settings['T_prime'], _settings['beta']
+    step = timedelta(seconds=_settings['step'])
+    params = f"{T}/{T_prime}/{_settings['step']}/{β}/window"   # 健康性评分方式变化时也从头计算
+    key = {'table_name': table_name, 'device_code': device}
+    where = "table_name = :table_name AND device_code = :device_code"
+
+    # 网格起点与已计算的窗口数；首次导入、参数变化或出现更早的数据时从头计算
+    state = _execute(f"SELECT grid_start, windows, params FROM {SCHEMA}.anomaly_state WHERE {where}", key)
+    grid_start, computed = first_time, 0
+    if time_from is not None and state and state[0][2] == params and state[0][0] == first_time:
+        computed = state[0][1]
+
+    n_steps = int((last_time - grid_start) / step) + 1
+    windows = (n_steps - T - T_prime) // T_prime + 1 if n_steps >= T + T_prime else 0
+
+    # 第一个受影响的窗口：结束点不早于 time_from 的窗口，以及尚未计算过的窗口
+    k0 = 0
+    if computed:
+        first_changed = max(0, -(-(time_from - grid_start) // step))
+        k0 = min(computed, max(0, -(-(first_changed - T - T_prime + 1) // T_prime)))
+        # 重算起点落在某个异常区间中间时，退回到该区间开始的窗口，直到没有跨越起点的区间
+        while k0 > 0:
+            straddling = _execute(f"""
+                SELECT MIN(start_time) FROM {SCHEMA}.anomaly_events
+                WHERE {where} AND start_time < :region_start AND end_time >= :region_start
+            """, {**key, 'region_start': grid_start + (k0 * T_prime + T) * step})[0][0]
+            if straddling is None:
+                break
+            k0 = max(0, (round((straddling - grid_start) / step) - T) // T_prime)
+
+    if k0 == 0:
+        _execute(f"DELETE FROM {SCHEMA}.anomaly_events WHERE {where}", key)
+        _execute(f"DELETE FROM {SCHEMA}.health_snapshots WHERE {where}", key)
+    else:
+        _execute(f"DELETE FROM {SCHEMA}.anomaly_events WHERE {where} AND start_time >= :region_start",
+                 {**key, 'region_start': grid_start + (k0 * T_prime + T) * step})
+        _execute(f"DELETE FROM {SCHEMA}.health_snapshots WHERE {where} AND window_index >= :k0",
+                 {**key, 'k0': k0})
+
+    if k0 < windows:
+        series = _resampled_series(table_name, device, grid_start, step,
+                                   k0 * T_prime, (windows - 1) * T_prime + T + T_prime)
+        events, snapshots = _detect(series, k0, grid_start, step)
+        site = (table_name, device, site_name, site_code)
+        _insert('anomaly_events', EVENT_COLUMNS, [site + event for event in events])
+        _insert('health_snapshots', SNAPSHOT_COLUMNS, [site + snapshot for snapshot in snapshots])
+
+    _execute(f"""
+        INSERT INTO {SCHEMA}.anomaly_state (table_name, device_code, grid_start, windows, params)
+        VALUES (:table_name, :device_code, :grid_start, :windows, :params)
+        ON CONFLICT (table_name, device_code) DO UPDATE
+        SET grid_start = EXCLUDED.grid_start, windows = EXCLUDED.windows, params = EXCLUDED.params
+    """, {**key, 'grid_start': grid_start, 'windows': windows, 'params': params})
+    _commit()
+    return max(windows - k0, 0)
+
+
+def _resampled_series(table_name, device, grid_start, step, begin, end):
+    """
+    网格点 [begin, end) 上的重采样值，形状为 (end-begin, V)。
+    从 begin 之前最后一次完整读数开始读取，结果与从头重采样相同。
+    """
+    begin_time = grid_start + begin * step
+    seed = last_complete_reading_time(table_name, device, begin_time) if begin > 0 else None
+    rows = stream_device_readings(table_name, device, time_from=seed)
+    try:
+        return np.array(list(resample_readings(rows, begin_time, step, end - begin)))
+    finally:
+        rows.close()
+
+
+def _detect(series, k0, grid_start, step):
+    """
+    对重采样序列上从第 k0 个窗口开始的各窗口做异常检测，各窗口的健康性评分分别从 100 开始计算。
+    :return: (异常区间行, 健康性快照行)，不含表名、设备和隐患点列
+    """
+    T, T_prime, β = _settings['T'], _settings['T_prime'], _settings['beta']
+    windows = np.lib.stride_tricks.sliding_window_view(series, T + T_prime, axis=0)[::T_prime]
+    data = np.ascontiguousarray(windows.transpose(0, 2, 1))[:, :, np.newaxis, :]   # (N, T+T', 1, V)
+    forecaster = BatchTimeSeriesForecaster(data, T, T_prime, β=β)
+    weighted_result, lower_bound, upper_bound = forecaster.forward()
+    is_anomaly = forecaster.detect_anomalies(weighted_result, lower_bound, upper_bound)[:, :, 0]
+
+    health_state = HealthScoreState()
+    health = health_state.update_batch(is_anomaly[:, :, np.newaxis])                 # (N, T')
+    snapshots = []
+    for j, (window_anomaly, window_health) in enumerate(zip(is_anomaly, health)):
+        index = k0 + j
+        snapshots.append((index, grid_start + (index * T_prime + T + T_prime - 1) * step,
+                          float(window_health[-1]), float(window_health.min()), int(window_anomaly.sum()),
+                          T_prime, int(health_state.total_duration[j])))
+
+    # 各窗口的预测区间首尾相接，拼接后第 i 个元素对应网格点 k0*T' + T + i
+    flags = is_anomaly.reshape(-1)
+    value, lower, upper = (a[:, :, 0].reshape(-1) for a in (weighted_result, lower_bound, upper_bound))
+    deviation = np.maximum(np.maximum(lower - value, value - upper), 0)
+    health = health.reshape(-1)
+    offset = k0 * T_prime + T
+    changes = np.flatnonzero(np.diff(np.concatenate(([0], flags, [0]))))
+    events = [(grid_start + (offset + start) * step, grid_start + (offset + end - 1) * step, int(end - start),
+               float(deviation[start:end].max()), float(health[start:end].min()))
+              for start, end in zip(changes[::2], changes[1::2])]
+    return events, snapshots
+
+
+def _filters(device, site, table_name, time_column, end_column, time_from, time_to):
+    conditions, params = [], {}
+    if device is not None:
+        conditions.append("device_code = :device")
+        params['device'] = device
+    if site is not None:
+        conditions.append("(site_name = :site OR site_code = :site)")
+        params['site'] = site
+    if table_name is not None:
+        conditions.append("table_name = :table_name")
+        params['table_name'] = table_name
+    if time_from is not None:
+        conditions.append(f"{end_column} >= CAST(:time_from AS TIMESTAMP)")
+        params['time_from'] = time_from
+    if time_to is not None:
+        conditions.append(f"{time_column} < CAST(:time_to AS TIMESTAMP)")
+        params['time_to'] = time_to
+    return conditions, params
+
+
+def query_events(device=None, site=None, table_name=None, time_from=None, time_to=None,
+                 limit=1000, after=None):
+    """
+    查询异常区间，按 (开始时间, 设备编号, 表名) 排序；同一设备可能出现在多个表格中，
+    加上表名排序键才唯一，翻页时不会跳过或重复行。时间范围按重叠判断：
+    结束不早于 time_from 且开始早于 time_to 的区间。
+    :param site: 隐患点名称或编号
+    :param after: 上一页最后一个区间的 (开始时间, 设备编号, 表名)，用于翻页
+    :return: [(EVENT_COLUMNS...)]
+    """
+    ensure_schema()
+    conditions, params = _filters(device, site, table_name, 'start_time', 'end_time', time_from, time_to)
+    if after is not None:
+        conditions.append("(start_time, device_code, table_name) > "
+                          "(CAST(:after_time AS TIMESTAMP), :after_device, :after_table)")
+        params.update({'after_time': after[0], 'after_device': after[1], 'after_table': after[2]})
+    params['limit'] = limit
+    return _execute(f"""
+        SELECT {', '.join(EVENT_COLUMNS)} FROM {SCHEMA}.anomaly_events
+        {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+        ORDER BY start_time, device_code, table_name LIMIT :limit
+    """, params)
+
+
+def query_health(device=None, site=None, table_name=None, time_from=None, time_to=None,
+                 limit=1000, after=None):
+    """
+    查询健康性快照，按 (时间, 设备编号, 表名) 排序。
+    :param after: 上一页最后一行的 (时间, 设备编号, 表名)
+    :return: [(table_name, device_code, site_name, site_code, time, health_score, min_health_score, anomaly_steps)]
+    """
+    ensure_schema()
+    conditions, params = _filters(device, site, table_name, 'time', 'time', time_from, time_to)
+    if after is not None:
+        conditions.append("(time, device_code, table_name) > "
+                          "(CAST(:after_time AS TIMESTAMP), :after_device, :after_table)")
+        params.update({'after_time': after[0], 'after_device': after[1], 'after_table': after[2]})
+    params['limit'] = limit
+    return _execute(f"""
+        SELECT table_name, device_code, site_name, site_code, time, health_score, min_health_score, anomaly_steps
+        FROM {SCHEMA}.health_snapshots
+        {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+        ORDER BY time, device_code, table_name LIMIT :limit
+    """, params)
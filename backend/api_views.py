@@ -1,24 +1,73 @@
-from flask import jsonify, request
+from flask import jsonify, request, current_app, Response, g
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room
 from config import Config
 from db import db
 from sqlalchemy import text
 import os
 import time
 import csv
-from db import check_table_exists, create_table_from_csv, insert_csv_data, get_all_databases, get_columns_of_table, get_table_data
+from db import get_all_databases, get_columns_of_table, get_column_types_of_table, get_table_data, get_table_data_keyset
+import columnar
+from downsample import downsample, device_statistics, VALUE_COLUMNS
 import logging
 from datetime import datetime
 from decimal import Decimal
 from flask import Blueprint
-from TimeSeriesForecaster import TimeSeriesForecaster
+from TimeSeriesForecaster import HealthScoreState
+from prediction_sessions import SessionRegistry, SharedSessionRegistry, SessionLimitError
+from prediction_input import iter_table_windows, window_starts, IndexedWindows, WindowPrefetcher, DEFAULT_STEP
+from forecast_cache import forecast_cache, forecast_key, forecast_window
+from frame_stream import FrameStreamer
+from ingest import ingest_csv_file, append_csv_file, ChunkedUploadStore, IngestQueue
+import measurements
+import anomaly_events
+from db import valid_table_name_of
+import metrics
 import numpy as np
 
+
+
+class InstrumentedSocketIO(SocketIO):
+    """ 统计服务端主动发送的 Socket.IO 消息数 """
+
+    def emit(self, event, *args, **kwargs):
+        metrics.socketio_emits_total.inc(event=event)
+        return super().emit(event, *args, **kwargs)
+
+
 api_blueprint = Blueprint('api', __name__)
-socketio = SocketIO(cors_allowed_origins="*")   # 初始化 SocketIO
+socketio = InstrumentedSocketIO(cors_allowed_origins="*")   # 初始化 SocketIO
 UPLOAD_FOLDER = './uploads'
+prediction_sessions = SessionRegistry()   # 正在运行的预测会话
+upload_store = ChunkedUploadStore(os.path.join(UPLOAD_FOLDER, '.chunks'))   # 分块上传暂存区
+ingest_queue = None   # 后台导入队列，首次使用时按配置创建
+metrics.prediction_sessions_active.set_function(lambda: len(prediction_sessions))
+metrics.socketio_queue_depth.set_function(lambda: prediction_sessions.pending_steps())
+
+
+def configure_cluster(app, cluster):
+    """
+    多进程部署：会话登记到各进程共享的状态表，预测任务由有空闲槽位的工作进程领取。
+    :param cluster: cluster.Cluster
+    """
+    global prediction_sessions
+    prediction_sessions = SharedSessionRegistry(cluster, app.config.get('MAX_PREDICTION_SESSIONS', 8))
+    socketio.start_background_task(_consume_prediction_jobs, app)
+
+
+def _consume_prediction_jobs(app):
+    while True:
+        running = len(prediction_sessions)
+        if running >= prediction_sessions.max_sessions:
+            socketio.sleep(0.1)
+            continue
+        # 运行会话较少的进程先领取，任务大致按负载分配到各进程
+        socketio.sleep(0.01 * running)
+        session = prediction_sessions.next_job(timeout=1.0)
+        if session is not None:
+            session.task = socketio.start_background_task(run_prediction, session, app)
 
 
 def delimiter_detect(file_path):
@@ -40,6 +89,44 @@ def custom_serializer(obj):
     else:
         return obj
 
+# 请求耗时统计与可选的采样分析
+
+
+@api_blueprint.before_app_request
+def _start_request_timer():
+    g.request_start = time.perf_counter()
+    if current_app.config.get('PROFILING_ENABLED') and request.args.get('profile') == '1':
+        g.profiler = metrics.SamplingProfiler().start()
+
+
+@api_blueprint.after_app_request
+def _record_request_metrics(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.http_request_seconds.observe(
+            time.perf_counter() - start, method=request.method, route=route,
+            status=response.status_code)
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profile_dir = current_app.config.get('PROFILE_DIR', './profiles')
+        os.makedirs(profile_dir, exist_ok=True)
+        profile_path = os.path.join(
+            profile_dir, f"{datetime.now():%Y%m%d_%H%M%S_%f}_{request.endpoint}.folded")
+        with open(profile_path, 'w', encoding='utf-8') as f:
+            f.write(profiler.stop().collapsed())
+        response.headers['X-Profile-File'] = profile_path
+        logging.info(f"Profile written to {profile_path}")
+    return response
+
+
+@api_blueprint.route('/metrics')
+def get_metrics():
+    """
+    本进程的指标。多进程部署时各工作进程的指标不合并，样本带有 worker 标签，需分别抓取各进程的端口。
+    """
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
 # test
 
 
@@ -80,26 +167,206 @@ def get_table_info(table_name):
         if columns is None:
             return jsonify({"code": 1, "message": "Error fetching columns."}), 200
 
-        # 获取表的数据（分页）
-        data = get_table_data(valid_table_name, start, end)
+        # 带有游标或筛选参数时使用键集分页，否则沿用 OFFSET 分页
+        keyset_args = ('after_device', 'after_time', 'device', 'time_from', 'time_to')
+        use_keyset = request.args.get('mode') == 'keyset' or any(
+            arg in request.args for arg in keyset_args)
+        if use_keyset:
+            limit = int(request.args.get('limit', end - start))
+            data = get_table_data_keyset(
+                valid_table_name, limit,
+                after_device=request.args.get('after_device'),
+                after_time=request.args.get('after_time'),
+                device=request.args.get('device'),
+                time_from=request.args.get('time_from'),
+                time_to=request.args.get('time_to'))
+        else:
+            # 获取表的数据（分页）
+            data = get_table_data(valid_table_name, start, end)
         if data is None:
             return jsonify({"code": 1, "message": "Error fetching data."}), 200
+        logging.info(f"table info: {valid_table_name} rows={len(data)}")
+
+        extra = {}
+        if use_keyset:
+            # 返回下一页的游标，最后一页时为 None
+            next_cursor = None
+            if data and len(data) == limit:
+                last_row = data[-1]
+                next_cursor = {
+                    "after_device": custom_serializer(last_row[columns.index('设备编号')]),
+                    "after_time": custom_serializer(last_row[columns.index('时间')])
+                }
+            extra["next"] = next_cursor
+
+        # 列式响应：每个字段一个数组，可协商二进制编码与压缩
+        if request.args.get('format') == 'columnar':
+            column_types = get_column_types_of_table(valid_table_name) or {}
+            body, mimetype = columnar.encode(
+                columnar.build_columns(columns, column_types, data),
+                request.accept_mimetypes, extra)
+            body, content_encoding = columnar.compress(body, request.accept_encodings)
+            response = Response(body, status=200, mimetype=mimetype)
+            response.headers['Vary'] = 'Accept, Accept-Encoding'
+            if content_encoding is not None:
+                response.headers['Content-Encoding'] = content_encoding
+            return response
 
         formatted_data = [tuple(custom_serializer(value)
                                 for value in row) for row in data]
 
-        logging.info(formatted_data)
-
-        return jsonify({
+        response = {
             "code": 0,
             "fieldNames": columns,
             "data": formatted_data  # 每行是一个元组
-        }), 200
+        }
+        response.update(extra)
+        return jsonify(response), 200
 
     except Exception as e:
         print(f"Error in get_database_info: {e}")
         return jsonify({"code": 1, "message": "Internal server error."}), 200
 
+# 服务端降采样，用于绘制长时间序列
+
+
+@api_blueprint.route('/api/database/<table_name>/downsample', methods=['GET'])
+def get_table_downsample(table_name):
+    logging.info(f"backend: downsample table: {table_name}")
+    device = request.args.get('device')
+    if not device:
+        return jsonify({"code": 1, "message": "缺少 device 参数"}), 200
+    method = request.args.get('method', 'bucket')
+    field = request.args.get('field', VALUE_COLUMNS[0])
+    if method not in ('bucket', 'lttb') or field not in VALUE_COLUMNS:
+        return jsonify({"code": 1, "message": "method 或 field 参数无效"}), 200
+    try:
+        valid_table_name = f"table_{table_name}".replace(
+            '.', '_').replace('-', '_')
+        result = downsample(
+            valid_table_name, device,
+            time_from=request.args.get('time_from'),
+            time_to=request.args.get('time_to'),
+            points=int(request.args.get('points', 2000)),
+            method=method, field=field)
+        return jsonify({"code": 0, **result}), 200
+    except Exception as e:
+        logging.error(f"Error in get_table_downsample: {e}")
+        return jsonify({"code": 1, "message": "Internal server error."}), 200
+
+# 每个设备的统计信息（分析型查询，启用嵌入式存储时在列式引擎中计算）
+
+
+@api_blueprint.route('/api/database/<table_name>/stats', methods=['GET'])
+def get_table_stats(table_name):
+    logging.info(f"backend: table stats: {table_name}")
+    try:
+        valid_table_name = f"table_{table_name}".replace(
+            '.', '_').replace('-', '_')
+        statistics = device_statistics(valid_table_name, request.args.get('device'))
+        return jsonify({"code": 0, "devices": statistics}), 200
+    except Exception as e:
+        logging.error(f"Error in get_table_stats: {e}")
+        return jsonify({"code": 1, "message": "Internal server error."}), 200
+
+# 跨上传文件查询某设备的历史数据（统一测量存储，按时间分区裁剪）
+
+
+@api_blueprint.route('/api/devices/<device_code>/history', methods=['GET'])
+def get_device_history(device_code):
+    logging.info(f"backend: device history: {device_code}")
+    if not measurements.enabled():
+        return jsonify({"code": 1, "message": "未启用统一测量存储"}), 200
+    try:
+        limit = min(int(request.args.get('limit', 1000)), 10000)
+        rows = measurements.device_history(
+            device_code,
+            time_from=request.args.get('time_from'),
+            time_to=request.args.get('time_to'),
+            limit=limit,
+            after_time=request.args.get('after_time'))
+        data = [{'时间': custom_serializer(row[0]), '采集值x': row[1], '采集值y': row[2],
+                 '采集值z': row[3], 'source': row[4][6:]} for row in rows]
+        response = {"code": 0, "device": device_code, "data": data}
+        if len(rows) == limit:
+            response['next'] = {'after_time': data[-1]['时间']}
+        return jsonify(response), 200
+    except Exception as e:
+        logging.error(f"Error in get_device_history: {e}")
+        return jsonify({"code": 1, "message": "Internal server error."}), 200
+
+def _event_query_args():
+    """
+    异常事件与健康性快照查询的公共参数：device、site（名称或编号）、table（不含 table_ 前缀）、
+    time_from / time_to、limit 以及翻页游标 after_time / after_device / after_table。
+    """
+    table = request.args.get('table')
+    after = None
+    if request.args.get('after_time') is not None:
+        after_table = request.args.get('after_table')
+        after = (request.args['after_time'], request.args.get('after_device', ''),
+                 valid_table_name_of(after_table) if after_table else '')
+    return {
+        'device': request.args.get('device'),
+        'site': request.args.get('site'),
+        'table_name': valid_table_name_of(table) if table else None,
+        'time_from': request.args.get('time_from'),
+        'time_to': request.args.get('time_to'),
+        'limit': min(int(request.args.get('limit', 1000)), 10000),
+        'after': after
+    }
+
+
+@api_blueprint.route('/api/anomaly_events', methods=['GET'])
+def get_anomaly_events():
+    """
+    查询导入时物化的异常区间，不重新计算。
+    """
+    logging.info("backend: anomaly events")
+    if not anomaly_events.enabled():
+        return jsonify({"code": 1, "message": "未启用异常事件"}), 200
+    try:
+        args = _event_query_args()
+        rows = anomaly_events.query_events(**args)
+        data = [{column: custom_serializer(value) for column, value in zip(anomaly_events.EVENT_COLUMNS, row)}
+                for row in rows]
+        for item in data:
+            item['table_name'] = item['table_name'][6:]
+        response = {"code": 0, "data": data}
+        if len(rows) == args['limit']:
+            response['next'] = {'after_time': data[-1]['start_time'], 'after_device': data[-1]['device_code'],
+                                'after_table': data[-1]['table_name']}
+        return jsonify(response), 200
+    except Exception as e:
+        logging.error(f"Error in get_anomaly_events: {e}")
+        return jsonify({"code": 1, "message": "Internal server error."}), 200
+
+
+@api_blueprint.route('/api/health_snapshots', methods=['GET'])
+def get_health_snapshots():
+    """
+    查询导入时物化的健康性快照（每个预测窗口一条），参数同 /api/anomaly_events。
+    """
+    logging.info("backend: health snapshots")
+    if not anomaly_events.enabled():
+        return jsonify({"code": 1, "message": "未启用异常事件"}), 200
+    try:
+        args = _event_query_args()
+        rows = anomaly_events.query_health(**args)
+        columns = ['table_name', 'device_code', 'site_name', 'site_code', 'time',
+                   'health_score', 'min_health_score', 'anomaly_steps']
+        data = [{column: custom_serializer(value) for column, value in zip(columns, row)} for row in rows]
+        for item in data:
+            item['table_name'] = item['table_name'][6:]
+        response = {"code": 0, "data": data}
+        if len(rows) == args['limit']:
+            response['next'] = {'after_time': data[-1]['time'], 'after_device': data[-1]['device_code'],
+                                'after_table': data[-1]['table_name']}
+        return jsonify(response), 200
+    except Exception as e:
+        logging.error(f"Error in get_health_snapshots: {e}")
+        return jsonify({"code": 1, "message": "Internal server error."}), 200
+
 # 接收csv并写入数据库
 
 
@@ -120,30 +387,119 @@ def upload_csv():
         file_path = os.path.join(UPLOAD_FOLDER, file.filename)
         file.save(file_path)
 
-        # 检查表格是否已存在
-        if check_table_exists(file_name):
-            logging.info(f"file_exists: {file_name} ")
-            return jsonify({'code': 1, 'message': f'表格 "{file_name}" 已存在'}), 200
-
-        # 读取 CSV 文件
-        with open(file_path, newline='', encoding='utf-8') as csvfile:
-            # delimiter = delimiter_detect(file_path)
-            # logging.info(delimiter)
-            csvreader = csv.reader(csvfile, delimiter='\t')
-            headers = next(csvreader)  # 第一行是特征标签
-            logging.info(headers)
-            rows = [tuple(row) for row in csvreader]
-            # 创建新表格
-            valid_table_name = f"table_{file_name}".replace(
-                '.', '_').replace('-', '_')
-            create_table_from_csv(valid_table_name, headers)
-            # 插入数据到新表格
-            insert_csv_data(valid_table_name, headers, rows)
-
-        return jsonify({'code': 0, 'message': '文件上传成功', 'file_path': file_path}), 200
+        # 数据提交后即返回，异常事件在后台计算，进度见 /api/ingest_jobs/<job_id> 的 anomaly_events
+        app = current_app._get_current_object()
+        jobs = []
+
+        def materialize(table_name, headers, time_from):
+            jobs.append(_get_ingest_queue().submit_materialize(app, table_name, headers, time_from))
+
+        # mode=append：表格已存在时追加并按 (设备编号, 时间) 去重合并，而不是拒绝
+        if request.form.get('mode', request.args.get('mode')) == 'append':
+            counts = append_csv_file(file_name, file_path, materialize=materialize)
+            return jsonify({'code': 0, 'message': '文件追加导入成功', 'file_path': file_path, **counts,
+                            'job_id': jobs[0]['job_id'] if jobs else None}), 200
+
+        try:
+            ingest_csv_file(file_name, file_path, materialize=materialize)
+        except FileExistsError as e:
+            return jsonify({'code': 1, 'message': str(e)}), 200
+
+        return jsonify({'code': 0, 'message': '文件上传成功', 'file_path': file_path,
+                        'job_id': jobs[0]['job_id'] if jobs else None}), 200
     except Exception as e:
         return jsonify({'code': 1, 'message': f'文件上传失败: {str(e)}'}), 200
 
+# 分块、可续传上传：init -> chunk（可重复/续传）-> complete（进入后台导入队列）
+
+
+def _get_ingest_queue():
+    global ingest_queue
+    if ingest_queue is None:
+        ingest_queue = IngestQueue(
+            lambda job: socketio.emit('ingest_progress', job, to=f"ingest_{job['job_id']}"),
+            max_workers=current_app.config.get('INGEST_WORKERS', 2))
+    return ingest_queue
+
+
+@api_blueprint.route('/api/upload/init', methods=['POST'])
+def upload_init():
+    params = request.get_json(silent=True) or request.form
+    filename = params.get('filename', '')
+    if not filename.endswith('.csv'):
+        return jsonify({'code': 1, 'message': '文件格式错误，只支持CSV'}), 200
+    try:
+        total_chunks = int(params.get('total_chunks', 0))
+    except (TypeError, ValueError):
+        total_chunks = 0
+    if total_chunks <= 0:
+        return jsonify({'code': 1, 'message': 'total_chunks 无效'}), 200
+    upload_id = upload_store.create(os.path.basename(filename), total_chunks)
+    logging.info(f"backend: upload init {filename} -> {upload_id}")
+    return jsonify({'code': 0, 'upload_id': upload_id}), 200
+
+
+@api_blueprint.route('/api/upload/<upload_id>/chunk', methods=['POST', 'PUT'])
+def upload_chunk(upload_id):
+    try:
+        index = int(request.args.get('index', request.form.get('index')))
+        checksum = request.headers.get('X-Chunk-Checksum') or request.form.get('checksum')
+        chunk = request.files.get('chunk')
+        data = chunk.read() if chunk is not None else request.get_data()
+        upload_store.save_chunk(upload_id, index, data, checksum)
+        return jsonify({'code': 0, 'index': index}), 200
+    except KeyError:
+        return jsonify({'code': 1, 'message': '上传不存在'}), 200
+    except (TypeError, ValueError) as e:
+        return jsonify({'code': 1, 'message': str(e)}), 200
+
+
+@api_blueprint.route('/api/upload/<upload_id>/status', methods=['GET'])
+def upload_status(upload_id):
+    try:
+        meta = upload_store.meta(upload_id)
+        return jsonify({'code': 0, 'total_chunks': meta['total_chunks'],
+                        'received': upload_store.received_chunks(upload_id)}), 200
+    except (KeyError, ValueError):
+        return jsonify({'code': 1, 'message': '上传不存在'}), 200
+
+
+@api_blueprint.route('/api/upload/<upload_id>/complete', methods=['POST'])
+def upload_complete(upload_id):
+    try:
+        meta = upload_store.meta(upload_id)
+        file_path = os.path.join(UPLOAD_FOLDER, meta['filename'])
+        params = request.get_json(silent=True) or request.form
+        mode = 'append' if params.get('mode') == 'append' else 'create'
+        upload_store.assemble(upload_id, file_path)
+        job = _get_ingest_queue().submit(
+            current_app._get_current_object(), meta['filename'][:-4], file_path, mode)
+        return jsonify({'code': 0, 'job_id': job['job_id'], 'file_path': file_path}), 200
+    except (KeyError, ValueError) as e:
+        return jsonify({'code': 1, 'message': f'上传未完成: {e}'}), 200
+    except OSError as e:
+        logging.error(f"Assembling upload <{upload_id}> failed: {e}")
+        return jsonify({'code': 1, 'message': f'文件保存失败: {e}'}), 200
+
+
+@api_blueprint.route('/api/ingest_jobs/<job_id>', methods=['GET'])
+def get_ingest_job(job_id):
+    job = ingest_queue.get(job_id) if ingest_queue is not None else None
+    if job is None:
+        return jsonify({'code': 1, 'message': '任务不存在'}), 200
+    return jsonify({'code': 0, **job}), 200
+
+
+@socketio.on('watch_ingest')
+def handle_watch_ingest(data=None):
+    """ 订阅某个导入任务的进度事件 ingest_progress """
+    job_id = (data or {}).get('job_id')
+    if job_id:
+        join_room(f"ingest_{job_id}")
+        job = ingest_queue.get(job_id) if ingest_queue is not None else None
+        if job is not None:
+            emit('ingest_progress', dict(job))
+
 
 @socketio.on('connect')
 def handle_connect():
@@ -152,69 +508,221 @@ def handle_connect():
     emit('connected', {'message': 'Connection established'})
 
 
+@socketio.on('disconnect')
+def handle_disconnect(*args):
+    """ WebSocket 断开时停止该客户端的全部预测会话 """
+    stopped = prediction_sessions.stop_owner(request.sid)
+    logging.info(f"Client disconnected, {stopped} prediction session(s) stopped.")
+
+
 @socketio.on('start_prediction')
-def handle_start_prediction(data):
+def handle_start_prediction(data=None):
     """
-    处理前端请求，执行预测并通过 socket 发送结果
+    处理前端请求，在后台任务中执行预测，结果发送到该会话的房间
     输入:
-    - data: 前端发送的数据，未使用
+    - data: 前端发送的数据，可选字段：
+        table: 数据表名（不含 table_ 前缀），缺省时使用随机数据
+        device_ids: 设备编号列表，每个设备作为一个通道 C
+        time_from / time_to: 时间范围
+        step: 重采样步长（秒），默认 600
+        T / T_prime: 历史窗口和预测步长
+        bound_beta: 上下界的标准差倍数 β，默认 0.5
+        dtype: 计算精度 "float32" 或 "float64"，默认取配置 FORECAST_DTYPE
+        step_interval: 相邻时间步的发送间隔（秒），默认 0.5
+        stream_mode: 为 "frames" 时按帧合并发送 inference_frame（float32 二进制附件）
+        frame_rate / max_pending_steps: 帧模式下的帧率与最大合并步数
+    """
+    max_sessions = current_app.config.get('MAX_PREDICTION_SESSIONS', 8)
+    try:
+        session = prediction_sessions.create(request.sid, data or {}, max_sessions)
+    except SessionLimitError as e:
+        emit('prediction_error', {'message': str(e)})
+        return
+    join_room(session.room)
+    emit('prediction_started', {'session_id': session.session_id})
+    if isinstance(prediction_sessions, SharedSessionRegistry):
+        # 多进程部署时由任一空闲的工作进程运行，结果经消息队列发送到本进程连接的客户端
+        prediction_sessions.submit(session)
+        return
+    session.task = socketio.start_background_task(
+        run_prediction, session, current_app._get_current_object())
+
+
+def _control_session(data, action):
+    """
+    对当前客户端的会话执行停止/暂停/恢复。未指定 session_id 时作用于该客户端的全部会话。
+    """
+    session_id = (data or {}).get('session_id')
+    if session_id is None:
+        sessions = prediction_sessions.sessions_of(request.sid)
+    else:
+        session = prediction_sessions.get(session_id)
+        sessions = [session] if session is not None and session.owner_sid == request.sid else []
+    for session in sessions:
+        getattr(session, action)()
+    return [session.session_id for session in sessions]
+
+
+@socketio.on('stop_prediction')
+def handle_stop_prediction(data=None):
+    session_ids = _control_session(data, 'stop')
+    emit('prediction_stopped', {'session_ids': session_ids})
+
+
+@socketio.on('pause_prediction')
+def handle_pause_prediction(data=None):
+    session_ids = _control_session(data, 'pause')
+    emit('prediction_paused', {'session_ids': session_ids})
+
+
+@socketio.on('resume_prediction')
+def handle_resume_prediction(data=None):
+    session_ids = _control_session(data, 'resume')
+    emit('prediction_resumed', {'session_ids': session_ids})
+
+
+def run_prediction(session, app):
+    """
+    预测会话的后台任务：滑动窗口预测并逐步发送结果，可被停止或暂停。
+    :param session: PredictionSession
+    :param app: Flask 应用，用于在后台任务中访问数据库
     """
-    logging.info("Prediction started.")
+    logging.info(f"Prediction <{session.session_id}> started.")
+    try:
+        with app.app_context():
+            if not session.stopped:
+                _run_prediction_windows(session, app)
+    except Exception as e:
+        logging.error(f"Prediction <{session.session_id}> failed: {e}")
+        socketio.emit('prediction_error', {
+            'session_id': session.session_id, 'message': str(e)}, to=session.room)
+    finally:
+        # 多进程部署时 stopped 读自共享状态表，须在 remove 删除登记之前读取
+        stopped = session.stopped
+        prediction_sessions.remove(session.session_id)
+        socketio.emit('prediction_finished', {
+            'session_id': session.session_id, 'stopped': stopped}, to=session.room)
+        socketio.close_room(session.room)
+        logging.info(f"Prediction <{session.session_id}> finished.")
+
+
+def _prediction_results(session, app, T, T_prime):
+    """
+    逐个窗口产生 ForecastResult。指定了数据表时按 (表, 设备, 数据流起点, 窗口起点, T, T', β, 精度) 查缓存，
+    未命中才从数据库流式读取窗口（带预取）并计算，多个会话观看同一数据流时共享同一份计算；
+    否则使用随机数据。
+    :return: (结果生成器, 需要关闭的窗口源或 None)
+    """
+    params = session.params
+    β = float(params.get('bound_beta', 0.5))
+    dtype = params.get('dtype', app.config.get('FORECAST_DTYPE', 'float64'))
+    if dtype not in ('float32', 'float64'):
+        raise ValueError(f"不支持的计算精度: {dtype}")
+    dtype = np.dtype(dtype)
+    if params.get('table'):
+        valid_table_name = f"table_{params['table']}".replace(
+            '.', '_').replace('-', '_')
+        device_ids = [str(device_id) for device_id in params.get('device_ids', [])]
+        if not device_ids:
+            raise ValueError("device_ids 不能为空")
+        step = int(params.get('step', DEFAULT_STEP))
+        time_from, time_to = params.get('time_from'), params.get('time_to')
+        starts = window_starts(valid_table_name, device_ids, T, T_prime, time_from, time_to, step)
+        windows = IndexedWindows(lambda: WindowPrefetcher(iter_table_windows(
+            valid_table_name, device_ids, T, T_prime,
+            time_from=time_from, time_to=time_to, step=step, dtype=dtype), app))
+
+        def results():
+            for index, window_start in enumerate(starts):
+                key = forecast_key(valid_table_name, device_ids, step, starts[0], window_start,
+                                   T, T_prime, β, dtype)
+                yield forecast_cache.get_or_compute(
+                    key, lambda: forecast_window(windows.get(index), T, T_prime, β, dtype))
+        return results(), windows
+
     # 调用模型
     # data = 模型返回
     M, C, V = 30, 5, 3  # 设定数据集大小
     data = np.random.rand(M, C, V)  # 生成随机数据
+    return (forecast_window(data[i:i + T + T_prime], T, T_prime, β, dtype)
+            for i in range(0, M - T - T_prime + 1, T_prime)), None
 
-    T, T_prime = 5, 3  # 设置历史窗口和预测步长
-    current_index = 0  # 滑动窗口起始索引
-
-    first_forecaster = TimeSeriesForecaster(
-        data[current_index:current_index + T + T_prime], T, T_prime)
-    history_weighted = first_forecaster.history_weighted()
-    weighted_result, lower_bound, upper_bound = first_forecaster.forward()
-
-    # 发送历史加权值 + 第一轮预测数据
-    socketio.emit('inference_result', {
-        'history_weighted': history_weighted.tolist()
-    })
-    time.sleep(0.5)
-    # socketio.emit('inference_result', {
-    #     'predicted_weighted': weighted_result.tolist(),
-    #     'lower_bound': lower_bound.tolist(),
-    #     'upper_bound': upper_bound.tolist()
-    # })
-    # logging.info(f"Predicted: {type(weighted_result)}")
-    health_score = [100 for _ in range(T_prime)]
-    for t in range(T_prime):
-        socketio.emit('inference_result', {
-            'predicted_weighted': [weighted_result[t].tolist()],
-            'lower_bound': [lower_bound[t].tolist()],
-            'upper_bound': [upper_bound[t].tolist()],
-            'health_score': [health_score[t]]
-        })
-        # logging.info(f"Predicted: {type(weighted_result[t])}")
-        time.sleep(0.5)
-
-    current_index += T_prime  # 向右移动预测步长
-
-    while current_index + T + T_prime <= M:
-        forecaster = TimeSeriesForecaster(
-            data[current_index:current_index + T + T_prime], T, T_prime)
-        weighted_result, lower_bound, upper_bound = forecaster.forward()
-        anomalies = forecaster.detect_anomalies(
-            weighted_result, lower_bound, upper_bound)
-        health_score = forecaster.compute_health_score(anomalies)
 
-        for t in range(T_prime):
+def _run_prediction_windows(session, app):
+    T = int(session.params.get('T', 5))  # 设置历史窗口和预测步长
+    T_prime = int(session.params.get('T_prime', 3))
+    results, windows = _prediction_results(session, app, T, T_prime)
+    try:
+        _score_windows(session, results, T_prime)
+    finally:
+        if windows is not None:
+            windows.close()
+
+
+def _frame_streamer(session):
+    """
+    帧模式下创建 FrameStreamer，帧发送给发起会话的客户端并等待其确认。
+    """
+    params = session.params
+    if params.get('stream_mode') != 'frames':
+        return None
+
+    def emit_frame(frame, callback):
+        frame['session_id'] = session.session_id
+        socketio.emit('inference_frame', frame, to=session.owner_sid, callback=callback)
+
+    return FrameStreamer(emit_frame,
+                         frame_rate=float(params.get('frame_rate', 2)),
+                         max_pending_steps=int(params.get('max_pending_steps', 256)))
+
+
+def _score_windows(session, results, T_prime):
+    streamer = _frame_streamer(session)
+    session.streamer = streamer
+    step_interval = float(session.params.get('step_interval', 0.5))
+    if streamer is None:
+        wait = lambda seconds: session.wait(seconds, socketio.sleep)
+    else:
+        tick = min(0.1, streamer.frame_interval)
+        wait = lambda seconds: session.wait(seconds, socketio.sleep, tick, streamer.poll)
+
+    try:
+        _score_window_steps(session, results, T_prime, streamer, step_interval, wait)
+    finally:
+        if streamer is not None:
+            streamer.poll(force=True)
+
+
+def _score_window_steps(session, results, T_prime, streamer, step_interval, wait):
+    # 健康性评分状态在各窗口之间延续，而不是每个窗口从 100 重新开始
+    health_state = HealthScoreState()
+    step = 0
+    for index, result in enumerate(results):
+        if index == 0:
+            # 发送历史加权值
             socketio.emit('inference_result', {
-                'predicted_weighted': [weighted_result[t].tolist()],
-                'lower_bound': [lower_bound[t].tolist()],
-                'upper_bound': [upper_bound[t].tolist()],
-                'health_score': [health_score[t]]
-            })
-            time.sleep(0.5)
+                'history_weighted': result.history_weighted.tolist()
+            }, to=session.room)
+            if not wait(0.5):
+                return
+        else:
+            if not wait(1):
+                return
 
-        time.sleep(1)
-        current_index += T_prime
+        _, weighted_result, lower_bound, upper_bound, is_anomaly = result
+        health_score = health_state.update_batch(is_anomaly)
 
-    logging.info("Prediction finished.")
+        for t in range(T_prime):
+            if streamer is not None:
+                streamer.push(step, weighted_result[t], lower_bound[t],
+                              upper_bound[t], health_score[t])
+            else:
+                socketio.emit('inference_result', {
+                    'predicted_weighted': [weighted_result[t].tolist()],
+                    'lower_bound': [lower_bound[t].tolist()],
+                    'upper_bound': [upper_bound[t].tolist()],
+                    'health_score': [health_score[t]]
+                }, to=session.room)
+            step += 1
+            if not wait(step_interval):
+                return
@@ -1,16 +1,21 @@
+import argparse
 from flask import Flask
 from flask_cors import CORS
 from config import Config
-from db import db
+from db import db, metadata_cache, configure_storage
 import os
 import logging
 from logging.handlers import RotatingFileHandler
-from api_views import api_blueprint, socketio
+from api_views import api_blueprint, socketio, configure_cluster
+from metrics import instrument_sqlalchemy, registry as metrics_registry
+from forecast_cache import forecast_cache
+from cluster import attach, run as run_cluster
+import anomaly_events
 
 UPLOAD_FOLDER = './uploads'
 
 # 日志配置函数
-def setup_logging():
+def setup_logging(log_file='app.log'):
     # 创建日志记录器
     logger = logging.getLogger()
     logger.setLevel(logging.INFO)  # 设置日志级别
@@ -18,7 +23,7 @@ def setup_logging():
     formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
     # 文件日志处理器
     file_handler = RotatingFileHandler(
-        'app.log', maxBytes=10*1024*1024, backupCount=5, encoding='utf-8'
+        log_file, maxBytes=10*1024*1024, backupCount=5, encoding='utf-8'
     )
     file_handler.setLevel(logging.INFO)
     file_handler.setFormatter(formatter)
@@ -30,14 +35,66 @@ def setup_logging():
     logger.addHandler(file_handler)
     logger.addHandler(console_handler)
 
-setup_logging()
-app = Flask(__name__)
-app.config.from_object(Config)
-CORS(app)   # 启用CORS处理跨域
-db.init_app(app)
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-socketio.init_app(app)
-app.register_blueprint(api_blueprint)
-app.logger.setLevel(logging.DEBUG)
-# app.run(host="0.0.0.0", port=5000, debug=True)
-socketio.run(app, host="0.0.0.0", port=5000, debug=True)
+
+def create_app(cluster=None):
+    """
+    创建 Flask 应用。
+    :param cluster: 多进程部署时当前工作进程的 cluster.Cluster，单进程运行时为 None
+    """
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    if app.config['STORAGE_BACKEND'] == 'embedded':
+        # 嵌入式模式不连接 PostgreSQL，SQLAlchemy 只使用内存 SQLite 占位
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    CORS(app)   # 启用CORS处理跨域
+    db.init_app(app)
+    metadata_cache.configure(maxsize=app.config['METADATA_CACHE_SIZE'],
+                             ttl=app.config['METADATA_CACHE_TTL'])
+    forecast_cache.configure(maxsize=app.config['FORECAST_CACHE_SIZE'],
+                             max_bytes=app.config['FORECAST_CACHE_BYTES'])
+    configure_storage(app.config)
+    anomaly_events.configure(app.config)
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    message_queue = app.config['SOCKETIO_MESSAGE_QUEUE']
+    if cluster is None:
+        socketio.init_app(app, **({'message_queue': message_queue} if message_queue else {}))
+    else:
+        socketio.init_app(app, **cluster.socketio_options(message_queue))
+        attach(cluster)
+        configure_cluster(app, cluster)
+        # 指标只统计本进程，以 worker 标签区分各进程
+        metrics_registry.set_const_labels(worker=cluster.index)
+    app.register_blueprint(api_blueprint)
+    app.logger.setLevel(logging.DEBUG)
+    return app
+
+
+def run_worker(cluster, host, port):
+    """
+    多进程部署中一个工作进程的入口，各进程写入单独的日志文件。
+    """
+    logging.getLogger().handlers.clear()   # 以 fork 启动时会继承启动进程的日志处理器
+    setup_logging(f'app.{cluster.index}.log')
+    instrument_sqlalchemy()
+    app = create_app(cluster)
+    socketio.run(app, host=host, port=port, allow_unsafe_werkzeug=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='HNU-SPS 后端')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000, help='多进程时为第一个工作进程的端口')
+    parser.add_argument('--workers', type=int, default=Config.WORKERS, help='工作进程数')
+    args = parser.parse_args()
+    if args.workers > 1:
+        # 嵌入式存储的 DuckDB 文件只能由一个进程写入
+        if Config.STORAGE_BACKEND != 'postgresql':
+            parser.error('多进程部署需要 STORAGE_BACKEND = postgresql')
+        setup_logging()
+        run_cluster(run_worker, args.workers, args.host, args.port)
+    else:
+        setup_logging()
+        instrument_sqlalchemy()
+        app = create_app()
+        # app.run(host="0.0.0.0", port=5000, debug=True)
+        socketio.run(app, host=args.host, port=args.port, debug=True)
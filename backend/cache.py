@@ -0,0 +1,87 @@
+# cache.py
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, maxsize=1024, ttl=60, clock=time.monotonic):
+        """
+        进程内缓存：条目超过 ttl 秒后失效，条目数超过 maxsize 时淘汰最久未使用的条目。
+        :param maxsize: 最大条目数
+        :param ttl: 过期时间（秒），None 表示不过期
+        :param clock: 时钟函数
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._data = OrderedDict()     # key -> (过期时刻, value)
+        self._lock = threading.RLock()
+
+    def configure(self, maxsize=None, ttl=None):
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize = maxsize
+            if ttl is not None:
+                self.ttl = ttl
+            self._evict()
+
+    def _evict(self):
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            expires_at, value = item
+            if expires_at is not None and expires_at <= self.clock():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            expires_at = None if self.ttl is None else self.clock() + self.ttl
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            self._evict()
+
+    def get_or_set(self, key, factory):
+        """
+        命中时返回缓存值，否则调用 factory 计算；factory 返回 None 时不缓存。
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        value = factory()
+        if value is not None:
+            self.set(key, value)
+        return value
+
+    def pop(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+            return None if item is None else item[1]
+
+    def invalidate(self, predicate):
+        """
+        删除所有满足 predicate(key) 的条目，返回删除的条目数。
+        """
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                del self._data[key]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
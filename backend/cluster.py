@@ -0,0 +1,155 @@
+# cluster.py
+"""
+多进程部署：启动进程创建共享状态，再启动若干工作进程，分别监听 port, port+1, ...，
+前端经启用粘性会话的反向代理（如 nginx ip_hash）连接到各工作进程。
+- Socket.IO 消息经消息队列在工作进程之间转发：配置了 SOCKETIO_MESSAGE_QUEUE（如 redis://）时
+  使用外部消息队列，否则使用基于 multiprocessing 的内存队列。任一进程发往房间或 sid 的消息
+  都能到达连接在其他进程上的客户端；
+- 预测任务放入共享队列，由有空闲槽位的工作进程领取（见 prediction_sessions.SharedSessionRegistry）；
+- broadcast 在每个工作进程中执行同一函数，用于数据变化后使各进程的缓存失效。
+"""
+import copy
+import logging
+import multiprocessing
+import multiprocessing.connection
+import threading
+from socketio import PubSubManager
+
+
+class QueueManager(PubSubManager):
+    """
+    Socket.IO 客户端管理器的进程间内存实现：每个工作进程一个收件队列，
+    发布的消息放入其他进程的队列。只适用于同一台机器上由 run 启动的工作进程。
+    """
+    name = 'multiprocessing'
+
+    def __init__(self, inboxes, index, channel='flask-socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.inboxes = inboxes
+        self.index = index
+
+    def _publish(self, data):
+        for i, inbox in enumerate(self.inboxes):
+            if i != self.index:
+                inbox.put(data)
+
+    def _listen(self):
+        inbox = self.inboxes[self.index]
+        while True:
+            yield inbox.get()
+
+
+class Cluster:
+    def __init__(self, manager, workers):
+        """
+        工作进程之间共享的状态，由启动进程创建后传给各工作进程。
+        :param manager: multiprocessing.Manager()
+        :param workers: 工作进程数
+        """
+        self.workers = workers
+        self.index = None                   # 当前工作进程的序号，启动进程中为 None
+        self.jobs = manager.Queue()         # 等待运行的预测任务
+        self.sessions = manager.dict()      # session_id -> (owner_sid, 状态, 客户端所在进程, 运行会话的进程)
+        self.lock = manager.Lock()
+        self.socketio_inboxes = [manager.Queue() for _ in range(workers)]
+        self.broadcast_inboxes = [manager.Queue() for _ in range(workers)]
+
+    def worker(self, index):
+        cluster = copy.copy(self)
+        cluster.index = index
+        return cluster
+
+    def socketio_options(self, message_queue=None):
+        """
+        SocketIO.init_app 的消息队列参数：优先使用外部消息队列，否则使用进程间内存队列。
+        """
+        if message_queue:
+            return {'message_queue': message_queue}
+        return {'client_manager': QueueManager(self.socketio_inboxes, self.index)}
+
+
+_current = None   # 当前工作进程的 Cluster，单进程运行时为 None
+
+
+def attach(cluster):
+    """
+    在工作进程中登记 cluster，并开始执行其他进程广播的函数。
+    """
+    global _current
+    _current = cluster
+    threading.Thread(target=_listen_broadcasts, args=(cluster,), daemon=True,
+                     name='cluster-broadcast').start()
+
+
+def current():
+    return _current
+
+
+def _listen_broadcasts(cluster):
+    inbox = cluster.broadcast_inboxes[cluster.index]
+    while True:
+        func, args = inbox.get()
+        try:
+            func(*args)
+        except Exception as e:
+            logging.error(f"Broadcast {func.__name__} failed: {e}")
+
+
+def broadcast(func, *args):
+    """
+    在本进程执行 func(*args)，多进程部署时也在其他每个工作进程中执行。
+    func 须为模块级函数，参数须可序列化。
+    """
+    result = func(*args)
+    if _current is not None:
+        for i, inbox in enumerate(_current.broadcast_inboxes):
+            if i != _current.index:
+                inbox.put((func, args))
+    return result
+
+
+def release_worker(cluster, index):
+    """
+    工作进程退出后清理它留在共享状态表中的会话：在该进程中运行的会话直接删除，不再占用会话数上限；
+    客户端连接在该进程上的会话标记为停止，由运行它的进程（或领取到排队任务的进程）结束并删除。
+    """
+    with cluster.lock:
+        for session_id, entry in cluster.sessions.items():
+            owner_sid, state, owner_worker, worker = entry
+            if worker == index:
+                cluster.sessions.pop(session_id, None)
+            elif owner_worker == index and state != 'stopped':
+                cluster.sessions[session_id] = (owner_sid, 'stopped', owner_worker, worker)
+
+
+def run(target, workers, host='0.0.0.0', port=5001):
+    """
+    启动 workers 个工作进程并等待其退出，第 i 个进程监听 port + i。
+    工作进程异常退出时，其会话由 release_worker 清理。
+    :param target: 工作进程入口 target(cluster, host, port)，须为模块级函数
+    """
+    with multiprocessing.Manager() as manager:
+        cluster = Cluster(manager, workers)
+        processes = [
+            multiprocessing.Process(target=target, args=(cluster.worker(i), host, port + i),
+                                    name=f"sps-worker-{i}")
+            for i in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        logging.info(f"Started {workers} workers on ports {port}-{port + workers - 1}.")
+        try:
+            pending = {process.sentinel: i for i, process in enumerate(processes)}
+            while pending:
+                for sentinel in multiprocessing.connection.wait(list(pending)):
+                    index = pending.pop(sentinel)
+                    processes[index].join()
+                    logging.warning(f"Worker {index} exited with code {processes[index].exitcode}.")
+                    release_worker(cluster, index)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+                process.join()
@@ -0,0 +1,179 @@
+# columnar.py
+import gzip
+import io
+import json
+from datetime import date, datetime
+from decimal import Decimal
+import numpy as np
+import pandas as pd
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPE = 'application/msgpack'
+ARROW_MIMETYPE = 'application/vnd.apache.arrow.stream'
+MIN_COMPRESS_SIZE = 1024    # 小于该字节数的响应不压缩
+
+
+def column_kind(data_type):
+    """
+    将 information_schema 中的 data_type 归为 timestamp / numeric / text。
+    """
+    data_type = (data_type or '').lower()
+    if data_type.startswith('timestamp') or data_type == 'date':
+        return 'timestamp'
+    if data_type.startswith(('numeric', 'decimal')) or data_type in (
+            'double precision', 'double', 'real', 'float', 'integer', 'bigint', 'smallint'):
+        return 'numeric'
+    return 'text'
+
+
+def infer_kind(series):
+    """
+    字段类型未知时（如元数据查询失败）按查询结果中的取值归类，与 column_kind 的结果一致。
+    """
+    values = series.dropna()
+    if values.empty:
+        return 'text'
+    if values.map(lambda value: isinstance(value, (datetime, date))).all():
+        return 'timestamp'
+    if values.map(lambda value: isinstance(value, (int, float, Decimal, np.number))
+                  and not isinstance(value, bool)).all():
+        return 'numeric'
+    return 'text'
+
+
+def _to_text(value):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return str(value)
+
+
+def build_columns(columns, column_types, rows):
+    """
+    将行数据整体转换为列式数据，按列批量转换而不是逐个值处理。
+    时间转换为 epoch 毫秒（无时区的时间按 UTC 解释），数值转换为 float。
+    :param columns: 字段名列表
+    :param column_types: {字段名: data_type}；缺少某个字段时按取值推断（见 infer_kind），
+                         归为文本的值逐个转换为字符串，Decimal、时间等值也能编码
+    :param rows: 查询结果行
+    :return: [(字段名, 类型, 值数组, 空值掩码)]
+    """
+    frame = pd.DataFrame.from_records(list(rows), columns=columns)
+    result = []
+    for name in columns:
+        series = frame[name]
+        data_type = column_types.get(name)
+        kind = column_kind(data_type) if data_type else infer_kind(series)
+        if kind == 'text' and not data_type:
+            series = series.map(_to_text)
+        if kind == 'timestamp':
+            times = pd.to_datetime(series, errors='coerce', utc=True)
+            mask = times.isna().to_numpy()
+            values = times.dt.tz_convert(None).to_numpy().astype('datetime64[ms]').astype(np.int64)
+        elif kind == 'numeric':
+            values = pd.to_numeric(series, errors='coerce').to_numpy(dtype=np.float64)
+            mask = np.isnan(values)
+        else:
+            mask = series.isna().to_numpy()
+            values = series.to_numpy(dtype=object)
+        result.append((name, kind, values, mask))
+    return result
+
+
+def _to_list(values, mask):
+    values = values.astype(object)
+    values[mask] = None
+    return values.tolist()
+
+
+def to_payload(columnar, extra=None):
+    """
+    列式数据的 JSON / MessagePack 结构：每个字段一个数组。
+    :param extra: 附加到响应中的其它字段（如分页游标）
+    """
+    payload = {
+        "code": 0,
+        "format": "columnar",
+        "fieldNames": [name for name, _, _, _ in columnar],
+        "types": [kind for _, kind, _, _ in columnar],
+        "columns": [_to_list(values, mask) for _, _, values, mask in columnar]
+    }
+    payload.update(extra or {})
+    return payload
+
+
+def _to_arrow(columnar, extra=None):
+    arrays = []
+    for _, kind, values, mask in columnar:
+        if kind == 'timestamp':
+            arrays.append(pa.array(values, type=pa.int64(), mask=mask))
+        elif kind == 'numeric':
+            arrays.append(pa.array(values, type=pa.float64(), mask=mask))
+        else:
+            arrays.append(pa.array(_to_list(values, mask), type=pa.string()))
+    batch = pa.RecordBatch.from_arrays(arrays, names=[name for name, _, _, _ in columnar])
+    # 附加字段以 JSON 形式写入 schema 元数据
+    batch = batch.replace_schema_metadata(
+        {key: json.dumps(value, ensure_ascii=False) for key, value in (extra or {}).items()})
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, batch.schema) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue()
+
+
+def available_mimetypes():
+    mimetypes = [JSON_MIMETYPE]
+    if msgpack is not None:
+        mimetypes.append(MSGPACK_MIMETYPE)
+    if pa is not None:
+        mimetypes.append(ARROW_MIMETYPE)
+    return mimetypes
+
+
+def encode(columnar, accept_mimetypes, extra=None):
+    """
+    按 Accept 头选择编码，所需的库未安装时回退到 JSON。
+    :param accept_mimetypes: werkzeug 的 request.accept_mimetypes
+    :param extra: 附加字段
+    :return: (字节串, mimetype)
+    """
+    mimetype = accept_mimetypes.best_match(available_mimetypes(), default=JSON_MIMETYPE)
+    if mimetype == ARROW_MIMETYPE:
+        return _to_arrow(columnar, extra), mimetype
+    if mimetype == MSGPACK_MIMETYPE:
+        return msgpack.packb(to_payload(columnar, extra)), mimetype
+    body = json.dumps(to_payload(columnar, extra), ensure_ascii=False, separators=(',', ':'))
+    return body.encode('utf-8'), JSON_MIMETYPE
+
+
+def compress(body, accept_encodings):
+    """
+    按 Accept-Encoding 选择 br 或 gzip 压缩。
+    :param accept_encodings: werkzeug 的 request.accept_encodings
+    :return: (字节串, Content-Encoding 或 None)
+    """
+    if len(body) < MIN_COMPRESS_SIZE:
+        return body, None
+    encodings = ['gzip'] if brotli is None else ['br', 'gzip']
+    encoding = accept_encodings.best_match(encodings)
+    if encoding == 'br':
+        return brotli.compress(body), 'br'
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=6), 'gzip'
+    return body, None
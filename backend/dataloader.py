@@ -1,33 +1,190 @@
+import hashlib
+import json
+import os
+import shutil
 import pandas as pd
 import numpy as np
 
+COLUMNS = ['设备编号', '时间', '采集值x', '采集值y', '采集值z']
+VALUE_COLUMNS = ['采集值x', '采集值y', '采集值z']
+
+
+def file_hash(file_path, block_size=1 << 20):
+    """
+    计算文件内容的哈希值，作为列式缓存的键。
+    """
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ColumnarCache:
+    def __init__(self, cache_path):
+        """
+        CSV 文件的列式磁盘缓存：每个设备一对按时间排序的 .npy 文件
+        （时间 datetime64[ns]，UTC；采集值 (n, 3) float64 或 float32），以内存映射方式读取。
+        :param cache_path: 缓存目录
+        """
+        self.cache_path = cache_path
+        with open(os.path.join(cache_path, 'index.json'), encoding='utf-8') as f:
+            self.index = json.load(f)   # 设备编号 -> {"file": 文件前缀, "rows": 行数}
+
+    @classmethod
+    def open_or_build(cls, file_path, cache_dir, sep=',', chunksize=100000, dtype=np.float64):
+        """
+        按文件哈希打开缓存，第一次遇到该文件时分块读取 CSV 并建立缓存。
+        :param file_path: CSV 文件路径
+        :param cache_dir: 缓存根目录
+        :param sep: CSV 分隔符
+        :param chunksize: 建立缓存时每次读取的行数
+        :param dtype: 采集值的保存精度，np.float32 时磁盘和内存占用减半
+        """
+        key = f"{file_hash(file_path)}:{sep}"
+        if np.dtype(dtype) != np.float64:
+            key += f":{np.dtype(dtype).name}"
+        cache_path = os.path.join(cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest())
+        if not os.path.exists(os.path.join(cache_path, 'index.json')):
+            cls.build(file_path, cache_path, sep, chunksize, dtype)
+        return cls(cache_path)
+
+    @staticmethod
+    def build(file_path, cache_path, sep=',', chunksize=100000, dtype=np.float64):
+        """
+        分块读取 CSV，按设备追加写入临时二进制文件，最后对每个设备按时间排序并保存为 .npy。
+        峰值内存取决于 chunksize 和单个设备的数据量。
+        """
+        tmp_path = f"{cache_path}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        index = {}
+        reader = pd.read_csv(file_path, sep=sep, usecols=COLUMNS,
+                             dtype={'设备编号': str}, chunksize=chunksize)
+        for chunk in reader:
+            chunk['时间'] = pd.to_datetime(chunk['时间'], errors='coerce', utc=True)
+            chunk = chunk.dropna()
+            for device, group in chunk.groupby('设备编号', sort=False):
+                entry = index.setdefault(device, {'file': str(len(index)), 'rows': 0})
+                prefix = os.path.join(tmp_path, entry['file'])
+                times = group['时间'].dt.tz_convert(None).to_numpy().astype('datetime64[ns]')
+                values = group[VALUE_COLUMNS].to_numpy(dtype=dtype)
+                with open(f"{prefix}_time.bin", 'ab') as f:
+                    times.view(np.int64).tofile(f)
+                with open(f"{prefix}_values.bin", 'ab') as f:
+                    values.tofile(f)
+                entry['rows'] += len(group)
+
+        for entry in index.values():
+            prefix = os.path.join(tmp_path, entry['file'])
+            times = np.fromfile(f"{prefix}_time.bin", dtype=np.int64).view('datetime64[ns]')
+            values = np.fromfile(f"{prefix}_values.bin", dtype=dtype).reshape(-1, len(VALUE_COLUMNS))
+            order = np.argsort(times, kind='stable')
+            np.save(f"{prefix}_time.npy", times[order])
+            np.save(f"{prefix}_values.npy", values[order])
+            os.remove(f"{prefix}_time.bin")
+            os.remove(f"{prefix}_values.bin")
+
+        with open(os.path.join(tmp_path, 'index.json'), 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False)
+        if os.path.exists(cache_path):
+            shutil.rmtree(cache_path)
+        os.replace(tmp_path, cache_path)
+
+    def devices(self):
+        return sorted(self.index)
+
+    def load(self, device):
+        """
+        以内存映射方式读取某个设备的数据。
+        :return: (时间 (n,), 采集值 (n, 3))
+        """
+        prefix = os.path.join(self.cache_path, self.index[device]['file'])
+        times = np.load(f"{prefix}_time.npy", mmap_mode='r')
+        values = np.load(f"{prefix}_values.npy", mmap_mode='r')
+        return times, values
+
+
 class myDataLoader:
-    def __init__(self, file_path, batch_size=3, device_id=None):
+    def __init__(self, file_path, batch_size=3, device_id=None, cache_dir=None, sep=',', chunksize=100000,
+                 dtype=np.float64):
+        """
+        :param file_path: CSV 文件路径
+        :param batch_size: 每个批次的时间步数
+        :param device_id: 可选的设备编号筛选
+        :param cache_dir: 列式缓存目录；指定时分块建立/复用缓存，不再整体读入 DataFrame
+        :param sep: CSV 分隔符
+        :param chunksize: 建立缓存时每次读取的行数
+        :param dtype: 采集值的精度，np.float32 时内存（以及列式缓存）占用减半
+        """
+        self.batch_size = batch_size
+        self.device_id = device_id  # 可选的设备编号筛选
+        self.cache = None
+        if cache_dir is not None:
+            self.cache = ColumnarCache.open_or_build(file_path, cache_dir, sep, chunksize, dtype)
+            return
         # 读取CSV文件
-        self.df = pd.read_csv(file_path)
+        self.df = pd.read_csv(file_path, sep=sep)
+        if np.dtype(dtype) != np.float64:
+            self.df[VALUE_COLUMNS] = self.df[VALUE_COLUMNS].apply(pd.to_numeric, errors='coerce').astype(dtype)
         # 确保数据按设备编号和时间排序
         self.df['时间'] = pd.to_datetime(self.df['时间'], errors='coerce')
         self.df = self.df.sort_values(by=['设备编号', '时间'])
-        self.batch_size = batch_size
-        self.device_id = device_id  # 可选的设备编号筛选
 
     def preprocess(self):
+        if self.cache is not None:
+            # 缓存中已去除缺失值并按时间排序
+            return
         # 提取我们关心的列：设备编号、时间、采集值x、y、z
-        self.df_filtered = self.df[['设备编号', '时间', '采集值x', '采集值y', '采集值z']].dropna()
+        self.df_filtered = self.df[COLUMNS].dropna()
 
         # 如果指定了设备编号，则只筛选该设备的数据
         if self.device_id:
             self.df_filtered = self.df_filtered[self.df_filtered['设备编号'] == self.device_id]
 
+    def _cached_devices(self):
+        if self.device_id:
+            device = str(self.device_id)
+            return [device] if device in self.cache.index else []
+        return self.cache.devices()
+
+    def generate_batch_arrays(self):
+        """
+        基于列式缓存按设备生成批次，不复制数据。
+        :return: 逐个设备产生 (设备编号, 时间 (n_batches, batch_size),
+                 采集值 (n_batches, batch_size, 3))，均为内存映射上的视图
+        """
+        if self.cache is None:
+            raise ValueError("generate_batch_arrays 需要指定 cache_dir")
+        for device in self._cached_devices():
+            times, values = self.cache.load(device)
+            n_batches = len(times) // self.batch_size
+            if n_batches == 0:
+                continue
+            usable = n_batches * self.batch_size
+            yield (device,
+                   times[:usable].reshape(n_batches, self.batch_size),
+                   values[:usable].reshape(n_batches, self.batch_size, len(VALUE_COLUMNS)))
+
     def generate_batches(self):
         batch_count = 0
+        if self.cache is not None:
+            for device, times, values in self.generate_batch_arrays():
+                for b in range(len(times)):
+                    batch_count += 1
+                    batch = pd.DataFrame(values[b], columns=VALUE_COLUMNS)
+                    batch.insert(0, '时间', pd.to_datetime(times[b], utc=True))
+                    batch.insert(0, '设备编号', device)
+                    yield batch
+            print(f"Total batches generated: {batch_count}")  # 输出总共生成了多少组batch
+            return
+
         # 根据设备编号分组
         device_groups = self.df_filtered.groupby('设备编号')
 
         # 遍历每个设备编号的分组，生成连续时间的批次
         for device, group in device_groups:
-            # 按时间排序
-            group = group.sort_values(by='时间')
+            # 分组保持了全局排序后的顺序，组内已按时间排序
             # 将数据切割成多个批次
             for start in range(0, len(group), self.batch_size):
                 batch = group.iloc[start:start + self.batch_size]
@@ -35,7 +192,7 @@ class myDataLoader:
                 if len(batch) == self.batch_size:
                     batch_count += 1
                     # 返回设备编号、时间序列和采集值
-                    yield batch[['设备编号', '时间', '采集值x', '采集值y', '采集值z']]
+                    yield batch[COLUMNS]
 
         print(f"Total batches generated: {batch_count}")  # 输出总共生成了多少组batch
 
@@ -54,7 +211,9 @@ def test_data_loader(file_path, device_id=None):
         if temp > 10:
             break
 
-# 假设你已经上传了文件，可以测试：
-file_path = r"E:\Code_files\时空\data\长寨社区市布鞋厂宿舍楼后滑坡.csv"
-device_id = 431271010011010101  # 可修改为需要的设备编号
-test_data_loader(file_path, device_id=device_id)
+
+if __name__ == '__main__':
+    # 假设你已经上传了文件，可以测试：
+    file_path = r"E:\Code_files\时空\data\长寨社区市布鞋厂宿舍楼后滑坡.csv"
+    device_id = 431271010011010101  # 可修改为需要的设备编号
+    test_data_loader(file_path, device_id=device_id)
@@ -2,36 +2,126 @@
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import text
 import logging
+import csv
+import io
+import os
+import time
 from datetime import datetime
+import pandas as pd
+from cache import TTLCache
+import metrics
+from storage import EmbeddedStore
 
 db = SQLAlchemy()
+metadata_cache = TTLCache(maxsize=1024, ttl=60)   # 表列表、字段列表、字段类型的缓存
+analytics_store = None      # 嵌入式列式存储（DuckDB），未启用时为 None
+embedded_only = False       # 为 True 时不使用 PostgreSQL，全部读写都走嵌入式存储
+unified_store = True        # 为 True 时标准传感器文件写入统一的分区测量表（见 measurements.py）
+infer_types = True          # 为 True 时抽样推断列类型，否则只按列名规则（decide_type）
+
+INGEST_CHUNK_SIZE = 50000   # 流式导入时每个分块的行数
+COPY_NULL = '\\N'           # COPY 中表示 NULL 的标记
+TYPE_SAMPLE_ROWS = 10000    # 推断列类型时抽样的行数
+INTERNAL_SCHEMA = 'store'   # 统一测量存储与导入记录所在的模式，不出现在表列表中
+
+WATERMARK_SQL = f"""
+CREATE SCHEMA IF NOT EXISTS {INTERNAL_SCHEMA};
+CREATE TABLE IF NOT EXISTS {INTERNAL_SCHEMA}.ingest_watermarks (
+    table_name TEXT NOT NULL,
+    device TEXT NOT NULL,
+    high_water TIMESTAMP NOT NULL,
+    PRIMARY KEY (table_name, device)
+)
+"""
+_watermarks_ready = False
+
+def configure_storage(config):
+    """
+    按配置选择存储后端：
+    - postgresql: 只使用 PostgreSQL（默认）
+    - mirror: 导入的数据同时镜像到嵌入式列式存储，分析型查询走嵌入式存储
+    - embedded: 不使用 PostgreSQL，全部读写走嵌入式存储，适合本地分析
+    """
+    global analytics_store, embedded_only, unified_store, infer_types
+    backend = config.get('STORAGE_BACKEND', 'postgresql')
+    if backend in ('mirror', 'embedded'):
+        analytics_store = EmbeddedStore(config.get('EMBEDDED_DB_PATH', './analytics.duckdb'), INTERNAL_SCHEMA)
+    else:
+        analytics_store = None
+    embedded_only = backend == 'embedded'
+    unified_store = config.get('MEASUREMENT_STORE', True) and not embedded_only
+    infer_types = config.get('COLUMN_TYPE_INFERENCE', True)
+    invalidate_table_metadata()
+    logging.info(f"Storage backend: {backend}")
+
+
+def analytics_for(table_name):
+    """
+    返回可承担该表分析型查询的嵌入式存储；未启用或该表没有镜像时返回 None，由 PostgreSQL 处理。
+    """
+    if analytics_store is None:
+        return None
+    if embedded_only:
+        return analytics_store
+    mirrored = metadata_cache.get(('mirrored', table_name))
+    if mirrored is None:
+        mirrored = analytics_store.table_exists(table_name)
+        metadata_cache.set(('mirrored', table_name), mirrored)
+    return analytics_store if mirrored else None
+
+
+def invalidate_table_metadata(table_name=None):
+    """
+    使元数据缓存失效。
+    :param table_name: 带 table_ 前缀的表名；为 None 时清空全部缓存
+    """
+    if table_name is None:
+        metadata_cache.clear()
+        return
+    metadata_cache.invalidate(lambda key: key[0] == 'tables' or key[1:] == (table_name,))
+
+
+def valid_table_name_of(file_name):
+    """
+    上传文件名对应的表名：加 table_ 前缀，'.' 和 '-' 替换为 '_'。
+    """
+    return f"table_{file_name}".replace('.', '_').replace('-', '_')
+
 
 # /api/upload_csv
 # 检查表格是否存在
 def check_table_exists(table_name):
     # True : table exists
+    valid_table_name = valid_table_name_of(table_name)
+    cached = metadata_cache.get(('exists', valid_table_name))
+    if cached is not None:
+        return cached
     try:
-        valid_table_name = f"table_{table_name}"
+        if embedded_only:
+            exists = analytics_store.table_exists(valid_table_name)
+            metadata_cache.set(('exists', valid_table_name), exists)
+            return exists
         result = db.session.execute(text(f"SELECT to_regclass('{valid_table_name}');"))
         ans = result.scalar()
         if ans is None:
             logging.info(f"Table <{table_name}> does not exist. || database return: {ans}")
-            return False
+            exists = False
         else:
             logging.info(f"Table <{table_name}> exists. || database return: {ans}")
-            return True
+            exists = True
+        metadata_cache.set(('exists', valid_table_name), exists)
+        return exists
     except Exception as e:
         print(f"Error checking table existence: {e}")
         return False
 
-
 def decide_type(header):
     """
     根据列名决定 PostgreSQL 数据类型。
     """
     if "编号" in header:
         return "TEXT"
-    elif "经度" in header or "纬度" in header:
+    elif "经度" in header or "纬度" in header or "维度" in header:
         return "FLOAT"
     elif "时间" in header:
         return "TIMESTAMP"
@@ -40,18 +130,103 @@ def decide_type(header):
     else:
         return "TEXT"
 
+
+_INTEGER_PATTERN = r"[+-]?\d+"
+
+
+def _fits_real(values):
+    """
+    有效数字不超过 6 位的十进制数经过 float32 往返后不变，可以用 REAL（4 字节）保存。
+    """
+    mantissa = (values.str.replace(r"[eE].*$", "", regex=True)
+                .str.replace(r"(\.\d*?)0+$", r"\1", regex=True)
+                .str.replace(r"[+\-.]", "", regex=True)
+                .str.lstrip("0"))
+    return bool((mantissa.str.len() <= 6).all())
+
+
+def infer_type(header, values):
+    """
+    根据抽样的取值推断列类型，列名规则优先：
+    - 时间：TIMESTAMP，按本地时间保存，与键集分页、高水位线和统一测量存储一致
+    - 经度/纬度/维度：DOUBLE PRECISION
+    - 编号：TEXT。编号是标识符，接口按字符串比较和排序，设备编号也超出前端 JSON 能精确表示的整数范围
+    其余列：全为整数用 BIGINT；全为数值时有效数字不超过 6 位用 REAL，否则 DOUBLE PRECISION；
+    全为带时区的时间用 TIMESTAMPTZ，不带时区的用 TIMESTAMP；其他为 TEXT。
+    列名含“值”的是测量值，抽样全为整数（如开头一段读数都是 0）不代表之后没有小数，
+    不推断为整数类型，此时用 DOUBLE PRECISION。
+    :param values: 抽样得到的非空字符串取值（Series）
+    """
+    if "时间" in header:
+        return "TIMESTAMP"
+    if "经度" in header or "纬度" in header or "维度" in header:
+        return "DOUBLE PRECISION"
+    if "编号" in header:
+        return "TEXT"
+    if values.empty:
+        return decide_type(header)
+    values = values.str.strip()
+    if values.str.fullmatch(_INTEGER_PATTERN).all():
+        return "DOUBLE PRECISION" if "值" in header else "BIGINT"
+    if pd.to_numeric(values, errors="coerce").notna().all():
+        return "REAL" if _fits_real(values) else "DOUBLE PRECISION"
+    times = pd.to_datetime(values, errors="coerce", format="mixed", utc=True)
+    if times.notna().all():
+        has_offset = values.str.contains(r"(?:[+-]\d{2}(?::?\d{2})?|Z)$", regex=True).all()
+        return "TIMESTAMPTZ" if has_offset else "TIMESTAMP"
+    return "TEXT"
+
+
+def infer_column_types(headers, file_path, delimiter="\t", sample_rows=TYPE_SAMPLE_ROWS):
+    """
+    读取文件开头 sample_rows 行推断各列类型；关闭类型推断时只按列名规则。
+    抽样之外的值如果不符合推断的类型，导入时报错（见 _clean_chunk），不会被静默丢弃。
+    :return: {列名: PostgreSQL 类型}
+    """
+    if not infer_types:
+        return {header: decide_type(header) for header in headers}
+    sample = pd.read_csv(file_path, sep=delimiter, header=None, skiprows=1, names=headers,
+                         dtype=str, keep_default_na=False, nrows=sample_rows, encoding="utf-8")
+    column_types = {}
+    for header in headers:
+        values = sample[header]
+        values = values[(values != "") & (values != "nan")]
+        column_types[header] = infer_type(header, values)
+    logging.info(f"Inferred column types: {column_types}")
+    return column_types
+
+def unique_key_of(file_name):
+    """
+    表格 (设备编号, 时间) 唯一键的约束名。
+    """
+    return f"uidx_{file_name}_device_time"
+
+
 # 动态创建表格
-def create_table_from_csv(file_name, headers):
+def create_table_from_csv(file_name, headers, column_types=None):
+    """
+    :param column_types: {列名: 类型}，缺省时按列名规则 decide_type
+    """
+    if column_types is None:
+        column_types = {header: decide_type(header) for header in headers}
+    if embedded_only:
+        analytics_store.create_table(file_name, [(header, column_types[header]) for header in headers])
+        invalidate_table_metadata(file_name)
+        return
     try:
-        columns = ', '.join([f"{header} {decide_type(header)}" for header in headers])
+        columns = [f"{header} {column_types[header]}" for header in headers]
+        # (设备编号, 时间) 唯一键：支撑按设备、时间的分页与筛选，以及追加导入时的 ON CONFLICT 合并
+        if "设备编号" in headers and "时间" in headers:
+            columns.append(f"CONSTRAINT {unique_key_of(file_name)} UNIQUE (设备编号, 时间)")
         logging.info(columns)
-        create_table_sql = f"CREATE TABLE IF NOT EXISTS {file_name} ({columns});"
+        create_table_sql = f"CREATE TABLE IF NOT EXISTS {file_name} ({', '.join(columns)});"
         db.session.execute(text(create_table_sql))
         db.session.commit()
+        invalidate_table_metadata(file_name)
     except Exception as e:
         logging.error(f"Error creating table from csv: {e}")
 
-# 插入 CSV 数据到新表
+# 逐行批量 INSERT 写入数据。导入已改用 copy_csv_data，此函数只作为 benchmark.py 的对照基线保留
 def insert_csv_data(file_name, headers, rows):
 
     insert_sql = f"INSERT INTO {file_name} ({', '.join(headers)}) VALUES ({', '.join([':value_' + str(i) for i in range(len(headers))])})"
@@ -95,12 +270,320 @@ def insert_csv_data(file_name, headers, rows):
         logging.error(f"插入数据失败: {e}")
         raise
 
+def _clean_chunk(chunk, headers, column_types=None):
+    """
+    按列清洗一个分块：规范化时间列，'nan' 及缺失值转为 None。
+    :param chunk: DataFrame，所有列均为字符串
+    :param headers: 列名列表
+    :param column_types: 可选的 {列名: 类型}，给出时检查取值：空字符串转为 None，
+                         其他不符合该类型的值报错，而不是写入缺失值
+    :return: 清洗后的 DataFrame
+    :raise ValueError: 某个值不符合列类型
+    """
+    chunk = chunk.where(chunk.notna() & (chunk != "nan"), None)
+    if "时间" in headers:
+        col = chunk["时间"].str.replace(r"\+08$", "+0800", regex=True)
+        parsed = pd.to_datetime(col, format="%Y-%m-%d %H:%M:%S%z", errors="coerce", utc=True)
+        # 无效时间值设置为 None，有效值保留原始字面量交给数据库解析
+        chunk["时间"] = col.where(parsed.notna(), None)
+    for header, column_type in (column_types or {}).items():
+        column_type = column_type.upper()
+        if header == "时间" or header not in chunk:
+            continue
+        if column_type in ("BIGINT", "INTEGER", "SMALLINT"):
+            check = lambda values: values.str.strip().str.fullmatch(_INTEGER_PATTERN).fillna(False)
+        elif column_type in ("REAL", "DOUBLE PRECISION", "FLOAT") or column_type.startswith("NUMERIC"):
+            check = lambda values: pd.to_numeric(values, errors="coerce").notna()
+        elif column_type.startswith("TIMESTAMP"):
+            check = lambda values: pd.to_datetime(values, errors="coerce", format="mixed", utc=True).notna()
+        else:
+            continue
+        values = chunk[header]
+        values = values.where(values.isna() | (values.str.strip() != ""), None)
+        invalid = values.notna() & ~check(values).astype(bool)
+        if invalid.any():
+            # 分块的行号在整个文件中连续，加上表头即为文件中的行号
+            row = invalid.idxmax()
+            raise ValueError(f"第 {row + 2} 行 {header} 的值 {values[row]!r} 不符合列类型 {column_type}")
+        chunk[header] = values
+    return chunk
+
+
+def _copy_chunk(cursor, file_name, headers, chunk):
+    """
+    通过 PostgreSQL COPY 将一个分块写入表格。
+    """
+    buffer = io.StringIO()
+    chunk.to_csv(buffer, sep=",", header=False, index=False, na_rep=COPY_NULL,
+                 quoting=csv.QUOTE_MINIMAL)
+    buffer.seek(0)
+    copy_sql = (f"COPY {file_name} ({', '.join(headers)}) FROM STDIN "
+                f"WITH (FORMAT csv, NULL '{COPY_NULL}')")
+    cursor.copy_expert(copy_sql, buffer)
+
+
+def _insert_chunk(file_name, headers, chunk):
+    """
+    非 PostgreSQL 数据库的回退路径：整块多行 INSERT。
+    """
+    insert_sql = f"INSERT INTO {file_name} ({', '.join(headers)}) VALUES ({', '.join([':value_' + str(i) for i in range(len(headers))])})"
+    data = [
+        {f"value_{j}": value for j, value in enumerate(row)}
+        for row in chunk.itertuples(index=False, name=None)
+    ]
+    db.session.execute(text(insert_sql), data)
+
+
+def copy_csv_data(file_name, headers, file_path, chunk_size=INGEST_CHUNK_SIZE, delimiter="\t",
+                  progress=None, column_types=None):
+    """
+    流式导入 CSV 文件：按固定行数分块读取、按列清洗，并在单个事务中批量写入。
+    峰值内存只与 chunk_size 有关，与文件大小无关。
+    :param file_name: 目标表名
+    :param headers: 列名列表（CSV 第一行）
+    :param file_path: 已保存的 CSV 文件路径
+    :param chunk_size: 每个分块的行数
+    :param delimiter: 分隔符
+    :param progress: 可选的进度回调 progress(rows_parsed, rows_inserted, bytes_read)，
+                     每个分块解析后和写入后各调用一次
+    :param column_types: 可选的 {列名: 类型}，用于清洗不符合列类型的值，并作为镜像表的列类型
+    :return: 写入的总行数
+    """
+    if embedded_only:
+        total_rows = analytics_store.load_csv(file_name, headers, file_path, delimiter)
+        metrics.ingest_rows_total.inc(total_rows)
+        if progress is not None:
+            file_size = os.path.getsize(file_path)
+            progress(total_rows, total_rows, file_size)
+        return total_rows
+
+    start_time = time.perf_counter()
+    total_rows = 0
+    csvfile = open(file_path, 'rb')
+    reader = pd.read_csv(csvfile, sep=delimiter, header=None, skiprows=1, names=headers,
+                         dtype=str, keep_default_na=False, chunksize=chunk_size,
+                         encoding="utf-8")
+    try:
+        connection = db.session.connection()
+        use_copy = connection.dialect.name == "postgresql"
+        cursor = connection.connection.cursor() if use_copy else None
+        for chunk in reader:
+            chunk = _clean_chunk(chunk, headers, column_types)
+            if progress is not None:
+                progress(total_rows + len(chunk), total_rows, csvfile.tell())
+            if use_copy:
+                _copy_chunk(cursor, file_name, headers, chunk)
+            else:
+                _insert_chunk(file_name, headers, chunk)
+            total_rows += len(chunk)
+            if progress is not None:
+                progress(total_rows, total_rows, csvfile.tell())
+        if use_copy and "设备编号" in headers and "时间" in headers:
+            save_watermarks(file_name, file_name)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"插入数据失败: {e}")
+        raise
+    finally:
+        reader.close()
+        csvfile.close()
+
+    elapsed = max(time.perf_counter() - start_time, 1e-9)
+    file_size = os.path.getsize(file_path)
+    metrics.ingest_rows_total.inc(total_rows)
+    metrics.ingest_rows_per_second.set(total_rows / elapsed)
+    logging.info(f"数据流式导入成功: {file_name} rows={total_rows} "
+                 f"elapsed={elapsed:.3f}s rows/s={total_rows / elapsed:.1f} "
+                 f"bytes/s={file_size / elapsed:.1f}")
+    mirror_csv(file_name, headers, file_path, delimiter, column_types=column_types)
+    return total_rows
+
+
+def mirror_csv(file_name, headers, file_path, delimiter="\t", upsert=False, column_types=None):
+    """
+    将已写入 PostgreSQL 的文件镜像到嵌入式存储；失败时删除镜像表，分析型查询回退到 PostgreSQL。
+    :param upsert: 为 True 时把追加导入的数据合并到已有的镜像表；表格没有镜像时不做处理
+    :param column_types: 新建镜像表的列类型，缺省时按列名规则 decide_type
+    """
+    if column_types is None:
+        column_types = {header: decide_type(header) for header in headers}
+    if analytics_store is None:
+        return
+    try:
+        if upsert:
+            if analytics_for(file_name) is not None:
+                analytics_store.upsert_csv(file_name, headers, file_path, delimiter)
+        else:
+            analytics_store.create_table(file_name, [(header, column_types[header]) for header in headers])
+            analytics_store.load_csv(file_name, headers, file_path, delimiter)
+    except Exception as e:
+        logging.error(f"镜像到嵌入式存储失败: {e}")
+        analytics_store.drop_table(file_name)
+    metadata_cache.pop(('mirrored', file_name))
+
+
+def _ensure_watermark_table():
+    global _watermarks_ready
+    if not _watermarks_ready:
+        with db.engine.begin() as connection:
+            for statement in WATERMARK_SQL.split(';'):
+                if statement.strip():
+                    connection.execute(text(statement))
+        _watermarks_ready = True
+
+
+def load_watermarks(table_name):
+    """
+    读取表格中每个设备已导入数据的最晚时间（高水位线）。
+    :return: {设备编号: 时间}
+    """
+    _ensure_watermark_table()
+    result = db.session.execute(text(
+        f"SELECT device, high_water FROM {INTERNAL_SCHEMA}.ingest_watermarks WHERE table_name = :table_name"),
+        {'table_name': table_name})
+    return {row[0]: row[1] for row in result.fetchall()}
+
+
+def save_watermarks(table_name, source):
+    """
+    用 source（表格本身或暂存表）中每个设备的最晚时间推进高水位线，在调用方的事务中执行。
+    """
+    _ensure_watermark_table()
+    db.session.execute(text(f"""
+        INSERT INTO {INTERNAL_SCHEMA}.ingest_watermarks (table_name, device, high_water)
+        SELECT :table_name, 设备编号, MAX(时间) FROM {source}
+        WHERE 设备编号 IS NOT NULL AND 时间 IS NOT NULL
+        GROUP BY 设备编号
+        ON CONFLICT (table_name, device) DO UPDATE
+        SET high_water = GREATEST({INTERNAL_SCHEMA}.ingest_watermarks.high_water, EXCLUDED.high_water)
+    """), {'table_name': table_name})
+
+
+def stage_csv_data(staging, headers, file_path, column_types, watermarks=None,
+                   chunk_size=INGEST_CHUNK_SIZE, delimiter="\t", progress=None, keyed_only=True):
+    """
+    按分块清洗 CSV 并 COPY 到临时暂存表（提交时删除），供追加导入合并使用。
+    设备编号或时间为空的行、时间早于该设备高水位线的行在这里丢弃，不发送到数据库；
+    暂存表的 _seq 列记录行在文件中的顺序，同一 (设备编号, 时间) 以最后一行为准。
+    :param staging: 暂存表名
+    :param column_types: {列名: 暂存表中的类型}
+    :param watermarks: {设备编号: 高水位线}，见 load_watermarks
+    :param keyed_only: 为 False 时保留设备编号或时间为空的行（新建上传时与单独建表一致）
+    :return: (解析的行数, 写入暂存表的行数)
+    """
+    columns = ', '.join(f"{header} {column_types[header]}" for header in headers)
+    db.session.execute(text(f"CREATE TEMP TABLE {staging} (_seq BIGSERIAL, {columns}) ON COMMIT DROP"))
+    cursor = db.session.connection().connection.cursor()
+    rows_parsed = rows_staged = 0
+    csvfile = open(file_path, 'rb')
+    reader = pd.read_csv(csvfile, sep=delimiter, header=None, skiprows=1, names=headers,
+                         dtype=str, keep_default_na=False, chunksize=chunk_size,
+                         encoding="utf-8")
+    try:
+        for chunk in reader:
+            chunk = _clean_chunk(chunk, headers, column_types)
+            rows_parsed += len(chunk)
+            if keyed_only:
+                chunk = chunk[chunk["设备编号"].notna() & chunk["时间"].notna()]
+            if watermarks:
+                # 时间字面量的前 19 位即 TIMESTAMP 列中保存的值（时区后缀被忽略）
+                times = pd.to_datetime(chunk["时间"].str[:19], errors="coerce")
+                marks = pd.to_datetime(chunk["设备编号"].map(watermarks))
+                chunk = chunk[(marks.isna() | times.isna() | (times >= marks)).to_numpy()]
+            if progress is not None:
+                progress(rows_parsed, rows_staged, csvfile.tell())
+            if len(chunk):
+                _copy_chunk(cursor, staging, headers, chunk)
+                rows_staged += len(chunk)
+    finally:
+        reader.close()
+        csvfile.close()
+    return rows_parsed, rows_staged
+
+
+def upsert_csv_data(file_name, headers, file_path, chunk_size=INGEST_CHUNK_SIZE, delimiter="\t",
+                    progress=None):
+    """
+    追加导入到已存在的表格：暂存新数据后按 (设备编号, 时间) 用 ON CONFLICT 合并，
+    新行插入，取值变化的行更新，完全相同的行跳过。耗时只与新文件的大小有关。
+    :return: {'inserted', 'updated', 'skipped', 'time_from'}，time_from 为暂存数据的最早时间
+    """
+    if embedded_only:
+        counts = analytics_store.upsert_csv(file_name, headers, file_path, delimiter)
+        metrics.ingest_rows_total.inc(counts['inserted'] + counts['updated'])
+        if progress is not None:
+            progress(counts['inserted'] + counts['updated'] + counts['skipped'],
+                     counts['inserted'] + counts['updated'], os.path.getsize(file_path))
+        return counts
+    if "设备编号" not in headers or "时间" not in headers:
+        raise ValueError("追加导入需要 设备编号 和 时间 列")
+    if db.session.get_bind().dialect.name != "postgresql":
+        raise ValueError("追加导入需要 PostgreSQL")
+
+    start_time = time.perf_counter()
+    staging = "sps_staging"
+    columns = ', '.join(headers)
+    value_columns = [header for header in headers if header not in ("设备编号", "时间")]
+    latest = (f"(SELECT DISTINCT ON (设备编号, 时间) {columns} FROM {staging} "
+              f"ORDER BY 设备编号, 时间, _seq DESC)")
+    if value_columns:
+        on_conflict = (f"DO UPDATE SET {', '.join(f'{c} = EXCLUDED.{c}' for c in value_columns)} "
+                       f"WHERE ({', '.join(f't.{c}' for c in value_columns)}) IS DISTINCT FROM "
+                       f"({', '.join(f'EXCLUDED.{c}' for c in value_columns)})")
+    else:
+        on_conflict = "DO NOTHING"
+    try:
+        if db.session.execute(text(f"SELECT to_regclass('{unique_key_of(file_name)}')")).scalar() is None:
+            raise ValueError(f"表格 {file_name} 没有 (设备编号, 时间) 唯一键，不能追加导入")
+        watermarks = load_watermarks(file_name)
+        table_types = get_column_types_of_table(file_name) or {}
+        rows_parsed, _ = stage_csv_data(staging, headers, file_path,
+                                        {header: table_types.get(header, decide_type(header)) for header in headers},
+                                        watermarks, chunk_size, delimiter, progress)
+        time_from, distinct_rows, matched = db.session.execute(text(f"""
+            SELECT MIN(s.时间), COUNT(*), COUNT(t.设备编号) FROM {latest} s
+            LEFT JOIN {file_name} t ON t.设备编号 = s.设备编号 AND t.时间 = s.时间
+        """)).one()
+        changed = db.session.execute(text(f"""
+            INSERT INTO {file_name} AS t ({columns}) SELECT {columns} FROM {latest} s
+            ON CONFLICT (设备编号, 时间) {on_conflict}
+        """)).rowcount
+        save_watermarks(file_name, staging)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"追加导入失败: {e}")
+        raise
+
+    inserted = distinct_rows - matched
+    updated = changed - inserted
+    counts = {'inserted': inserted, 'updated': updated, 'skipped': rows_parsed - inserted - updated,
+              'time_from': time_from}
+    elapsed = max(time.perf_counter() - start_time, 1e-9)
+    metrics.ingest_rows_total.inc(inserted + updated)
+    metrics.ingest_rows_per_second.set(rows_parsed / elapsed)
+    if progress is not None:
+        progress(rows_parsed, inserted + updated, os.path.getsize(file_path))
+    logging.info(f"追加导入成功: {file_name} inserted={inserted} updated={updated} "
+                 f"skipped={counts['skipped']} elapsed={elapsed:.3f}s")
+    mirror_csv(file_name, headers, file_path, delimiter, upsert=True)
+    return counts
+
 # /api/get_databases
 def get_all_databases():
+    cached = metadata_cache.get(('tables',))
+    if cached is not None:
+        return cached
     # 使用 db.session.execute 执行查询
     try:
+        if embedded_only:
+            tables = [name[6:] if name.startswith('table_') else name for name in analytics_store.list_tables()]
+            metadata_cache.set(('tables',), tables)
+            return tables
         result = db.session.execute(text("SELECT table_name FROM information_schema.tables WHERE table_schema = 'public'"))
         tables = [row[0][6:] if row[0].startswith('table_') else row[0] for row in result.fetchall()]
+        metadata_cache.set(('tables',), tables)
         return tables
     except Exception as e:
         print(f"Error getting all databases: {e}")
@@ -110,7 +593,14 @@ def get_all_databases():
 #
 # 获取数据库的字段信息
 def get_columns_of_table(database_name):
+    cached = metadata_cache.get(('columns', database_name))
+    if cached is not None:
+        return cached
     try:
+        if embedded_only:
+            columns = analytics_store.columns(database_name)
+            metadata_cache.set(('columns', database_name), columns)
+            return columns
         # 查询表的所有字段，并按位置排序
         query = text(f"""
             SELECT column_name
@@ -121,22 +611,101 @@ def get_columns_of_table(database_name):
         result = db.session.execute(query, {'table_name': database_name})
         columns = [row[0] for row in result.fetchall()]
         logging.info(columns)
+        metadata_cache.set(('columns', database_name), columns)
         return columns
     except Exception as e:
         print(f"Error getting columns for table {database_name}: {e}")
         return None
 
 
+# 获取数据库的字段类型
+def get_column_types_of_table(database_name):
+    """
+    :return: 字典 {字段名: 数据类型}，按字段位置排序
+    """
+    cached = metadata_cache.get(('column_types', database_name))
+    if cached is not None:
+        return cached
+    try:
+        if embedded_only:
+            column_types = analytics_store.column_types(database_name)
+            metadata_cache.set(('column_types', database_name), column_types)
+            return column_types
+        query = text("""
+            SELECT column_name, data_type
+            FROM information_schema.columns
+            WHERE table_name = :table_name
+            ORDER BY ordinal_position
+        """)
+        result = db.session.execute(query, {'table_name': database_name})
+        column_types = {row[0]: row[1] for row in result.fetchall()}
+        metadata_cache.set(('column_types', database_name), column_types)
+        return column_types
+    except Exception as e:
+        print(f"Error getting column types for table {database_name}: {e}")
+        return None
+
+
 # 获取表格的数据（分页处理）
 def get_table_data(database_name, start, end):
     try:
+        if embedded_only:
+            return analytics_store.fetch_page(database_name, start, end)
         # 构建 SQL 查询，使用 LIMIT 和 OFFSET 来分页
         query = text(f"SELECT * FROM {database_name} LIMIT :limit OFFSET :offset")
         result = db.session.execute(query, {'limit': end - start, 'offset': start})
         # 获取查询结果并返回
         rows = result.fetchall()
-        logging.info(rows)
+        logging.debug(rows)
         return rows
     except Exception as e:
         print(f"Error getting data for table {database_name}: {e}")
         return None
+
+
+# 获取表格的数据（游标/键集分页）
+def get_table_data_keyset(database_name, limit, after_device=None, after_time=None,
+                          device=None, time_from=None, time_to=None):
+    """
+    按 (设备编号, 时间) 做键集分页，配合复合索引，第 N 页与第 1 页代价相同。
+    时间为空的行不参与键集分页。
+    :param database_name: 表名
+    :param limit: 每页行数
+    :param after_device: 上一页最后一行的设备编号
+    :param after_time: 上一页最后一行的时间
+    :param device: 只返回该设备的数据
+    :param time_from: 时间下界（包含）
+    :param time_to: 时间上界（不包含）
+    :return: 行列表
+    """
+    try:
+        if embedded_only:
+            return analytics_store.fetch_keyset(database_name, limit, after_device, after_time,
+                                                device, time_from, time_to)
+        conditions = ["时间 IS NOT NULL"]
+        params = {'limit': limit}
+        if device is not None:
+            conditions.append("设备编号 = :device")
+            params['device'] = device
+        if time_from is not None:
+            conditions.append("时间 >= :time_from")
+            params['time_from'] = time_from
+        if time_to is not None:
+            conditions.append("时间 < :time_to")
+            params['time_to'] = time_to
+        if after_device is not None and after_time is not None:
+            conditions.append("(设备编号, 时间) > (:after_device, :after_time)")
+            params['after_device'] = after_device
+            params['after_time'] = after_time
+        elif after_device is not None:
+            conditions.append("设备编号 > :after_device")
+            params['after_device'] = after_device
+        query = text(f"SELECT * FROM {database_name} WHERE {' AND '.join(conditions)} "
+                     f"ORDER BY 设备编号, 时间 LIMIT :limit")
+        result = db.session.execute(query, params)
+        rows = result.fetchall()
+        logging.info(f"keyset page of {database_name}: {len(rows)} rows")
+        return rows
+    except Exception as e:
+        print(f"Error getting keyset data for table {database_name}: {e}")
+        return None
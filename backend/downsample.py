@@ -0,0 +1,218 @@
+# downsample.py
+import logging
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from cache import TTLCache
+import db as db_module
+from db import db
+from prediction_input import VALUE_COLUMNS, get_time_range, stream_device_readings, _parse_time
+
+MAX_POINTS = 10000
+downsample_cache = TTLCache(maxsize=256, ttl=300)   # (表, 设备, 区间, 分辨率, 方法) -> 结果
+
+
+def _epoch_ms(times):
+    """
+    将时间序列批量转换为 epoch 毫秒（无时区的时间按 UTC 解释）。
+    """
+    times = pd.to_datetime(pd.Series(times, dtype=object), utc=True)
+    return times.dt.tz_convert(None).to_numpy().astype('datetime64[ms]').astype(np.int64).tolist()
+
+
+def _nullable(values):
+    return [None if value is None else float(value) for value in values]
+
+
+def _bucket_rows(table_name, device_id, time_from, time_to, bucket_seconds):
+    """
+    在 PostgreSQL 中用 date_bin 按时间桶聚合。
+    """
+    aggregates = ', '.join(
+        f"MIN({column}), MAX({column}), AVG({column})" for column in VALUE_COLUMNS)
+    query = text(f"""
+        SELECT date_bin(make_interval(secs => :bucket_seconds), 时间, :origin) AS bucket,
+               COUNT(*), {aggregates}
+        FROM {table_name}
+        WHERE 设备编号 = :device_id AND 时间 >= :time_from AND 时间 < :time_to
+        GROUP BY bucket
+        ORDER BY bucket
+    """)
+    return db.session.execute(query, {
+        'bucket_seconds': bucket_seconds, 'origin': time_from,
+        'device_id': device_id, 'time_from': time_from, 'time_to': time_to
+    }).fetchall()
+
+
+def bucket_series(table_name, device_id, time_from, time_to, points):
+    """
+    按时间桶聚合，每个桶返回 count 以及各采集值的 min/max/avg。
+    表已镜像到嵌入式列式存储时在其中计算，否则在 PostgreSQL 中计算。
+    """
+    bucket_seconds = max((time_to - time_from).total_seconds() / points, 1)
+    store = db_module.analytics_for(table_name)
+    if store is not None:
+        rows = store.bucket_series(table_name, device_id, time_from, time_to, bucket_seconds)
+    else:
+        rows = _bucket_rows(table_name, device_id, time_from, time_to, bucket_seconds)
+
+    columns = list(zip(*rows)) if rows else [[] for _ in range(2 + 3 * len(VALUE_COLUMNS))]
+    result = {
+        'method': 'bucket',
+        'bucket_seconds': bucket_seconds,
+        'time': _epoch_ms(columns[0]),
+        'count': list(columns[1])
+    }
+    for i, column in enumerate(VALUE_COLUMNS):
+        offset = 2 + 3 * i
+        result[column] = {
+            'min': _nullable(columns[offset]),
+            'max': _nullable(columns[offset + 1]),
+            'avg': _nullable(columns[offset + 2])
+        }
+    return result
+
+
+def lttb_stream(samples, x_from, x_to, points):
+    """
+    流式 LTTB 降采样：按 [x_from, x_to) 等分的固定桶边界选点，只缓存相邻两个桶的样本，
+    内存与桶大小而非序列长度成正比。首末样本总被保留，空桶不产生点。
+    :param samples: 按 x 递增的 (x, y, 数据) 迭代器
+    :param points: 目标点数
+    :return: 选中的样本列表
+    """
+    buckets = max(points - 2, 1)
+    width = max((x_to - x_from) / buckets, 1)
+    selected = []
+    current, pending, pending_index = [], [], None   # 已完整的桶、正在累积的桶
+    last = None                                      # 最后一个样本不放入桶，最后单独保留
+
+    def choose(bucket, avg_x, avg_y):
+        px, py = selected[-1][0], selected[-1][1]
+        xs = np.array([sample[0] for sample in bucket])
+        ys = np.array([sample[1] for sample in bucket])
+        areas = np.abs((px - avg_x) * (ys - py) - (px - xs) * (avg_y - py))
+        selected.append(bucket[int(np.argmax(areas))])
+
+    def mean(bucket):
+        return (sum(sample[0] for sample in bucket) / len(bucket),
+                sum(sample[1] for sample in bucket) / len(bucket))
+
+    for sample in samples:
+        if not selected:
+            selected.append(sample)
+            continue
+        if last is not None:
+            index = min(max(int((last[0] - x_from) // width), 0), buckets - 1)
+            if index != pending_index:
+                # 下一个桶已完整，用它的平均点作为三角形的第三个顶点
+                if current:
+                    choose(current, *mean(pending))
+                current, pending, pending_index = pending, [], index
+            pending.append(last)
+        last = sample
+    if current:
+        choose(current, *mean(pending))
+    if pending:
+        choose(pending, last[0], last[1])
+    if last is not None:
+        selected.append(last)
+    return selected
+
+
+def _epoch_ms_of(value):
+    return float(np.datetime64(value, 'ms').astype(np.int64))
+
+
+def lttb_series(table_name, device_id, time_from, time_to, points, field):
+    """
+    流式读取设备的原始序列，按 field 在 [time_from, time_to) 的固定时间桶上做 LTTB 降采样，
+    返回选中点的全部采集值。
+    """
+    field_index = 1 + VALUE_COLUMNS.index(field)
+    samples = ((_epoch_ms_of(row[0]), float(row[field_index]), row)
+               for row in stream_device_readings(table_name, device_id, time_from, time_to)
+               if row[field_index] is not None)
+    selected = lttb_stream(samples, _epoch_ms_of(time_from), _epoch_ms_of(time_to), points)
+    rows = [sample[2] for sample in selected]
+    result = {
+        'method': 'lttb',
+        'field': field,
+        'time': _epoch_ms([row[0] for row in rows])
+    }
+    for i, column in enumerate(VALUE_COLUMNS):
+        result[column] = _nullable([row[1 + i] for row in rows])
+    return result
+
+
+def downsample(table_name, device_id, time_from=None, time_to=None, points=2000,
+               method='bucket', field=VALUE_COLUMNS[0]):
+    """
+    对某设备的时间序列做服务端降采样，结果按 (表, 设备, 区间, 分辨率, 方法) 缓存。
+    :param time_from: 时间下界（包含），缺省为最早读数
+    :param time_to: 时间上界（不包含），缺省为最晚读数之后
+    :param points: 目标点数
+    :param method: bucket 为 SQL 分桶聚合，lttb 为 LTTB 降采样
+    :param field: lttb 降采样依据的采集值字段
+    :return: 结果字典；设备在区间内无数据时返回空序列
+    """
+    points = max(1, min(int(points), MAX_POINTS))
+    time_from, time_to = _parse_time(time_from), _parse_time(time_to)
+    key = (table_name, device_id, time_from, time_to, points, method, field)
+    cached = downsample_cache.get(key)
+    if cached is not None:
+        return cached
+
+    if time_from is None or time_to is None:
+        first_time, last_time = get_time_range(table_name, [device_id], time_from, time_to)
+        time_from = time_from or first_time
+        # 区间为左闭右开，自动推断的终点需要包含最后一条读数
+        time_to = time_to or (last_time and last_time + timedelta(microseconds=1))
+    if time_from is None or time_to is None:
+        result = {'method': method, 'time': []}
+    elif method == 'lttb':
+        result = lttb_series(table_name, device_id, time_from, time_to, points, field)
+    else:
+        result = bucket_series(table_name, device_id, time_from, time_to, points)
+    result['device'] = device_id
+    logging.info(f"downsample {table_name}/{device_id}: {method} -> {len(result['time'])} points")
+    downsample_cache.set(key, result)
+    return result
+
+
+def invalidate_downsample_cache(table_name):
+    """
+    表中数据变化时清除该表的降采样缓存。
+    """
+    return downsample_cache.invalidate(lambda key: key[0] == table_name)
+
+
+def device_statistics(table_name, device=None):
+    """
+    每个设备的行数、首末时间与各采集值的 min/max/avg/stddev。
+    表已镜像到嵌入式列式存储时在其中计算，否则在 PostgreSQL 中计算。
+    """
+    store = db_module.analytics_for(table_name)
+    if store is not None:
+        rows = store.device_statistics(table_name, device)
+    else:
+        aggregates = ', '.join(
+            f"MIN({c}), MAX({c}), AVG({c}), STDDEV_POP({c})" for c in VALUE_COLUMNS)
+        condition = "时间 IS NOT NULL" + ("" if device is None else " AND 设备编号 = :device")
+        rows = db.session.execute(text(f"""
+            SELECT 设备编号, COUNT(*), MIN(时间), MAX(时间), {aggregates}
+            FROM {table_name} WHERE {condition}
+            GROUP BY 设备编号 ORDER BY 设备编号
+        """), {'device': device}).fetchall()
+
+    statistics = []
+    for row in rows:
+        item = {'device': row[0], 'count': row[1],
+                'first_time': _epoch_ms([row[2]])[0] if row[2] is not None else None,
+                'last_time': _epoch_ms([row[3]])[0] if row[3] is not None else None}
+        for i, column in enumerate(VALUE_COLUMNS):
+            offset = 4 + 4 * i
+            item[column] = dict(zip(('min', 'max', 'avg', 'std'), _nullable(row[offset:offset + 4])))
+        statistics.append(item)
+    return statistics
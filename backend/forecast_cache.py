@@ -0,0 +1,157 @@
+# forecast_cache.py
+import collections
+import threading
+from datetime import timedelta
+import numpy as np
+import metrics
+from TimeSeriesForecaster import TimeSeriesForecaster
+
+ForecastResult = collections.namedtuple(
+    'ForecastResult', ['history_weighted', 'weighted_result', 'lower_bound', 'upper_bound', 'is_anomaly'])
+
+
+def forecast_window(window, T, T_prime, β=0.5, dtype=None):
+    """
+    对一个 (T+T', C, V) 窗口做预测和异常检测。
+    健康性评分依赖会话内跨窗口延续的状态，不属于窗口本身的结果，由各会话自行计算。
+    :param dtype: 计算精度，见 TimeSeriesForecaster
+    """
+    with metrics.forecaster_window_seconds.time():
+        forecaster = TimeSeriesForecaster(window, T, T_prime, dtype=dtype)
+        forecaster.β = β
+        weighted_result, lower_bound, upper_bound = forecaster.forward()
+        is_anomaly = forecaster.detect_anomalies(weighted_result, lower_bound, upper_bound)
+        return ForecastResult(forecaster.history_weighted(), weighted_result, lower_bound, upper_bound, is_anomaly)
+
+
+def result_nbytes(result):
+    return sum(np.asarray(part).nbytes for part in result)
+
+
+def forecast_key(table_name, device_ids, step, origin, window_start, T, T_prime, β, dtype=np.float64):
+    """
+    缓存键：(表, 设备, 重采样步长, 数据流起点, 窗口起点, T, T', β, 精度)。
+    窗口的值不只取决于窗口起点：重采样沿用起点之后的上一次读数，尚无读数的设备补零，
+    因此起点不同的数据流即使窗口起点相同，窗口内容也可能不同。
+    :param origin: 数据流的网格起点，即 time_from 之后这些设备的最早读数时间（见 iter_table_windows）
+    """
+    return (table_name, tuple(device_ids), int(step), origin, window_start, int(T), int(T_prime), float(β),
+            np.dtype(dtype).name)
+
+
+class ForecastCache:
+    def __init__(self, maxsize=4096, max_bytes=256 * 1024 * 1024):
+        """
+        预测结果缓存，在观看同一数据流的多个会话之间共享。
+        条目数超过 maxsize 或总字节数超过 max_bytes 时淘汰最久未使用的条目；
+        同一个键同时只计算一次，其余会话等待该结果。
+        :param maxsize: 最大条目数
+        :param max_bytes: 缓存结果数组的内存上限（字节）
+        """
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._data = collections.OrderedDict()     # key -> (字节数, ForecastResult)
+        self._inflight = {}                         # key -> threading.Event
+        self._lock = threading.Lock()
+
+    def configure(self, maxsize=None, max_bytes=None):
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize = maxsize
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            self._evict()
+
+    def _evict(self):
+        while self._data and (len(self._data) > self.maxsize or self.nbytes > self.max_bytes):
+            _, (nbytes, _) = self._data.popitem(last=False)
+            self.nbytes -= nbytes
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            self._data.move_to_end(key)
+            return item[1]
+
+    def set(self, key, result):
+        nbytes = result_nbytes(result)
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[0]
+            self._data[key] = (nbytes, result)
+            self.nbytes += nbytes
+            self._evict()
+
+    def get_or_compute(self, key, compute):
+        """
+        命中时直接返回；未命中时由第一个请求该键的调用方计算，并发的其他调用方等待其结果。
+        计算失败时异常只抛给计算方，等待方会重新尝试。
+        """
+        while True:
+            with self._lock:
+                item = self._data.get(key)
+                if item is not None:
+                    self._data.move_to_end(key)
+                    metrics.forecast_cache_requests_total.inc(result='hit')
+                    return item[1]
+                event = self._inflight.get(key)
+                if event is None:
+                    event = self._inflight[key] = threading.Event()
+                    break
+            event.wait()
+            metrics.forecast_cache_requests_total.inc(result='shared')
+            with self._lock:
+                item = self._data.get(key)
+            if item is not None:
+                return item[1]
+
+        metrics.forecast_cache_requests_total.inc(result='miss')
+        try:
+            result = compute()
+            self.set(key, result)
+            return result
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def invalidate(self, table_name, time_from=None):
+        """
+        删除某表中与新数据重叠或位于其后的窗口：重采样沿用上一次读数，
+        time_from 之后新增的读数也会改变后续窗口的值。
+        :param time_from: 新数据的最早时间；为 None 时删除该表的全部窗口
+        :return: 删除的条目数
+        """
+        def affected(key):
+            table, _, step, _, window_start, T, T_prime = key[:7]
+            if table != table_name:
+                return False
+            window_end = window_start + timedelta(seconds=step * (T + T_prime - 1))
+            return time_from is None or window_end >= time_from
+
+        with self._lock:
+            keys = [key for key in self._data if affected(key)]
+            for key in keys:
+                self.nbytes -= self._data.pop(key)[0]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+forecast_cache = ForecastCache()
+metrics.forecast_cache_bytes.set_function(lambda: forecast_cache.nbytes)
+
+
+def invalidate_forecast_cache(table_name, time_from=None):
+    return forecast_cache.invalidate(table_name, time_from)
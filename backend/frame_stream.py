@@ -0,0 +1,101 @@
+# frame_stream.py
+import threading
+import time
+from functools import partial
+import numpy as np
+
+
+class FrameStreamer:
+    def __init__(self, emit, frame_rate=2.0, max_pending_steps=256, ack_timeout=5.0,
+                 clock=time.monotonic):
+        """
+        将多个时间步（每步包含全部设备通道）合并为一帧，按固定帧率发送。
+        帧中的数组以 float32 打包为二进制附件。客户端确认（ack）上一帧之前不发送新帧，
+        期间新的时间步继续合并；积压超过 max_pending_steps 时丢弃最旧的时间步，
+        服务端不会为慢客户端累积队列。
+        :param emit: 发送函数 emit(frame, callback)
+        :param frame_rate: 每秒最多发送的帧数
+        :param max_pending_steps: 最多合并的时间步数
+        :param ack_timeout: 等待确认的超时时间（秒），超时后视为该帧丢失
+        :param clock: 时钟函数
+        """
+        self._emit = emit
+        self.frame_interval = 1.0 / frame_rate
+        self.max_pending_steps = max_pending_steps
+        self.ack_timeout = ack_timeout
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._pending = []           # [(step, predicted, lower, upper, health)]
+        self._last_sent = None
+        self._awaiting_since = None  # 等待确认的帧的发送时刻
+        self._sent_seq = None        # 最后发送的帧的序号
+        self.seq = 0
+        self.dropped = 0             # 被丢弃的时间步总数
+
+    @property
+    def pending_steps(self):
+        return len(self._pending)
+
+    def push(self, step, predicted, lower, upper, health):
+        """
+        加入一个时间步的结果。
+        :param step: 时间步序号
+        :param predicted: (C,) 加权预测值
+        :param lower: (C,) 下界
+        :param upper: (C,) 上界
+        :param health: 健康性评分
+        """
+        with self._lock:
+            self._pending.append((step, predicted, lower, upper, health))
+            if len(self._pending) > self.max_pending_steps:
+                overflow = len(self._pending) - self.max_pending_steps
+                del self._pending[:overflow]
+                self.dropped += overflow
+
+    def _on_ack(self, seq, *args):
+        """
+        客户端确认第 seq 帧。超时后才到达的旧帧的确认不解除对最新一帧的等待。
+        """
+        with self._lock:
+            if seq == self._sent_seq:
+                self._awaiting_since = None
+
+    def _build_frame(self):
+        steps, predicted, lower, upper, health = zip(*self._pending)
+        self._pending = []
+        pack = lambda values: np.asarray(values, dtype='<f4').tobytes()
+        return {
+            'seq': self.seq,
+            'start_step': int(steps[0]),
+            'steps': len(steps),
+            'channels': int(np.asarray(predicted[0]).shape[0]),
+            'dropped': self.dropped,
+            'dtype': 'float32',
+            'predicted_weighted': pack(predicted),   # (steps, C)
+            'lower_bound': pack(lower),               # (steps, C)
+            'upper_bound': pack(upper),               # (steps, C)
+            'health_score': pack(health)              # (steps,)
+        }
+
+    def poll(self, force=False):
+        """
+        到达帧间隔且上一帧已确认时发送一帧。
+        :param force: 忽略帧率与确认，立即发送积压的时间步
+        :return: 是否发送了一帧
+        """
+        now = self.clock()
+        with self._lock:
+            if not self._pending:
+                return False
+            if not force:
+                if self._last_sent is not None and now - self._last_sent < self.frame_interval:
+                    return False
+                if self._awaiting_since is not None and now - self._awaiting_since < self.ack_timeout:
+                    return False
+            frame = self._build_frame()
+            self._sent_seq = frame['seq']
+            self.seq += 1
+            self._last_sent = now
+            self._awaiting_since = now
+        self._emit(frame, partial(self._on_ack, frame['seq']))
+        return True
@@ -0,0 +1,324 @@
+# ingest.py
+import csv
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from cache import TTLCache
+from db import (check_table_exists, valid_table_name_of, infer_column_types, create_table_from_csv,
+                copy_csv_data, upsert_csv_data, mirror_csv, invalidate_table_metadata)
+import measurements
+import anomaly_events
+from cluster import broadcast
+from downsample import invalidate_downsample_cache
+from forecast_cache import invalidate_forecast_cache
+
+UNIQUE_VIOLATION = '23505'   # PostgreSQL 错误码
+
+
+def read_csv_headers(file_path, delimiter='\t'):
+    """
+    只读取 CSV 的第一行（特征标签）。
+    """
+    with open(file_path, newline='', encoding='utf-8') as csvfile:
+        csvreader = csv.reader(csvfile, delimiter=delimiter)
+        return next(csvreader)
+
+
+def invalidate_table_caches(table_name, time_from=None):
+    """
+    表格数据变化后使元数据、降采样和预测结果缓存失效。经 broadcast 调用，多进程部署时每个进程都执行。
+    :param time_from: 新数据的最早时间，见 invalidate_forecast_cache
+    """
+    invalidate_table_metadata(table_name)
+    invalidate_downsample_cache(table_name)
+    invalidate_forecast_cache(table_name, time_from)
+
+
+def materialize_anomalies(table_name, headers, time_from=None):
+    """
+    导入完成后同步更新异常事件与健康性快照。数据已经提交，计算失败只记录日志，不影响导入结果。
+    服务中由 IngestQueue.submit_materialize 在后台执行，导入请求不必等待。
+    """
+    try:
+        anomaly_events.materialize(table_name, headers, time_from)
+    except Exception as e:
+        logging.error(f"Anomaly events for {table_name} failed: {e}")
+
+
+def ingest_csv_file(file_name, file_path, progress=None, materialize=materialize_anomalies):
+    """
+    将已保存的 CSV 文件导入：检查表格是否存在，标准传感器文件写入统一测量存储并创建同名视图，
+    其他文件单独建表并流式写入数据。
+    :param file_name: 文件名（不含 .csv 后缀）
+    :param file_path: CSV 文件路径
+    :param progress: 进度回调，见 copy_csv_data
+    :param materialize: 数据提交后调用 materialize(table_name, headers, time_from) 更新异常事件，
+                        默认同步执行
+    :return: 写入的行数
+    :raise FileExistsError: 表格已存在
+    """
+    # 检查表格是否已存在
+    if check_table_exists(file_name):
+        logging.info(f"file_exists: {file_name} ")
+        raise FileExistsError(f'表格 "{file_name}" 已存在')
+
+    # 只读取表头，数据部分按分块流式导入
+    headers = read_csv_headers(file_path)
+    logging.info(headers)
+    valid_table_name = valid_table_name_of(file_name)
+    if measurements.is_sensor_csv(headers) and measurements.enabled():
+        rows = measurements.ingest_csv(valid_table_name, headers, file_path, progress=progress)
+        mirror_csv(valid_table_name, headers, file_path)
+        broadcast(invalidate_table_caches, valid_table_name)
+        materialize(valid_table_name, headers, None)
+        return rows
+    # 抽样推断列类型并创建新表格
+    column_types = infer_column_types(headers, file_path)
+    create_table_from_csv(valid_table_name, headers, column_types)
+    # 流式写入数据到新表格（COPY，单事务）
+    rows = _copy_or_merge(valid_table_name, headers, file_path, progress, column_types)
+    broadcast(invalidate_table_caches, valid_table_name)
+    materialize(valid_table_name, headers, None)
+    return rows
+
+
+def _copy_or_merge(valid_table_name, headers, file_path, progress, column_types):
+    """
+    用 COPY 写入新表格。文件中有重复的 (设备编号, 时间) 时 COPY 违反表格的唯一键，整体回滚后
+    改为暂存再按唯一键合并：同一键以最后一行为准，缺少设备编号或时间的行丢弃，与追加导入相同。
+    :return: 写入的行数
+    """
+    try:
+        return copy_csv_data(valid_table_name, headers, file_path, progress=progress, column_types=column_types)
+    except Exception as e:
+        if getattr(getattr(e, 'orig', e), 'pgcode', None) != UNIQUE_VIOLATION:
+            raise
+    logging.info(f"{valid_table_name} 中有重复的 (设备编号, 时间)，改为按唯一键合并导入")
+    rows = upsert_csv_data(valid_table_name, headers, file_path, progress=progress)['inserted']
+    mirror_csv(valid_table_name, headers, file_path)
+    return rows
+
+
+def append_csv_file(file_name, file_path, progress=None, materialize=materialize_anomalies):
+    """
+    追加导入：表格不存在时按新表导入；已存在时暂存新数据并按 (设备编号, 时间) 合并，
+    早于各设备高水位线的行不发送到数据库。用于每天与前一天大部分重叠的网关导出文件。
+    :param materialize: 见 ingest_csv_file
+    :return: {'inserted', 'updated', 'skipped'}
+    """
+    if not check_table_exists(file_name):
+        rows = ingest_csv_file(file_name, file_path, progress, materialize)
+        return {'inserted': rows, 'updated': 0, 'skipped': 0}
+
+    headers = read_csv_headers(file_path)
+    valid_table_name = valid_table_name_of(file_name)
+    if measurements.enabled() and measurements.upload_id_of(valid_table_name) is not None:
+        counts = measurements.append_csv(valid_table_name, headers, file_path, progress=progress)
+        mirror_csv(valid_table_name, headers, file_path, upsert=True)
+    else:
+        counts = upsert_csv_data(valid_table_name, headers, file_path, progress=progress)
+    time_from = counts.pop('time_from')
+    if counts['inserted'] or counts['updated']:
+        broadcast(invalidate_table_caches, valid_table_name, time_from)
+        materialize(valid_table_name, headers, time_from)
+    return counts
+
+
+class ChunkedUploadStore:
+    def __init__(self, chunk_dir):
+        """
+        分块上传的暂存区。每个上传在 chunk_dir/<upload_id>/ 下保存 meta.json 和各分块，
+        服务重启后仍可续传。
+        :param chunk_dir: 暂存根目录
+        """
+        self.chunk_dir = chunk_dir
+        self._lock = threading.Lock()
+
+    def _path(self, upload_id, *parts):
+        if not upload_id.isalnum():
+            raise ValueError("无效的 upload_id")
+        return os.path.join(self.chunk_dir, upload_id, *parts)
+
+    def create(self, filename, total_chunks):
+        """
+        开始一个分块上传。
+        :return: upload_id
+        """
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self._path(upload_id))
+        meta = {'filename': filename, 'total_chunks': int(total_chunks)}
+        with open(self._path(upload_id, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        return upload_id
+
+    def meta(self, upload_id):
+        """
+        :raise KeyError: 上传不存在
+        """
+        try:
+            with open(self._path(upload_id, 'meta.json'), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise KeyError(upload_id)
+
+    def received_chunks(self, upload_id):
+        """
+        已收到的分块序号，客户端据此续传缺失的分块。
+        """
+        return sorted(int(name[:-5]) for name in os.listdir(self._path(upload_id))
+                      if name.endswith('.part'))
+
+    def save_chunk(self, upload_id, index, data, checksum=None):
+        """
+        保存一个分块；提供 checksum（SHA-256 十六进制）时先校验。重复上传同一分块会覆盖。
+        :raise ValueError: 序号越界或校验失败
+        """
+        meta = self.meta(upload_id)
+        if not 0 <= index < meta['total_chunks']:
+            raise ValueError(f"分块序号 {index} 越界")
+        if checksum is not None and hashlib.sha256(data).hexdigest() != checksum.lower():
+            raise ValueError(f"分块 {index} 校验失败")
+        part_path = self._path(upload_id, f"{index}.part")
+        with open(part_path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(part_path + '.tmp', part_path)
+
+    def assemble(self, upload_id, target_path):
+        """
+        所有分块到齐后按序拼接为完整文件，并删除暂存区。
+        :raise ValueError: 分块不完整
+        """
+        meta = self.meta(upload_id)
+        missing = sorted(set(range(meta['total_chunks'])) - set(self.received_chunks(upload_id)))
+        if missing:
+            raise ValueError(f"缺少分块: {missing[:20]}")
+        with self._lock, open(target_path, 'wb') as target:
+            for index in range(meta['total_chunks']):
+                with open(self._path(upload_id, f"{index}.part"), 'rb') as part:
+                    shutil.copyfileobj(part, target)
+        shutil.rmtree(self._path(upload_id), ignore_errors=True)
+        return target_path
+
+
+class IngestQueue:
+    def __init__(self, emit_progress, max_workers=2, progress_interval=0.5,
+                 finished_ttl=3600, max_finished=1000):
+        """
+        后台导入任务队列，多个文件可并行导入，进度通过 emit_progress 推送。
+        :param emit_progress: 回调 emit_progress(job)，job 为任务状态字典
+        :param max_workers: 并行导入的文件数
+        :param progress_interval: 进度推送的最小间隔（秒）
+        :param finished_ttl: 已结束的任务保留的时间（秒），之后不能再查询
+        :param max_finished: 最多保留的已结束任务数
+        """
+        self._emit_progress = emit_progress
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ingest')
+        self.progress_interval = progress_interval
+        self.jobs = {}                                   # 排队或运行中的任务
+        self.finished = TTLCache(maxsize=max_finished, ttl=finished_ttl)
+
+    def get(self, job_id):
+        """
+        :return: 任务状态字典；任务不存在或已结束过久时为 None
+        """
+        return self.jobs.get(job_id) or self.finished.get(job_id)
+
+    def submit_materialize(self, app, table_name, headers, time_from=None, job=None):
+        """
+        在后台更新异常事件与健康性快照，导入在数据提交后即可返回。进度记录在任务状态字典的
+        anomaly_events 字段：queued / running / done / failed。
+        :param job: 所属的导入任务；为 None 时新建一个任务（同步导入的 /api/upload_csv 使用）
+        :return: 任务状态字典
+        """
+        if job is None:
+            job = {'job_id': uuid.uuid4().hex, 'file_name': table_name, 'mode': 'anomaly_events',
+                   'status': 'done', 'message': ''}
+            self.finished.set(job['job_id'], job)
+        job['anomaly_events'] = 'queued'
+        self._executor.submit(self._materialize, app, job, table_name, headers, time_from)
+        return job
+
+    def _materialize(self, app, job, table_name, headers, time_from):
+        job['anomaly_events'] = 'running'
+        self._emit_progress(dict(job))
+        try:
+            with app.app_context():
+                anomaly_events.materialize(table_name, headers, time_from)
+            job['anomaly_events'] = 'done'
+        except Exception as e:
+            logging.error(f"Anomaly events for {table_name} failed: {e}")
+            job.update({'anomaly_events': 'failed', 'anomaly_events_message': str(e)})
+        self._emit_progress(dict(job))
+
+    def submit(self, app, file_name, file_path, mode='create'):
+        """
+        提交导入任务。
+        :param app: Flask 应用，后台线程需要应用上下文访问数据库
+        :param mode: create 导入为新表；append 追加到已有表格
+        :return: 任务状态字典
+        """
+        job = {
+            'job_id': uuid.uuid4().hex,
+            'file_name': file_name,
+            'mode': mode,
+            'status': 'queued',
+            'rows_parsed': 0,
+            'rows_inserted': 0,
+            'bytes_read': 0,
+            'total_bytes': os.path.getsize(file_path),
+            'rows_per_sec': 0.0,
+            'eta_seconds': None,
+            'message': '',
+            'anomaly_events': None
+        }
+        self.jobs[job['job_id']] = job
+        self._emit_progress(dict(job))
+        self._executor.submit(self._run, app, job, file_path)
+        return job
+
+    def _run(self, app, job, file_path):
+        start_time = time.perf_counter()
+        last_emit = [0.0]
+
+        def progress(rows_parsed, rows_inserted, bytes_read):
+            elapsed = max(time.perf_counter() - start_time, 1e-9)
+            bytes_per_sec = bytes_read / elapsed
+            job.update({
+                'rows_parsed': rows_parsed,
+                'rows_inserted': rows_inserted,
+                'bytes_read': bytes_read,
+                'rows_per_sec': rows_inserted / elapsed,
+                'eta_seconds': (job['total_bytes'] - bytes_read) / bytes_per_sec if bytes_per_sec > 0 else None
+            })
+            now = time.perf_counter()
+            if now - last_emit[0] >= self.progress_interval:
+                last_emit[0] = now
+                self._emit_progress(dict(job))
+
+        def materialize(table_name, headers, time_from):
+            self.submit_materialize(app, table_name, headers, time_from, job)
+
+        job['status'] = 'running'
+        self._emit_progress(dict(job))
+        try:
+            with app.app_context():
+                if job['mode'] == 'append':
+                    counts = append_csv_file(job['file_name'], file_path, progress, materialize)
+                    job.update(counts)
+                    rows = counts['inserted'] + counts['updated']
+                else:
+                    rows = ingest_csv_file(job['file_name'], file_path, progress, materialize)
+            job.update({'status': 'done', 'rows_inserted': rows, 'bytes_read': job['total_bytes'],
+                        'eta_seconds': 0, 'message': '文件导入成功'})
+        except Exception as e:
+            logging.error(f"Ingest job <{job['job_id']}> failed: {e}")
+            job.update({'status': 'failed', 'message': f'文件导入失败: {e}'})
+        self.finished.set(job['job_id'], job)
+        self.jobs.pop(job['job_id'], None)
+        self._emit_progress(dict(job))
@@ -0,0 +1,334 @@
+# measurements.py
+"""
+统一的测量数据存储（PostgreSQL）：所有上传文件的数据写入同一张按时间分区的事实表，
+设备和隐患点归一化为维度表；每次上传原来的表名 table_<文件名> 保留为视图。
+
+    store.hazard_points (id, name, code, longitude, latitude)
+    store.devices       (id, device_code, device_name, hazard_point_id)
+    store.uploads       (id, table_name, created_at)
+    store.measurements  (upload_id, device_code, time, x, y, z)  按月 RANGE 分区
+        BRIN (time)                —— 数据按时间追加，BRIN 体积小、范围扫描快
+        B-tree (device_code, time) —— 单设备历史查询
+        UNIQUE (upload_id, device_code, time) —— 与视图的 (设备编号, 时间) 顺序一致，
+            支撑键集分页、按设备读取，以及追加导入时 ON CONFLICT 合并
+
+事实表保存设备编号而不是维度表的代理键，视图按 (设备编号, 时间) 排序和翻页时可以直接走索引，
+不需要对整个上传排序；隐患点、设备名称只在维度表中保存一次，取第一次导入时的值，
+之后的上传只补充缺失的字段，不改变已有视图中显示的内容。
+时间为空的行写入带 CHECK (time IS NULL) 的默认分区，设备编号为空的行同样保留，与单独建表时行数一致。
+事实表放在独立的 store 模式中，不出现在 public 模式的表列表里。
+"""
+import logging
+import os
+import threading
+import time
+import pandas as pd
+from sqlalchemy import text
+import metrics
+from db import (db, stage_csv_data, load_watermarks, save_watermarks, invalidate_table_metadata,
+                INGEST_CHUNK_SIZE, INTERNAL_SCHEMA)
+
+SCHEMA = INTERNAL_SCHEMA
+SENSOR_HEADERS = ['隐患点名称', '隐患点编号', '经度', '维度', '设备名称', '设备编号', '时间', '采集值x', '采集值y', '采集值z']
+STAGING_TYPES = {
+    '经度': 'DOUBLE PRECISION',
+    '维度': 'DOUBLE PRECISION',
+    '时间': 'TIMESTAMP',
+    '采集值x': 'DOUBLE PRECISION',
+    '采集值y': 'DOUBLE PRECISION',
+    '采集值z': 'DOUBLE PRECISION',
+}
+# 视图中各列对应的表达式（m: measurements, d: devices, h: hazard_points）
+VIEW_COLUMNS = {
+    '隐患点名称': 'h.name',
+    '隐患点编号': 'h.code',
+    '经度': 'h.longitude',
+    '维度': 'h.latitude',
+    '设备名称': 'd.device_name',
+    '设备编号': 'm.device_code',
+    '时间': 'm.time',
+    '采集值x': 'm.x',
+    '采集值y': 'm.y',
+    '采集值z': 'm.z',
+}
+
+SCHEMA_SQL = f"""
+CREATE SCHEMA IF NOT EXISTS {SCHEMA};
+CREATE TABLE IF NOT EXISTS {SCHEMA}.hazard_points (
+    id SERIAL PRIMARY KEY,
+    name TEXT NOT NULL,
+    code TEXT NOT NULL,
+    longitude DOUBLE PRECISION,
+    latitude DOUBLE PRECISION,
+    UNIQUE (name, code)
+);
+CREATE TABLE IF NOT EXISTS {SCHEMA}.devices (
+    id SERIAL PRIMARY KEY,
+    device_code TEXT NOT NULL UNIQUE,
+    device_name TEXT,
+    hazard_point_id INTEGER REFERENCES {SCHEMA}.hazard_points (id)
+);
+CREATE TABLE IF NOT EXISTS {SCHEMA}.uploads (
+    id SERIAL PRIMARY KEY,
+    table_name TEXT NOT NULL UNIQUE,
+    created_at TIMESTAMP NOT NULL DEFAULT now()
+);
+CREATE TABLE IF NOT EXISTS {SCHEMA}.measurements (
+    upload_id INTEGER NOT NULL,
+    device_code TEXT,
+    time TIMESTAMP,
+    x DOUBLE PRECISION,
+    y DOUBLE PRECISION,
+    z DOUBLE PRECISION,
+    CONSTRAINT measurements_upload_device_time UNIQUE (upload_id, device_code, time)
+) PARTITION BY RANGE (time);
+CREATE TABLE IF NOT EXISTS {SCHEMA}.measurements_untimed PARTITION OF {SCHEMA}.measurements (
+    CONSTRAINT measurements_untimed_null_time CHECK (time IS NULL)
+) DEFAULT;
+CREATE INDEX IF NOT EXISTS measurements_time_brin ON {SCHEMA}.measurements USING BRIN (time);
+CREATE INDEX IF NOT EXISTS measurements_device_code_time ON {SCHEMA}.measurements (device_code, time);
+"""
+
+_lock = threading.Lock()
+_schema_ready = False
+_partitions = set()     # 已确认存在的分区（月份第一天）
+
+
+def is_sensor_csv(headers):
+    """
+    只有列与标准传感器导出格式完全一致的文件才写入统一存储，其他文件仍按原方式单独建表。
+    """
+    return sorted(headers) == sorted(SENSOR_HEADERS)
+
+
+def enabled():
+    """
+    统一存储依赖 PostgreSQL 的声明式分区，嵌入式模式或其他数据库下不启用。
+    """
+    import db as db_module
+    if not db_module.unified_store or db_module.embedded_only:
+        return False
+    return db.session.get_bind().dialect.name == 'postgresql'
+
+
+def ensure_schema():
+    """
+    创建统一存储的模式、维度表、分区事实表和索引（幂等）。
+    """
+    global _schema_ready
+    with _lock:
+        if _schema_ready:
+            return
+        with db.engine.begin() as connection:
+            for statement in SCHEMA_SQL.split(';'):
+                if statement.strip():
+                    connection.execute(text(statement))
+        _schema_ready = True
+
+
+def _view_sql(table_name, headers, upload_id):
+    """
+    上传 upload_id 对应的视图，列与原来单独建表时相同。维度表用 LEFT JOIN，设备编号为空的行也保留。
+    """
+    select_list = ', '.join(f"{VIEW_COLUMNS[header]} AS {header}" for header in headers)
+    return f"""
+        CREATE VIEW {table_name} AS
+        SELECT {select_list}
+        FROM {SCHEMA}.measurements m
+        LEFT JOIN {SCHEMA}.devices d ON d.device_code = m.device_code
+        LEFT JOIN {SCHEMA}.hazard_points h ON h.id = d.hazard_point_id
+        WHERE m.upload_id = {int(upload_id)}
+    """
+
+
+def _month_start(value):
+    return pd.Timestamp(value).to_period('M').to_timestamp()
+
+
+def partition_name(month):
+    return f"measurements_{month:%Y%m}"
+
+
+def ensure_partitions(time_min, time_max):
+    """
+    确保覆盖 [time_min, time_max] 的按月分区存在。
+    使用独立的短事务提交，避免在导入事务中长时间持有父表上的锁。
+    """
+    month = _month_start(time_min)
+    last = _month_start(time_max)
+    missing = []
+    while month <= last:
+        if month not in _partitions:
+            missing.append(month)
+        month = month + pd.offsets.MonthBegin(1)
+    if not missing:
+        return
+    with _lock, db.engine.begin() as connection:
+        for month in missing:
+            upper = month + pd.offsets.MonthBegin(1)
+            connection.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {SCHEMA}.{partition_name(month)} "
+                f"PARTITION OF {SCHEMA}.measurements "
+                f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{upper:%Y-%m-%d}')"))
+            logging.info(f"Created partition {SCHEMA}.{partition_name(month)}")
+    _partitions.update(missing)
+
+
+def ingest_csv(table_name, headers, file_path, chunk_size=INGEST_CHUNK_SIZE, delimiter='\t', progress=None):
+    """
+    将标准传感器 CSV 作为一次新上传导入统一存储，并创建视图 table_<文件名>，列与原来单独建表时相同。
+    :param table_name: 带 table_ 前缀的视图名
+    :param progress: 进度回调，见 db.copy_csv_data
+    :return: 写入事实表的行数
+    """
+    return _load(table_name, headers, file_path, chunk_size, delimiter, progress, create=True)['inserted']
+
+
+def append_csv(table_name, headers, file_path, chunk_size=INGEST_CHUNK_SIZE, delimiter='\t', progress=None):
+    """
+    追加导入到已有的上传：早于各设备高水位线的行直接跳过，其余按 (设备, 时间) 合并。
+    :return: {'inserted', 'updated', 'skipped', 'time_from'}
+    """
+    return _load(table_name, headers, file_path, chunk_size, delimiter, progress, create=False)
+
+
+def upload_id_of(table_name):
+    """
+    :return: 视图对应的上传编号；表格不在统一存储中时返回 None
+    """
+    ensure_schema()
+    return db.session.execute(text(f"SELECT id FROM {SCHEMA}.uploads WHERE table_name = :table_name"),
+                              {'table_name': table_name}).scalar()
+
+
+def _load(table_name, headers, file_path, chunk_size, delimiter, progress, create):
+    """
+    1. 分块 COPY 到临时暂存表（不触及事实表）；
+    2. 按暂存数据的时间范围补齐分区；
+    3. 在 SQL 中合并隐患点、设备维度；
+    4. 按 (upload_id, device_code, time) 用 ON CONFLICT 合并到事实表，取值不变的行不改写；
+       新上传中时间或设备编号为空的行无法合并，原样写入（追加导入时与单独建表的表格一样丢弃）；
+    5. 新上传创建视图，并推进高水位线。
+    全部在一个事务中完成。
+    """
+    ensure_schema()
+    start_time = time.perf_counter()
+    staging = "sps_staging"   # 临时表只对当前连接可见，提交时删除
+    latest = f"""(SELECT DISTINCT ON (设备编号, 时间) 设备编号 AS device_code, 时间 AS time,
+                         采集值x AS x, 采集值y AS y, 采集值z AS z
+                  FROM {staging} WHERE 设备编号 IS NOT NULL AND 时间 IS NOT NULL
+                  ORDER BY 设备编号, 时间, _seq DESC)"""
+    try:
+        if create:
+            upload_id = db.session.execute(
+                text(f"INSERT INTO {SCHEMA}.uploads (table_name) VALUES (:table_name) RETURNING id"),
+                {'table_name': table_name}).scalar()
+            watermarks = None
+        else:
+            upload_id = upload_id_of(table_name)
+            if upload_id is None:
+                raise ValueError(f"表格 {table_name} 不在统一测量存储中")
+            watermarks = load_watermarks(table_name)
+        rows_parsed, _ = stage_csv_data(
+            staging, headers, file_path, {header: STAGING_TYPES.get(header, 'TEXT') for header in headers},
+            watermarks, chunk_size, delimiter, progress, keyed_only=not create)
+
+        time_min, time_max = db.session.execute(text(f"SELECT MIN(时间), MAX(时间) FROM {staging}")).one()
+        if time_min is not None:
+            ensure_partitions(time_min, time_max)
+
+        db.session.execute(text(f"""
+            INSERT INTO {SCHEMA}.hazard_points (name, code, longitude, latitude)
+            SELECT DISTINCT ON (name, code) name, code, 经度, 维度
+            FROM (SELECT COALESCE(隐患点名称, '') AS name, COALESCE(隐患点编号, '') AS code, 经度, 维度
+                  FROM {staging} WHERE 设备编号 IS NOT NULL) s
+            ORDER BY name, code, 经度 NULLS LAST
+            ON CONFLICT (name, code) DO UPDATE
+            SET longitude = COALESCE({SCHEMA}.hazard_points.longitude, EXCLUDED.longitude),
+                latitude = COALESCE({SCHEMA}.hazard_points.latitude, EXCLUDED.latitude)
+        """))
+        db.session.execute(text(f"""
+            INSERT INTO {SCHEMA}.devices (device_code, device_name, hazard_point_id)
+            SELECT DISTINCT ON (s.设备编号) s.设备编号, s.设备名称, h.id
+            FROM {staging} s
+            JOIN {SCHEMA}.hazard_points h
+              ON h.name = COALESCE(s.隐患点名称, '') AND h.code = COALESCE(s.隐患点编号, '')
+            WHERE s.设备编号 IS NOT NULL
+            ORDER BY s.设备编号, s.时间 DESC NULLS LAST
+            ON CONFLICT (device_code) DO UPDATE
+            SET device_name = COALESCE({SCHEMA}.devices.device_name, EXCLUDED.device_name)
+        """))
+        distinct_rows, matched = db.session.execute(text(f"""
+            SELECT COUNT(*), COUNT(m.upload_id) FROM {latest} s
+            LEFT JOIN {SCHEMA}.measurements m
+              ON m.upload_id = :upload_id AND m.device_code = s.device_code AND m.time = s.time
+        """), {'upload_id': upload_id}).one()
+        changed = db.session.execute(text(f"""
+            INSERT INTO {SCHEMA}.measurements AS m (upload_id, device_code, time, x, y, z)
+            SELECT :upload_id, device_code, time, x, y, z FROM {latest} s
+            ON CONFLICT (upload_id, device_code, time) DO UPDATE
+            SET x = EXCLUDED.x, y = EXCLUDED.y, z = EXCLUDED.z
+            WHERE (m.x, m.y, m.z) IS DISTINCT FROM (EXCLUDED.x, EXCLUDED.y, EXCLUDED.z)
+        """), {'upload_id': upload_id}).rowcount
+
+        if create:
+            unkeyed = db.session.execute(text(f"""
+                INSERT INTO {SCHEMA}.measurements (upload_id, device_code, time, x, y, z)
+                SELECT :upload_id, 设备编号, 时间, 采集值x, 采集值y, 采集值z FROM {staging}
+                WHERE 设备编号 IS NULL OR 时间 IS NULL
+            """), {'upload_id': upload_id}).rowcount
+            distinct_rows += unkeyed
+            changed += unkeyed
+            db.session.execute(text(_view_sql(table_name, headers, upload_id)))
+        save_watermarks(table_name, staging)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"写入统一存储失败: {e}")
+        raise
+    if create:
+        invalidate_table_metadata(table_name)
+
+    inserted = distinct_rows - matched
+    updated = changed - inserted
+    counts = {'inserted': inserted, 'updated': updated, 'skipped': rows_parsed - inserted - updated,
+              'time_from': time_min}
+    elapsed = max(time.perf_counter() - start_time, 1e-9)
+    metrics.ingest_rows_total.inc(inserted + updated)
+    metrics.ingest_rows_per_second.set(rows_parsed / elapsed)
+    if progress is not None:
+        progress(rows_parsed, inserted + updated, os.path.getsize(file_path))
+    logging.info(f"统一存储导入成功: {table_name} upload_id={upload_id} inserted={inserted} "
+                 f"updated={updated} skipped={counts['skipped']} elapsed={elapsed:.3f}s "
+                 f"rows/s={rows_parsed / elapsed:.1f}")
+    return counts
+
+
+def device_history(device_code, time_from=None, time_to=None, limit=1000, after_time=None):
+    """
+    跨全部上传查询某设备的历史数据，按时间排序。
+    时间条件直接作用于分区键，只扫描相关的月分区；设备条件走 (device_code, time) 索引。
+    :param time_from: 时间下界（包含）
+    :param time_to: 时间上界（不包含）
+    :param after_time: 上一页最后一行的时间，用于翻页
+    :return: [(时间, x, y, z, 来源表名)]；设备不存在时返回空列表
+    """
+    ensure_schema()
+    conditions = ["m.device_code = :device_code", "m.time IS NOT NULL"]
+    params = {'device_code': device_code, 'limit': limit}
+    if time_from is not None:
+        conditions.append("m.time >= :time_from")
+        params['time_from'] = time_from
+    if time_to is not None:
+        conditions.append("m.time < :time_to")
+        params['time_to'] = time_to
+    if after_time is not None:
+        conditions.append("m.time > :after_time")
+        params['after_time'] = after_time
+    result = db.session.execute(text(f"""
+        SELECT m.time, m.x, m.y, m.z, u.table_name
+        FROM {SCHEMA}.measurements m JOIN {SCHEMA}.uploads u ON u.id = m.upload_id
+        WHERE {' AND '.join(conditions)}
+        ORDER BY m.time LIMIT :limit
+    """), params)
+    return result.fetchall()
@@ -0,0 +1,260 @@
+# metrics.py
+import bisect
+import collections
+import os
+import re
+import sys
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+class _Metric:
+    type_name = ''
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self, const_labels=()):
+        """
+        :param const_labels: 附加到每个样本的标签 [(名称, 值)]
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples(list(const_labels)))
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    type_name = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values = collections.defaultdict(float)
+        if not self.labelnames:
+            self._values[()] = 0.0
+
+    def inc(self, amount=1.0, **labels):
+        with self._lock:
+            self._values[self._key(labels)] += amount
+
+    def _samples(self, extra):
+        with self._lock:
+            return [f"{self.name}{_format_labels(self.labelnames, key, extra)} {value}"
+                    for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    type_name = 'gauge'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values = {} if self.labelnames else {(): 0.0}
+        self._function = None
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, function):
+        """
+        采集时调用 function() 取值（仅用于无标签的指标）。
+        """
+        self._function = function
+
+    def _samples(self, extra):
+        if self._function is not None:
+            return [f"{self.name}{_format_labels((), (), extra)} {self._function()}"]
+        with self._lock:
+            return [f"{self.name}{_format_labels(self.labelnames, key, extra)} {value}"
+                    for key, value in self._values.items()]
+
+
+class Histogram(_Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self._counts = {}   # key -> [各桶计数..., +Inf 计数]
+        self._sums = collections.defaultdict(float)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sums[key] += value
+
+    def time(self, **labels):
+        """
+        计时上下文：with histogram.time(route='/'): ...
+        """
+        return _Timer(self, labels)
+
+    def _samples(self, extra):
+        lines = []
+        with self._lock:
+            for key, counts in self._counts.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, extra + [('le', le)])} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key, extra)} {self._sums[key]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key, extra)} {cumulative}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+        self.histogram.observe(self.elapsed, **self.labels)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self.const_labels = {}
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def set_const_labels(self, **labels):
+        """
+        设置附加到每个样本的标签。多进程部署时各工作进程的指标只统计本进程，
+        以 worker 标签区分，由 Prometheus 分别抓取各进程的端口后按标签聚合。
+        """
+        self.const_labels = labels
+
+    def render(self):
+        """
+        Prometheus 文本格式（0.0.4）。
+        """
+        const_labels = list(self.const_labels.items())
+        return '\n'.join(metric.render(const_labels) for metric in self._metrics) + '\n'
+
+
+registry = Registry()
+
+http_request_seconds = registry.register(Histogram(
+    'sps_http_request_seconds', 'HTTP request latency by route.', ('method', 'route', 'status')))
+sql_statement_seconds = registry.register(Histogram(
+    'sps_sql_statement_seconds', 'SQL statement execution time by normalized statement.', ('statement',)))
+ingest_rows_total = registry.register(Counter(
+    'sps_ingest_rows_total', 'Rows written by CSV ingestion.'))
+ingest_rows_per_second = registry.register(Gauge(
+    'sps_ingest_rows_per_second', 'Throughput of the most recent CSV ingestion.'))
+forecaster_window_seconds = registry.register(Histogram(
+    'sps_forecaster_window_seconds', 'Forecaster compute time per window.'))
+socketio_emits_total = registry.register(Counter(
+    'sps_socketio_emits_total', 'Socket.IO messages emitted by event.', ('event',)))
+prediction_sessions_active = registry.register(Gauge(
+    'sps_prediction_sessions_active', 'Running prediction sessions.'))
+socketio_queue_depth = registry.register(Gauge(
+    'sps_socketio_queue_depth', 'Prediction steps waiting to be emitted to clients.'))
+forecast_cache_requests_total = registry.register(Counter(
+    'sps_forecast_cache_requests_total', 'Forecast cache lookups by result (hit, miss, shared).', ('result',)))
+forecast_cache_bytes = registry.register(Gauge(
+    'sps_forecast_cache_bytes', 'Memory held by cached forecast results.'))
+
+
+_TABLE_PATTERN = re.compile(r'\btable_\w+')
+_LITERAL_PATTERN = re.compile(r"'[^']*'|\b\d+\b")
+_SPACE_PATTERN = re.compile(r'\s+')
+
+
+def normalize_statement(statement, max_length=80):
+    """
+    归一化 SQL 语句作为指标标签：合并空白、用占位符替换表名和字面量，限制标签的基数。
+    """
+    statement = _SPACE_PATTERN.sub(' ', statement).strip()
+    statement = _TABLE_PATTERN.sub('table_?', statement)
+    statement = _LITERAL_PATTERN.sub('?', statement)
+    return statement[:max_length]
+
+
+def instrument_sqlalchemy():
+    """
+    通过 SQLAlchemy 引擎事件记录每条 SQL 语句的耗时。
+    """
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    if getattr(instrument_sqlalchemy, 'installed', False):
+        return
+    instrument_sqlalchemy.installed = True
+
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('sps_query_start', []).append(time.perf_counter())
+
+    @event.listens_for(Engine, 'after_cursor_execute')
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('sps_query_start')
+        if starts:
+            sql_statement_seconds.observe(time.perf_counter() - starts.pop(),
+                                          statement=normalize_statement(statement))
+
+
+class SamplingProfiler:
+    def __init__(self, thread_id=None, interval=0.005):
+        """
+        采样分析器：后台线程按固定间隔采集目标线程的调用栈，输出折叠栈（可用于火焰图）。
+        :param thread_id: 目标线程编号，默认为当前线程
+        :param interval: 采样间隔（秒）
+        """
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.samples = collections.Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        return self
+
+    def collapsed(self):
+        """
+        折叠栈格式：每行 "帧1;帧2;... 采样数"。
+        """
+        return '\n'.join(f"{stack} {count}" for stack, count in self.samples.most_common())
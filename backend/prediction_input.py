@@ -0,0 +1,302 @@
+# prediction_input.py
+import logging
+import queue
+import threading
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import text, bindparam
+import db as db_module
+from db import db
+
+VALUE_COLUMNS = ['采集值x', '采集值y', '采集值z']
+FETCH_SIZE = 2000           # 服务端游标每次取回的行数
+DEFAULT_STEP = 600          # 默认重采样步长（秒），设备每 10 分钟上报一次
+
+
+def _parse_time(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value))
+
+
+def get_time_range(table_name, device_ids, time_from=None, time_to=None):
+    """
+    查询若干设备在给定区间内的首末时间，由 (设备编号, 时间) 索引支撑。
+    :return: (最早时间, 最晚时间)，无数据时为 (None, None)
+    """
+    store = db_module.analytics_for(table_name)
+    if store is not None:
+        return store.time_range(table_name, device_ids, time_from, time_to)
+    conditions = ["设备编号 IN :device_ids", "时间 IS NOT NULL"]
+    params = {'device_ids': list(device_ids)}
+    if time_from is not None:
+        conditions.append("时间 >= :time_from")
+        params['time_from'] = time_from
+    if time_to is not None:
+        conditions.append("时间 < :time_to")
+        params['time_to'] = time_to
+    query = text(f"SELECT MIN(时间), MAX(时间) FROM {table_name} WHERE {' AND '.join(conditions)}"
+                 ).bindparams(bindparam('device_ids', expanding=True))
+    return tuple(db.session.execute(query, params).fetchone())
+
+
+def stream_device_readings(table_name, device_id, time_from=None, time_to=None, fetch_size=FETCH_SIZE):
+    """
+    通过服务端游标按时间顺序流式读取某设备的 (时间, x, y, z)，不一次性加载全部历史。
+    """
+    store = db_module.analytics_for(table_name)
+    if store is not None:
+        yield from store.stream_device(table_name, device_id, time_from, time_to, fetch_size)
+        return
+    conditions = ["设备编号 = :device_id", "时间 IS NOT NULL"]
+    params = {'device_id': device_id}
+    if time_from is not None:
+        conditions.append("时间 >= :time_from")
+        params['time_from'] = time_from
+    if time_to is not None:
+        conditions.append("时间 < :time_to")
+        params['time_to'] = time_to
+    query = text(f"SELECT 时间, {', '.join(VALUE_COLUMNS)} FROM {table_name} "
+                 f"WHERE {' AND '.join(conditions)} ORDER BY 设备编号, 时间")
+    with db.engine.connect() as connection:
+        result = connection.execution_options(
+            stream_results=True, yield_per=fetch_size).execute(query, params)
+        for row in result:
+            yield row
+
+
+def stream_devices_readings(table_name, device_ids, time_from=None, time_to=None, fetch_size=FETCH_SIZE):
+    """
+    通过一个服务端游标按时间顺序流式读取若干设备的 (设备编号, 时间, x, y, z)。
+    设备再多也只占用一个连接，不会因每个设备一个游标耗尽连接池。
+    """
+    store = db_module.analytics_for(table_name)
+    if store is not None:
+        yield from store.stream_devices(table_name, device_ids, time_from, time_to, fetch_size)
+        return
+    conditions = ["设备编号 IN :device_ids", "时间 IS NOT NULL"]
+    params = {'device_ids': list(device_ids)}
+    if time_from is not None:
+        conditions.append("时间 >= :time_from")
+        params['time_from'] = time_from
+    if time_to is not None:
+        conditions.append("时间 < :time_to")
+        params['time_to'] = time_to
+    query = text(f"SELECT 设备编号, 时间, {', '.join(VALUE_COLUMNS)} FROM {table_name} "
+                 f"WHERE {' AND '.join(conditions)} ORDER BY 时间, 设备编号"
+                 ).bindparams(bindparam('device_ids', expanding=True))
+    with db.engine.connect() as connection:
+        result = connection.execution_options(
+            stream_results=True, yield_per=fetch_size).execute(query, params)
+        for row in result:
+            yield row
+
+
+def device_time_ranges(table_name, site_columns=(), changed_from=None):
+    """
+    每个设备的首末时间与所属隐患点。
+    :param site_columns: 需要一并返回的隐患点列，如 ('隐患点名称', '隐患点编号')
+    :param changed_from: 只返回最晚时间不早于该时间的设备（追加导入后受影响的设备）
+    :return: [(设备编号, 最早时间, 最晚时间, *隐患点列)]
+    """
+    store = db_module.analytics_for(table_name)
+    if store is not None:
+        return store.device_time_ranges(table_name, site_columns, changed_from)
+    sites = ''.join(f", MIN({column})" for column in site_columns)
+    having = "" if changed_from is None else "HAVING MAX(时间) >= :changed_from"
+    return db.session.execute(text(f"""
+        SELECT 设备编号, MIN(时间), MAX(时间){sites} FROM {table_name}
+        WHERE 设备编号 IS NOT NULL AND 时间 IS NOT NULL
+        GROUP BY 设备编号 {having} ORDER BY 设备编号
+    """), {'changed_from': changed_from}).fetchall()
+
+
+def last_complete_reading_time(table_name, device_id, at):
+    """
+    某设备不晚于 at 的最后一次三个采集值都有效的读数时间。从该读数开始重采样，
+    与从头重采样在 at 之后得到的值相同，用于只重新计算末尾的窗口。
+    :return: 时间；没有这样的读数时为 None
+    """
+    store = db_module.analytics_for(table_name)
+    if store is not None:
+        return store.last_complete_time(table_name, device_id, at)
+    not_null = ' AND '.join(f"{column} IS NOT NULL" for column in VALUE_COLUMNS)
+    return db.session.execute(text(f"""
+        SELECT MAX(时间) FROM {table_name}
+        WHERE 设备编号 = :device_id AND 时间 <= :at AND {not_null}
+    """), {'device_id': device_id, 'at': at}).scalar()
+
+
+def resample_readings(rows, grid_start, step, n_steps):
+    """
+    将不规则时间戳的读数重采样到固定步长的网格上。
+    每个网格点取不晚于该时刻的最后一次读数（缺测时沿用上一个值），
+    首次读数之前为 0（预测器将 0 视为无效值）。
+    :param rows: 按时间排序的 (时间, x, y, z) 迭代器
+    :param grid_start: 网格起点
+    :param step: 网格步长（timedelta）
+    :param n_steps: 网格点数
+    :return: 逐个网格点产生形状为 (V,) 的数组
+    """
+    last = np.zeros(len(VALUE_COLUMNS))
+    rows = iter(rows)
+    pending = next(rows, None)
+    for k in range(n_steps):
+        grid_time = grid_start + k * step
+        while pending is not None and pending[0] <= grid_time:
+            for v, value in enumerate(pending[1:]):
+                if value is not None:
+                    last[v] = float(value)
+            pending = next(rows, None)
+        yield last.copy()
+
+
+def resample_devices_readings(rows, device_ids, grid_start, step, n_steps):
+    """
+    与 resample_readings 相同，但同时重采样多个设备：rows 为按时间排序的
+    (设备编号, 时间, x, y, z)，按设备编号分到各自的通道。
+    :return: 逐个网格点产生形状为 (C, V) 的数组，C 与 device_ids 的顺序一致
+    """
+    channel_of = {str(device_id): c for c, device_id in enumerate(device_ids)}
+    last = np.zeros((len(device_ids), len(VALUE_COLUMNS)))
+    rows = iter(rows)
+    pending = next(rows, None)
+    for k in range(n_steps):
+        grid_time = grid_start + k * step
+        while pending is not None and pending[1] <= grid_time:
+            channel = last[channel_of[str(pending[0])]]
+            for v, value in enumerate(pending[2:]):
+                if value is not None:
+                    channel[v] = float(value)
+            pending = next(rows, None)
+        yield last.copy()
+
+
+def iter_table_windows(table_name, device_ids, T, T_prime, time_from=None, time_to=None,
+                       step=DEFAULT_STEP, dtype=np.float64):
+    """
+    从数据库流式生成形状为 (T+T', C, V) 的滑动窗口，C 为设备数，窗口每次右移 T'。
+    内存占用只与窗口长度有关。
+    :param dtype: 窗口的数据类型，np.float32 时窗口与预取队列的内存减半
+    """
+    time_from, time_to = _parse_time(time_from), _parse_time(time_to)
+    first_time, last_time = get_time_range(table_name, device_ids, time_from, time_to)
+    if first_time is None:
+        logging.info(f"No readings in <{table_name}> for devices {device_ids}.")
+        return
+    step = timedelta(seconds=step)
+    n_steps = int((last_time - first_time) / step) + 1
+    readings = stream_devices_readings(table_name, device_ids, time_from, time_to)
+
+    window_size = T + T_prime
+    window = np.zeros((window_size, len(device_ids), len(VALUE_COLUMNS)), dtype=dtype)
+    filled = 0
+    for step_values in resample_devices_readings(readings, device_ids, first_time, step, n_steps):
+        window[filled] = step_values
+        filled += 1
+        if filled == window_size:
+            yield window.copy()
+            # 保留后 T 步作为下一个窗口的历史部分
+            window[:T] = window[T_prime:]
+            filled = T
+
+
+def window_starts(table_name, device_ids, T, T_prime, time_from=None, time_to=None,
+                  step=DEFAULT_STEP):
+    """
+    只查询首末时间，计算 iter_table_windows 将产生的各窗口的起点，不读取数据。
+    :return: 窗口起点列表，与 iter_table_windows 的输出一一对应
+    """
+    time_from, time_to = _parse_time(time_from), _parse_time(time_to)
+    first_time, last_time = get_time_range(table_name, device_ids, time_from, time_to)
+    if first_time is None:
+        return []
+    step = timedelta(seconds=step)
+    n_steps = int((last_time - first_time) / step) + 1
+    if n_steps < T + T_prime:
+        return []
+    return [first_time + k * T_prime * step for k in range((n_steps - T - T_prime) // T_prime + 1)]
+
+
+class IndexedWindows:
+    def __init__(self, factory):
+        """
+        按序号按需取窗口：第一次取窗口时才调用 factory() 开始读取，之后只向前推进。
+        预测结果命中缓存的窗口不需要读取；跳过的窗口只读取不计算。
+        :param factory: 返回窗口迭代器的函数，如 lambda: WindowPrefetcher(iter_table_windows(...), app)
+        """
+        self._factory = factory
+        self._windows = None
+        self._position = 0
+
+    def get(self, index):
+        if self._windows is None:
+            self._windows = self._factory()
+        if index < self._position:
+            raise IndexError("窗口只能向前读取")
+        while True:
+            window = next(self._windows)
+            self._position += 1
+            if self._position > index:
+                return window
+
+    def close(self):
+        if self._windows is not None and hasattr(self._windows, 'close'):
+            self._windows.close()
+
+
+class WindowPrefetcher:
+    def __init__(self, windows, app, depth=2):
+        """
+        在后台线程中预取下一个窗口，使数据库读取与当前窗口的计算重叠。
+        :param windows: 窗口生成器
+        :param app: Flask 应用，后台线程需要应用上下文访问数据库
+        :param depth: 预取队列深度
+        """
+        self._windows = windows
+        self._app = app
+        self._queue = queue.Queue(maxsize=depth)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+        self._thread.start()
+
+    _END = object()
+
+    def _put(self, item):
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self):
+        with self._app.app_context():
+            try:
+                for window in self._windows:
+                    if not self._put(window):
+                        break
+            except Exception as e:
+                logging.error(f"Prefetching prediction windows failed: {e}")
+                self._put(e)
+            finally:
+                self._windows.close()
+                self._put(self._END)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        item = self._queue.get()
+        if item is self._END:
+            raise StopIteration
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def close(self):
+        """
+        停止预取并释放数据库游标。
+        """
+        self._stopped.set()
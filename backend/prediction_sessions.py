@@ -0,0 +1,257 @@
+# prediction_sessions.py
+import queue
+import threading
+import uuid
+import logging
+
+
+class SessionLimitError(Exception):
+    """
+    并发预测会话数达到上限时抛出。
+    """
+    pass
+
+
+class PredictionSession:
+    def __init__(self, session_id, owner_sid, params):
+        """
+        一次预测运行的控制状态。
+        :param session_id: 会话编号
+        :param owner_sid: 发起预测的客户端 Socket.IO sid
+        :param params: 前端发送的预测参数
+        """
+        self.session_id = session_id
+        self.room = f"prediction_{session_id}"  # 该会话专属的 Socket.IO 房间
+        self.owner_sid = owner_sid
+        self.params = params
+        self.stopped = False
+        self.paused = False
+        self.task = None
+        self.streamer = None    # 帧模式下的 FrameStreamer
+
+    def stop(self):
+        self.stopped = True
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+
+    def wait(self, seconds, sleep, tick=0.1, on_tick=None):
+        """
+        非阻塞地等待一段时间，暂停期间不计时。
+        :param seconds: 等待时长（秒）
+        :param sleep: 让出执行权的睡眠函数，如 socketio.sleep
+        :param tick: 检查停止/暂停标志的间隔
+        :param on_tick: 每个间隔调用一次的回调，如按帧率发送数据
+        :return: False 表示会话已被停止，调用方应结束运行
+        """
+        remaining = seconds
+        while not self.stopped and (self.paused or remaining > 0):
+            step = tick if self.paused else min(tick, remaining)
+            sleep(step)
+            if not self.paused:
+                remaining -= step
+            if on_tick is not None:
+                on_tick()
+        return not self.stopped
+
+
+class SessionRegistry:
+    def __init__(self, max_sessions=8):
+        """
+        预测会话登记表，限制同时运行的会话数。
+        :param max_sessions: 默认的并发会话上限
+        """
+        self.max_sessions = max_sessions
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def create(self, owner_sid, params, max_sessions=None):
+        """
+        登记一个新会话。
+        :raise SessionLimitError: 会话数已达上限
+        """
+        limit = self.max_sessions if max_sessions is None else max_sessions
+        with self._lock:
+            if len(self._sessions) >= limit:
+                raise SessionLimitError(f"预测会话数已达上限 {limit}")
+            session = PredictionSession(uuid.uuid4().hex, owner_sid, params)
+            self._sessions[session.session_id] = session
+        logging.info(f"Prediction session <{session.session_id}> created by {owner_sid}.")
+        return session
+
+    def get(self, session_id):
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def remove(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None)
+
+    def sessions_of(self, owner_sid):
+        """
+        返回某个客户端发起的全部会话。
+        """
+        with self._lock:
+            return [s for s in self._sessions.values() if s.owner_sid == owner_sid]
+
+    def stop_owner(self, owner_sid):
+        """
+        停止某个客户端的全部会话（断开连接时调用）。
+        """
+        sessions = self.sessions_of(owner_sid)
+        for session in sessions:
+            session.stop()
+        return len(sessions)
+
+    def pending_steps(self):
+        """
+        所有会话中等待发送给客户端的时间步数。
+        """
+        with self._lock:
+            streamers = [s.streamer for s in self._sessions.values() if s.streamer is not None]
+        return sum(streamer.pending_steps for streamer in streamers)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+
+class SharedPredictionSession(PredictionSession):
+    def __init__(self, session_id, owner_sid, params, registry):
+        """
+        多进程部署中的会话：停止/暂停标志保存在共享状态表中，
+        客户端所连接的进程发出的控制与实际运行预测的进程看到同一状态。
+        :param registry: SharedSessionRegistry
+        """
+        self._registry = None
+        super().__init__(session_id, owner_sid, params)
+        self._registry = registry
+
+    @property
+    def stopped(self):
+        return self._registry.state_of(self.session_id) in (None, 'stopped')
+
+    @stopped.setter
+    def stopped(self, value):
+        if self._registry is not None and value:
+            self._registry.set_state(self.session_id, 'stopped')
+
+    @property
+    def paused(self):
+        return self._registry.state_of(self.session_id) == 'paused'
+
+    @paused.setter
+    def paused(self, value):
+        if self._registry is not None:
+            self._registry.set_state(self.session_id, 'paused' if value else 'running')
+
+
+class SharedSessionRegistry:
+    def __init__(self, cluster, max_sessions=8):
+        """
+        多进程部署的会话登记表：会话状态保存在 cluster 的共享状态表中，预测任务放入共享队列，
+        由有空闲槽位的工作进程领取，因此会话可以在与客户端连接不同的进程中运行。
+        :param cluster: cluster.Cluster
+        :param max_sessions: 每个工作进程同时运行的会话上限，整个集群的上限为其乘以进程数
+        """
+        self.cluster = cluster
+        self.max_sessions = max_sessions
+        self._running = {}      # 在本进程中运行的会话
+        self._lock = threading.Lock()
+
+    def create(self, owner_sid, params, max_sessions=None):
+        """
+        登记一个新会话，之后需调用 submit 放入任务队列。
+        :raise SessionLimitError: 整个集群的会话数已达上限
+        """
+        limit = (self.max_sessions if max_sessions is None else max_sessions) * self.cluster.workers
+        session_id = uuid.uuid4().hex
+        with self.cluster.lock:
+            if len(self.cluster.sessions) >= limit:
+                raise SessionLimitError(f"预测会话数已达上限 {limit}")
+            self.cluster.sessions[session_id] = (owner_sid, 'running', self.cluster.index, None)
+        logging.info(f"Prediction session <{session_id}> created by {owner_sid}.")
+        return SharedPredictionSession(session_id, owner_sid, params, self)
+
+    def submit(self, session):
+        self.cluster.jobs.put((session.session_id, session.owner_sid, session.params))
+
+    def next_job(self, timeout=1.0):
+        """
+        从共享队列领取一个任务，登记为在本进程中运行。
+        :return: SharedPredictionSession；timeout 秒内没有任务时返回 None
+        """
+        try:
+            session_id, owner_sid, params = self.cluster.jobs.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        session = SharedPredictionSession(session_id, owner_sid, params, self)
+        with self.cluster.lock:
+            entry = self.cluster.sessions.get(session_id)
+            if entry is not None:
+                self.cluster.sessions[session_id] = entry[:3] + (self.cluster.index,)
+        with self._lock:
+            self._running[session_id] = session
+        logging.info(f"Prediction session <{session_id}> assigned to worker {self.cluster.index}.")
+        return session
+
+    def state_of(self, session_id):
+        entry = self.cluster.sessions.get(session_id)
+        return None if entry is None else entry[1]
+
+    def set_state(self, session_id, state):
+        """
+        更新会话状态；已停止的会话不会再被暂停或恢复。
+        """
+        with self.cluster.lock:
+            entry = self.cluster.sessions.get(session_id)
+            if entry is not None and entry[1] != 'stopped':
+                self.cluster.sessions[session_id] = (entry[0], state) + entry[2:]
+
+    def get(self, session_id):
+        with self._lock:
+            session = self._running.get(session_id)
+        if session is not None:
+            return session
+        entry = self.cluster.sessions.get(session_id)
+        if entry is None:
+            return None
+        return SharedPredictionSession(session_id, entry[0], {}, self)
+
+    def remove(self, session_id):
+        with self.cluster.lock:
+            self.cluster.sessions.pop(session_id, None)
+        with self._lock:
+            return self._running.pop(session_id, None)
+
+    def sessions_of(self, owner_sid):
+        """
+        返回某个客户端发起的全部会话（无论在哪个进程中运行）。
+        """
+        sessions = (self.get(session_id) for session_id, entry in self.cluster.sessions.items()
+                    if entry[0] == owner_sid)
+        return [session for session in sessions if session is not None]
+
+    def stop_owner(self, owner_sid):
+        sessions = self.sessions_of(owner_sid)
+        for session in sessions:
+            session.stop()
+        return len(sessions)
+
+    def pending_steps(self):
+        """
+        本进程运行的会话中等待发送给客户端的时间步数。
+        """
+        with self._lock:
+            streamers = [s.streamer for s in self._running.values() if s.streamer is not None]
+        return sum(streamer.pending_steps for streamer in streamers)
+
+    def __len__(self):
+        """
+        在本进程中运行的会话数。
+        """
+        with self._lock:
+            return len(self._running)
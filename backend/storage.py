@@ -0,0 +1,395 @@
+# storage.py
+import logging
+import threading
+import time
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+VALUE_COLUMNS = ['采集值x', '采集值y', '采集值z']
+
+
+def embedded_type(pg_type):
+    """
+    将 PostgreSQL 类型映射为嵌入式列式引擎中的类型：REAL 保持 4 字节，其他浮点数用 DOUBLE。
+    文本列由 DuckDB 自动做字典压缩。
+    """
+    pg_type = pg_type.upper()
+    if pg_type == 'REAL':
+        return 'REAL'
+    if pg_type.startswith('NUMERIC') or pg_type in ('FLOAT', 'DOUBLE PRECISION'):
+        return 'DOUBLE'
+    if pg_type in ('TIMESTAMPTZ', 'TIMESTAMP WITH TIME ZONE'):
+        return 'TIMESTAMPTZ'
+    if pg_type.startswith('TIMESTAMP'):
+        return 'TIMESTAMP'
+    return pg_type
+
+
+def _quote(identifier):
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+class EmbeddedStore:
+    def __init__(self, path, internal_schema='store'):
+        """
+        基于 DuckDB 的嵌入式列式存储，用于扫描、聚合等分析型查询，
+        也可以在没有 PostgreSQL 的情况下单独承担全部存储。
+        :param path: DuckDB 数据库文件路径，":memory:" 表示内存数据库
+        :param internal_schema: 导入记录（高水位线）等内部表所在的模式，不出现在表列表中
+        """
+        if duckdb is None:
+            raise RuntimeError("嵌入式存储需要安装 duckdb")
+        self.path = path
+        self.internal_schema = internal_schema
+        self._connection = duckdb.connect(path)
+        self._lock = threading.Lock()
+        self._watermarks_ready = False
+
+    def _cursor(self):
+        # DuckDB 的连接不是线程安全的，每次操作使用独立的游标连接
+        with self._lock:
+            return self._connection.cursor()
+
+    def execute(self, sql, params=None):
+        """
+        执行查询并返回全部结果行。
+        """
+        cursor = self._cursor()
+        try:
+            return cursor.execute(sql, params or {}).fetchall()
+        finally:
+            cursor.close()
+
+    # 元数据
+    def table_exists(self, table_name):
+        rows = self.execute("SELECT 1 FROM information_schema.tables WHERE table_name = $table_name",
+                            {'table_name': table_name})
+        return bool(rows)
+
+    def list_tables(self):
+        return [row[0] for row in self.execute(
+            "SELECT table_name FROM information_schema.tables WHERE table_schema = 'main' ORDER BY table_name")]
+
+    def column_types(self, table_name):
+        rows = self.execute("""
+            SELECT column_name, data_type FROM information_schema.columns
+            WHERE table_name = $table_name ORDER BY ordinal_position
+        """, {'table_name': table_name})
+        return {row[0]: row[1] for row in rows}
+
+    def columns(self, table_name):
+        return list(self.column_types(table_name))
+
+    def drop_table(self, table_name):
+        self.execute(f"DROP TABLE IF EXISTS {_quote(table_name)}")
+        if self._watermarks_ready:
+            self.execute(f"DELETE FROM {self._watermark_table} WHERE table_name = $table_name",
+                         {'table_name': table_name})
+
+    # 高水位线
+    @property
+    def _watermark_table(self):
+        return f"{self.internal_schema}.ingest_watermarks"
+
+    def _ensure_watermarks(self, cursor):
+        if not self._watermarks_ready:
+            cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {self.internal_schema}")
+            cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self._watermark_table} (
+                    table_name VARCHAR NOT NULL,
+                    device VARCHAR NOT NULL,
+                    high_water TIMESTAMP NOT NULL,
+                    PRIMARY KEY (table_name, device)
+                )
+            """)
+            self._watermarks_ready = True
+
+    def _save_watermarks(self, cursor, table_name, source):
+        """
+        用 source（表格本身或新数据）中每个设备的最晚时间推进高水位线，与 db.save_watermarks 相同。
+        """
+        self._ensure_watermarks(cursor)
+        cursor.execute(f"""
+            INSERT INTO {self._watermark_table}
+            SELECT $table_name, CAST("设备编号" AS VARCHAR), MAX("时间") FROM {source}
+            WHERE "设备编号" IS NOT NULL AND "时间" IS NOT NULL
+            GROUP BY "设备编号"
+            ON CONFLICT (table_name, device) DO UPDATE
+            SET high_water = greatest(high_water, EXCLUDED.high_water)
+        """, {'table_name': table_name})
+
+    # 导入
+    def create_table(self, table_name, column_types):
+        """
+        :param column_types: [(字段名, PostgreSQL 类型)]
+        """
+        columns = ', '.join(f"{_quote(name)} {embedded_type(pg_type)}" for name, pg_type in column_types)
+        self.execute(f"CREATE TABLE IF NOT EXISTS {_quote(table_name)} ({columns})")
+
+    @staticmethod
+    def _csv_expressions(headers, column_types):
+        """
+        按列清洗 CSV 字段的 SQL 表达式：'nan' 转为 NULL，不带时区的时间列去掉时区后缀
+        （与 PostgreSQL TIMESTAMP 列的行为一致）。与 db._clean_chunk 相同，无效的“时间”转为 NULL，
+        其他列的空字符串转为 NULL，不符合列类型的值使导入报错。
+        """
+        expressions = []
+        for header in headers:
+            column = f"NULLIF({_quote(header)}, 'nan')"
+            data_type = column_types.get(header, 'VARCHAR')
+            if data_type == 'TIMESTAMP':
+                column = f"regexp_replace({column}, '[+-][0-9]{{2}}(:?[0-9]{{2}})?$', '')"
+            if header == '时间' and data_type != 'VARCHAR':
+                column = f"TRY_CAST({column} AS {data_type})"
+            elif data_type != 'VARCHAR':
+                column = f"CAST(NULLIF(trim({column}), '') AS {data_type})"
+            expressions.append(column)
+        return expressions
+
+    def load_csv(self, table_name, headers, file_path, delimiter='\t'):
+        """
+        由 DuckDB 直接流式读取 CSV 并写入表格，清洗规则见 _csv_expressions。
+        :return: 写入的行数
+        """
+        start_time = time.perf_counter()
+        expressions = self._csv_expressions(headers, self.column_types(table_name))
+        cursor = self._cursor()
+        try:
+            before = cursor.execute(f"SELECT COUNT(*) FROM {_quote(table_name)}").fetchone()[0]
+            cursor.execute(f"""
+                INSERT INTO {_quote(table_name)} ({', '.join(_quote(h) for h in headers)})
+                SELECT {', '.join(expressions)}
+                FROM read_csv($file_path, delim = $delimiter, header = true, all_varchar = true)
+            """, {'file_path': file_path, 'delimiter': delimiter})
+            rows = cursor.execute(f"SELECT COUNT(*) FROM {_quote(table_name)}").fetchone()[0] - before
+            if '设备编号' in headers and '时间' in headers:
+                self._save_watermarks(cursor, table_name, _quote(table_name))
+        finally:
+            cursor.close()
+        elapsed = max(time.perf_counter() - start_time, 1e-9)
+        logging.info(f"嵌入式存储导入成功: {table_name} rows={rows} rows/s={rows / elapsed:.1f}")
+        return rows
+
+    def upsert_csv(self, table_name, headers, file_path, delimiter='\t'):
+        """
+        追加导入：按 (设备编号, 时间) 合并，同一键在文件中以最后一行为准；
+        取值变化的已有行先删除再写入，完全相同的行和缺少设备编号或时间的行跳过。
+        早于该设备高水位线的行直接丢弃；与表格比较时只读取新数据最早时间之后的行，
+        数据按时间追加时 DuckDB 按行组的最小/最大值跳过更早的历史，耗时只与新数据有关。
+        :return: {'inserted', 'updated', 'skipped', 'time_from'}
+        """
+        expressions = self._csv_expressions(headers, self.column_types(table_name))
+        table = _quote(table_name)
+        columns = ', '.join(_quote(h) for h in headers)
+        same_key = 't."设备编号" = sps_new."设备编号" AND t."时间" = sps_new."时间"'
+        same_values = ' AND '.join(f't.{_quote(h)} IS NOT DISTINCT FROM sps_new.{_quote(h)}'
+                                   for h in headers)
+        recent = f'{table} t WHERE t."时间" >= $time_from'
+        cursor = self._cursor()
+        try:
+            self._ensure_watermarks(cursor)
+            cursor.execute("BEGIN TRANSACTION")
+            cursor.execute(f"""
+                CREATE OR REPLACE TEMP TABLE sps_staging AS
+                SELECT {', '.join(f'{e} AS {_quote(h)}' for e, h in zip(expressions, headers))},
+                       row_number() OVER () AS _seq
+                FROM read_csv($file_path, delim = $delimiter, header = true, all_varchar = true)
+            """, {'file_path': file_path, 'delimiter': delimiter})
+            total = cursor.execute("SELECT COUNT(*) FROM sps_staging").fetchone()[0]
+            cursor.execute(f"""
+                CREATE OR REPLACE TEMP TABLE sps_new AS
+                SELECT DISTINCT ON (s."设备编号", s."时间") {', '.join(f's.{_quote(h)}' for h in headers)}
+                FROM sps_staging s
+                LEFT JOIN {self._watermark_table} w
+                  ON w.table_name = $table_name AND w.device = CAST(s."设备编号" AS VARCHAR)
+                WHERE s."设备编号" IS NOT NULL AND s."时间" IS NOT NULL
+                  AND (w.high_water IS NULL OR s."时间" >= w.high_water)
+                ORDER BY s."设备编号", s."时间", s._seq DESC
+            """, {'table_name': table_name})
+            time_from = cursor.execute('SELECT MIN("时间") FROM sps_new').fetchone()[0]
+            self._save_watermarks(cursor, table_name, 'sps_new')
+            params = {'time_from': time_from}
+            cursor.execute(f"DELETE FROM sps_new WHERE EXISTS (SELECT 1 FROM {recent} AND {same_key} AND {same_values})",
+                           params)
+            updated = cursor.execute(
+                f"SELECT COUNT(*) FROM sps_new WHERE EXISTS (SELECT 1 FROM {recent} AND {same_key})",
+                params).fetchone()[0]
+            cursor.execute(f"DELETE FROM {table} t WHERE t.\"时间\" >= $time_from "
+                           f"AND EXISTS (SELECT 1 FROM sps_new WHERE {same_key})", params)
+            cursor.execute(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM sps_new")
+            changed = cursor.execute("SELECT COUNT(*) FROM sps_new").fetchone()[0]
+            cursor.execute("DROP TABLE sps_staging")
+            cursor.execute("DROP TABLE sps_new")
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        finally:
+            cursor.close()
+        inserted = changed - updated
+        logging.info(f"嵌入式存储追加导入成功: {table_name} inserted={inserted} updated={updated}")
+        return {'inserted': inserted, 'updated': updated, 'skipped': total - changed, 'time_from': time_from}
+
+    # 分页读取
+    def fetch_page(self, table_name, start, end):
+        return self.execute(f"SELECT * FROM {_quote(table_name)} LIMIT $limit OFFSET $offset",
+                            {'limit': end - start, 'offset': start})
+
+    def _filters(self, device=None, time_from=None, time_to=None, devices=None):
+        conditions = ['"时间" IS NOT NULL']
+        params = {}
+        if device is not None:
+            conditions.append('"设备编号" = $device')
+            params['device'] = device
+        if devices is not None:
+            conditions.append('list_contains($devices, "设备编号")')
+            params['devices'] = list(devices)
+        if time_from is not None:
+            conditions.append('"时间" >= $time_from')
+            params['time_from'] = time_from
+        if time_to is not None:
+            conditions.append('"时间" < $time_to')
+            params['time_to'] = time_to
+        return conditions, params
+
+    def insert_rows(self, table_name, columns, rows):
+        """
+        批量写入行（经 DataFrame 一次插入，比逐行 executemany 快得多）。
+        :param table_name: 表名，可带模式前缀
+        :param rows: [tuple]，与 columns 一一对应
+        """
+        if not rows:
+            return
+        import pandas as pd
+        frame = pd.DataFrame(rows, columns=columns)
+        cursor = self._cursor()
+        try:
+            cursor.register('sps_rows', frame)
+            cursor.execute(f"INSERT INTO {table_name} ({', '.join(_quote(c) for c in columns)}) "
+                           f"SELECT * FROM sps_rows")
+            cursor.unregister('sps_rows')
+        finally:
+            cursor.close()
+
+    def fetch_keyset(self, table_name, limit, after_device=None, after_time=None,
+                     device=None, time_from=None, time_to=None):
+        conditions, params = self._filters(device, time_from, time_to)
+        params['limit'] = limit
+        if after_device is not None and after_time is not None:
+            conditions.append('("设备编号" > $after_device OR ("设备编号" = $after_device AND "时间" > CAST($after_time AS TIMESTAMP)))')
+            params['after_device'] = after_device
+            params['after_time'] = after_time
+        elif after_device is not None:
+            conditions.append('"设备编号" > $after_device')
+            params['after_device'] = after_device
+        return self.execute(f"""
+            SELECT * FROM {_quote(table_name)} WHERE {' AND '.join(conditions)}
+            ORDER BY "设备编号", "时间" LIMIT $limit
+        """, params)
+
+    # 分析型查询
+    def time_range(self, table_name, device_ids, time_from=None, time_to=None):
+        conditions, params = self._filters(None, time_from, time_to, devices=device_ids)
+        return tuple(self.execute(
+            f'SELECT MIN("时间"), MAX("时间") FROM {_quote(table_name)} WHERE {" AND ".join(conditions)}',
+            params)[0])
+
+    def device_time_ranges(self, table_name, site_columns=(), changed_from=None):
+        """
+        每个设备的首末时间与所属隐患点，只返回最晚时间不早于 changed_from 的设备。
+        """
+        sites = ''.join(f", MIN({_quote(column)})" for column in site_columns)
+        conditions, params = self._filters()
+        conditions.append('"设备编号" IS NOT NULL')
+        having = ''
+        if changed_from is not None:
+            having = 'HAVING MAX("时间") >= $changed_from'
+            params['changed_from'] = changed_from
+        return self.execute(f"""
+            SELECT "设备编号", MIN("时间"), MAX("时间"){sites}
+            FROM {_quote(table_name)} WHERE {' AND '.join(conditions)}
+            GROUP BY "设备编号" {having} ORDER BY "设备编号"
+        """, params)
+
+    def last_complete_time(self, table_name, device_id, at):
+        conditions, params = self._filters(device_id)
+        conditions.append('"时间" <= $at')
+        conditions.extend(f'{_quote(column)} IS NOT NULL' for column in VALUE_COLUMNS)
+        params['at'] = at
+        rows = self.execute(f"""
+            SELECT MAX("时间") FROM {_quote(table_name)} WHERE {' AND '.join(conditions)}
+        """, params)
+        return rows[0][0]
+
+    def stream_device(self, table_name, device_id, time_from=None, time_to=None, fetch_size=2000):
+        """
+        按时间顺序分批读取某设备的 (时间, x, y, z)。
+        """
+        conditions, params = self._filters(device_id, time_from, time_to)
+        values = ', '.join(_quote(column) for column in VALUE_COLUMNS)
+        cursor = self._cursor()
+        try:
+            cursor.execute(f"""
+                SELECT "时间", {values} FROM {_quote(table_name)}
+                WHERE {' AND '.join(conditions)} ORDER BY "时间"
+            """, params)
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cursor.close()
+
+    def stream_devices(self, table_name, device_ids, time_from=None, time_to=None, fetch_size=2000):
+        """
+        用一个游标按时间顺序分批读取若干设备的 (设备编号, 时间, x, y, z)。
+        """
+        conditions, params = self._filters(None, time_from, time_to, devices=device_ids)
+        values = ', '.join(_quote(column) for column in VALUE_COLUMNS)
+        cursor = self._cursor()
+        try:
+            cursor.execute(f"""
+                SELECT "设备编号", "时间", {values} FROM {_quote(table_name)}
+                WHERE {' AND '.join(conditions)} ORDER BY "时间", "设备编号"
+            """, params)
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cursor.close()
+
+    def bucket_series(self, table_name, device_id, time_from, time_to, bucket_seconds):
+        """
+        按时间桶聚合，列顺序与 downsample.bucket_series 的 PostgreSQL 查询一致。
+        """
+        conditions, params = self._filters(device_id, time_from, time_to)
+        params.update({'bucket_us': int(round(bucket_seconds * 1e6)), 'origin': time_from})
+        aggregates = ', '.join(
+            f"MIN({_quote(c)}), MAX({_quote(c)}), AVG({_quote(c)})" for c in VALUE_COLUMNS)
+        return self.execute(f"""
+            SELECT time_bucket(to_microseconds(CAST($bucket_us AS BIGINT)), "时间", CAST($origin AS TIMESTAMP)) AS bucket,
+                   COUNT(*), {aggregates}
+            FROM {_quote(table_name)}
+            WHERE {' AND '.join(conditions)}
+            GROUP BY bucket ORDER BY bucket
+        """, params)
+
+    def device_statistics(self, table_name, device=None):
+        """
+        每个设备的行数、首末时间以及各采集值的 min/max/avg/stddev。
+        """
+        conditions, params = self._filters(device)
+        aggregates = ', '.join(
+            f"MIN({_quote(c)}), MAX({_quote(c)}), AVG({_quote(c)}), STDDEV_POP({_quote(c)})"
+            for c in VALUE_COLUMNS)
+        return self.execute(f"""
+            SELECT "设备编号", COUNT(*), MIN("时间"), MAX("时间"), {aggregates}
+            FROM {_quote(table_name)} WHERE {' AND '.join(conditions)}
+            GROUP BY "设备编号" ORDER BY "设备编号"
+        """, params)
@@ -0,0 +1,55 @@
+import hashlib
+
+import pytest
+
+from ingest import ChunkedUploadStore
+
+
+def split(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def test_resume_after_restart_and_assemble(tmp_path):
+    data = bytes(range(256)) * 40
+    chunks = split(data, 1000)
+    store = ChunkedUploadStore(str(tmp_path / 'chunks'))
+    upload_id = store.create('site.csv', len(chunks))
+    for index in (3, 0, 1):
+        store.save_chunk(upload_id, index, chunks[index])
+
+    # 服务重启后由磁盘上的暂存区继续，客户端只需补传缺失的分块
+    store = ChunkedUploadStore(str(tmp_path / 'chunks'))
+    assert store.received_chunks(upload_id) == [0, 1, 3]
+    with pytest.raises(ValueError, match="缺少分块"):
+        store.assemble(upload_id, str(tmp_path / 'site.csv'))
+    missing = sorted(set(range(len(chunks))) - set(store.received_chunks(upload_id)))
+    for index in missing:
+        store.save_chunk(upload_id, index, chunks[index], hashlib.sha256(chunks[index]).hexdigest())
+    store.save_chunk(upload_id, 0, chunks[0])    # 重复上传覆盖同一分块
+
+    target = store.assemble(upload_id, str(tmp_path / 'site.csv'))
+    with open(target, 'rb') as f:
+        assert f.read() == data
+    with pytest.raises(KeyError):
+        store.meta(upload_id)
+
+
+def test_checksum_mismatch_rejects_chunk(tmp_path):
+    store = ChunkedUploadStore(str(tmp_path / 'chunks'))
+    upload_id = store.create('site.csv', 2)
+    with pytest.raises(ValueError, match="校验失败"):
+        store.save_chunk(upload_id, 0, b'corrupted', hashlib.sha256(b'original').hexdigest())
+    assert store.received_chunks(upload_id) == []
+    store.save_chunk(upload_id, 0, b'original', hashlib.sha256(b'original').hexdigest().upper())
+    assert store.received_chunks(upload_id) == [0]
+
+
+def test_invalid_upload_and_chunk_index(tmp_path):
+    store = ChunkedUploadStore(str(tmp_path / 'chunks'))
+    upload_id = store.create('site.csv', 2)
+    with pytest.raises(ValueError, match="越界"):
+        store.save_chunk(upload_id, 2, b'data')
+    with pytest.raises(ValueError):
+        store.meta('../etc')
+    with pytest.raises(KeyError):
+        store.meta('0' * 32)
@@ -0,0 +1,30 @@
+import json
+from datetime import datetime
+from decimal import Decimal
+
+import numpy as np
+
+import columnar
+
+COLUMNS = ['设备编号', '时间', '采集值x', '备注']
+ROWS = [('431281011110020101', datetime(2021, 8, 19, 12, 0), Decimal('1.25'), Decimal('3')),
+        ('431281011110020102', None, None, 'ok')]
+
+
+def test_known_types_convert_by_column():
+    column_types = {'设备编号': 'text', '时间': 'timestamp without time zone',
+                    '采集值x': 'numeric', '备注': 'text'}
+    built = columnar.build_columns(COLUMNS, column_types, ROWS)
+    assert [kind for _, kind, _, _ in built] == ['text', 'timestamp', 'numeric', 'text']
+    _, _, times, mask = built[1]
+    # 无时区的时间按 UTC 解释
+    assert times[0] == np.datetime64('2021-08-19T12:00', 'ms').astype(np.int64)
+    assert mask.tolist() == [False, True]
+
+
+def test_unknown_types_are_inferred_and_serializable():
+    built = columnar.build_columns(COLUMNS, {}, ROWS)
+    assert [kind for _, kind, _, _ in built] == ['text', 'timestamp', 'numeric', 'text']
+    payload = json.loads(json.dumps(columnar.to_payload(built)))
+    assert payload['columns'][2] == [1.25, None]
+    assert payload['columns'][3] == ['3', 'ok']
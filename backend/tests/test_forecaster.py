@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from OnlineForecaster import OnlineForecaster
+from TimeSeriesForecaster import TimeSeriesForecaster
+
+
+@pytest.mark.parametrize('T, T_prime, C, V', [(16, 32, 3, 4), (5, 1, 1, 1), (64, 8, 2, 3)])
+def test_vectorized_bounds_match_reference(T, T_prime, C, V):
+    rng = np.random.default_rng(T)
+    # 绝对值较大、波动较小的数据容易放大累积和的舍入误差
+    data = 1e4 + rng.random((T + T_prime, C, V))
+    forecaster = TimeSeriesForecaster(data, T, T_prime)
+    for β in (0.5, 2.0):
+        lower, upper = forecaster._compute_bounds(β)
+        lower_ref, upper_ref = forecaster._compute_bounds(β, mode="reference")
+        np.testing.assert_allclose(lower, lower_ref, rtol=0, atol=1e-9)
+        np.testing.assert_allclose(upper, upper_ref, rtol=0, atol=1e-9)
+
+
+def test_constant_window_has_zero_width_bounds():
+    data = np.full((24, 2, 3), 7.25)
+    lower, upper = TimeSeriesForecaster(data, 16, 8)._compute_bounds()
+    np.testing.assert_array_equal(lower, data[:8])
+    np.testing.assert_array_equal(upper, data[:8])
+
+
+def test_online_forecaster_matches_batch_windows():
+    T, T_prime, C, V = 16, 8, 3, 4
+    rng = np.random.default_rng(0)
+    data = 100 + np.cumsum(rng.normal(0, 1, size=(T + 5 * T_prime, C, V)), axis=0)
+    data[rng.random(data.shape) < 0.05] = 0    # 缺测值
+    online = OnlineForecaster(T, C, V, refresh_interval=7)
+    results = [online.update(sample) for sample in data]
+    assert all(result is None for result in results[:T])
+
+    for start in range(0, len(data) - T - T_prime + 1, T_prime):
+        forecaster = TimeSeriesForecaster(data[start:start + T + T_prime], T, T_prime)
+        weighted, lower, upper = forecaster.forward()
+        is_anomaly = forecaster.detect_anomalies(weighted, lower, upper)
+        for t in range(T_prime):
+            result = results[start + T + t]
+            np.testing.assert_allclose(result['weighted_result'], weighted[t])
+            np.testing.assert_allclose(result['lower_bound'], lower[t], atol=1e-9)
+            np.testing.assert_allclose(result['upper_bound'], upper[t], atol=1e-9)
+            np.testing.assert_array_equal(result['is_anomaly'], is_anomaly[t])
@@ -0,0 +1,50 @@
+import numpy as np
+
+from frame_stream import FrameStreamer
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_streamer():
+    clock, sent = FakeClock(), []
+    streamer = FrameStreamer(lambda frame, callback: sent.append((frame, callback)),
+                             frame_rate=10, ack_timeout=5.0, clock=clock)
+    return streamer, clock, sent
+
+
+def push_step(streamer, step):
+    streamer.push(step, np.ones(2), np.zeros(2), np.full(2, 2.0), 100.0)
+
+
+def test_waits_for_ack_before_next_frame():
+    streamer, clock, sent = make_streamer()
+    push_step(streamer, 0)
+    assert streamer.poll()
+    push_step(streamer, 1)
+    clock.now = 1.0
+    assert not streamer.poll()            # 未确认
+    sent[0][1]()
+    assert streamer.poll()
+    assert [frame['seq'] for frame, _ in sent] == [0, 1]
+
+
+def test_late_ack_of_older_frame_is_ignored():
+    streamer, clock, sent = make_streamer()
+    push_step(streamer, 0)
+    streamer.poll()
+    push_step(streamer, 1)
+    clock.now = 6.0                       # 第 0 帧超时，视为丢失
+    assert streamer.poll()
+    push_step(streamer, 2)
+    clock.now = 7.0
+    sent[0][1]()                          # 第 0 帧的确认迟到
+    assert not streamer.poll()
+    sent[1][1]()
+    assert streamer.poll()
+    assert [frame['start_step'] for frame, _ in sent] == [0, 1, 2]
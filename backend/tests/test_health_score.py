@@ -0,0 +1,59 @@
+import numpy as np
+
+from TimeSeriesForecaster import HealthScoreState, TimeSeriesForecaster
+
+
+def reference_health_score(is_anomaly, alpha=0.9, beta=0.5, gamma=0.1):
+    """
+    原来逐步重新求和的实现，O(T'^2·C)。
+    """
+    y, C = is_anomaly.shape
+    health_score = 100 * np.ones(y)
+    for t in range(1, y):
+        duration = np.sum(is_anomaly[:t, :], axis=0)
+        simultaneous_anomalies = np.sum(is_anomaly[t, :])
+        health_score[t] = 100 - alpha * (beta * np.sum(duration) + (
+            1 - beta) * simultaneous_anomalies) * np.exp(-gamma * (t - 1))
+    return health_score
+
+
+def test_single_window_matches_reference():
+    rng = np.random.default_rng(0)
+    is_anomaly = (rng.random((64, 3)) < 0.3).astype(int)
+    forecaster = TimeSeriesForecaster(rng.random((80, 3, 4)), 16, 64)
+    np.testing.assert_allclose(forecaster.compute_health_score(is_anomaly),
+                               reference_health_score(is_anomaly))
+
+
+def test_batch_dimension_matches_per_series():
+    rng = np.random.default_rng(1)
+    is_anomaly = (rng.random((5, 32, 3)) < 0.3).astype(int)
+    batched = HealthScoreState().update_batch(is_anomaly)
+    for n in range(5):
+        np.testing.assert_allclose(batched[n], reference_health_score(is_anomaly[n]))
+
+
+def test_steady_anomalies_stay_below_100_in_later_windows():
+    state = HealthScoreState()
+    is_anomaly = np.ones((32, 3), dtype=int)
+    for _ in range(50):
+        health_score = state.update_batch(is_anomaly)
+    assert np.all(health_score < 100)
+    # 衰减相对最新的窗口：稳定异常的数据流在之后的窗口中评分不再变化
+    np.testing.assert_allclose(state.update_batch(is_anomaly), health_score)
+
+
+def test_carried_state_recovers_after_anomalies_stop():
+    state = HealthScoreState()
+    state.update_batch(np.ones((32, 3), dtype=int))
+    health_score = state.update_batch(np.zeros((32, 3), dtype=int))
+    assert health_score[0] < 100
+    assert np.all(np.diff(health_score) >= 0)
+
+
+def test_single_steps_decay_relative_to_newest_step():
+    state = HealthScoreState()
+    scores = [state.update(np.ones(3, dtype=int)) for _ in range(500)]
+    assert scores[0] == 100
+    assert max(scores[1:]) < 100
+    assert abs(scores[-1] - scores[-2]) < 1e-9
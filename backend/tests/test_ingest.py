@@ -0,0 +1,117 @@
+import csv
+
+import pandas as pd
+import pytest
+
+from benchmark import generate_sensor_csv
+from conftest import TABLE_PREFIX, count_rows
+from db import (copy_csv_data, create_table_from_csv, infer_column_types, infer_type, upsert_csv_data,
+                _clean_chunk)
+from ingest import read_csv_headers
+
+
+def write_rows(path, headers, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f, delimiter='\t')
+        writer.writerow(headers)
+        writer.writerows(rows)
+
+
+def read_rows(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return list(csv.reader(f, delimiter='\t'))
+
+
+def create_and_load(table_name, file_path, **kwargs):
+    headers = read_csv_headers(file_path)
+    column_types = infer_column_types(headers, file_path)
+    create_table_from_csv(table_name, headers, column_types)
+    return copy_csv_data(table_name, headers, file_path, column_types=column_types, **kwargs)
+
+
+def test_streamed_ingest_writes_every_row(backend_app, tmp_path):
+    file_path = str(tmp_path / 'site.csv')
+    total = generate_sensor_csv(file_path, devices=3, rows_per_device=50, missing_rate=0.1)
+    progress = []
+    rows = create_and_load(TABLE_PREFIX + 'copy', file_path, chunk_size=16,
+                           progress=lambda *args: progress.append(args))
+
+    assert rows == total
+    assert count_rows(TABLE_PREFIX + 'copy') == total
+    inserted = [rows_inserted for _, rows_inserted, _ in progress]
+    assert inserted == sorted(inserted)
+    assert progress[-1][:2] == (total, total)
+
+
+def test_append_counts_inserted_updated_and_skipped(backend_app, tmp_path):
+    if backend_app.config['BACKEND'] == 'sqlite':
+        pytest.skip("追加导入需要 PostgreSQL 或嵌入式存储")
+    devices = 3
+    full_path = str(tmp_path / 'full.csv')
+    generate_sensor_csv(full_path, devices=devices, rows_per_device=50, missing_rate=0)
+    headers, *rows = read_rows(full_path)
+    by_device = [rows[d * 50:(d + 1) * 50] for d in range(devices)]
+
+    first_path, second_path = str(tmp_path / 'day1.csv'), str(tmp_path / 'day2.csv')
+    write_rows(first_path, headers, [row for device_rows in by_device for row in device_rows[:30]])
+    second = []
+    for device_rows in by_device:
+        overlap = [list(row) for row in device_rows[25:30]]
+        overlap[0][-1] = '0.50'      # 早于高水位线的修改不发送到数据库
+        overlap[-1][-1] = '0.25'     # 高水位线上的行取值变化：更新
+        second += overlap + device_rows[30:]
+        second.append(list(device_rows[49]))    # 文件内重复的键以最后一行为准
+    write_rows(second_path, headers, second)
+
+    create_and_load(TABLE_PREFIX + 'append', first_path)
+    counts = upsert_csv_data(TABLE_PREFIX + 'append', headers, second_path)
+
+    assert counts['inserted'] == devices * 20
+    assert counts['updated'] == devices
+    assert counts['skipped'] == len(second) - devices * 21
+    assert count_rows(TABLE_PREFIX + 'append') == devices * 50
+    assert count_rows(TABLE_PREFIX + 'append', "采集值z = 0.25") == devices
+    assert count_rows(TABLE_PREFIX + 'append', "采集值z = 0.5") == 0
+
+    # 再次追加同一文件：没有新行，也没有变化
+    again = upsert_csv_data(TABLE_PREFIX + 'append', headers, second_path)
+    assert (again['inserted'], again['updated']) == (0, 0)
+
+
+def test_infer_type_from_sample():
+    assert infer_type('数量', pd.Series(['1', '-2', '30'])) == 'BIGINT'
+    assert infer_type('采集值x', pd.Series(['0', '1'])) == 'DOUBLE PRECISION'
+    assert infer_type('温度', pd.Series(['1.25', '-3.5'])) == 'REAL'
+    assert infer_type('温度', pd.Series(['1.2345678'])) == 'DOUBLE PRECISION'
+    assert infer_type('备注', pd.Series(['1.5', 'abc'])) == 'TEXT'
+    assert infer_type('记录时间', pd.Series(['x'])) == 'TIMESTAMP'
+    assert infer_type('设备编号', pd.Series(['431281011110020101'])) == 'TEXT'
+    assert infer_type('更新于', pd.Series(['2021-08-19 12:00:00+08:00'])) == 'TIMESTAMPTZ'
+
+
+def test_clean_chunk_rejects_values_outside_inferred_type():
+    chunk = pd.DataFrame({'数量': ['1', '', 'x2'], '采集值x': ['1.5', 'nan', '2']})
+    with pytest.raises(ValueError, match="第 4 行 数量"):
+        _clean_chunk(chunk, list(chunk.columns), {'数量': 'BIGINT', '采集值x': 'REAL'})
+
+    cleaned = _clean_chunk(chunk.iloc[:2], list(chunk.columns), {'数量': 'BIGINT', '采集值x': 'REAL'})
+    assert cleaned['数量'][0] == '1' and pd.isna(cleaned['数量'][1])
+    assert cleaned['采集值x'][0] == '1.5' and pd.isna(cleaned['采集值x'][1])
+
+
+def test_bad_value_after_sample_fails_ingest(backend_app, tmp_path):
+    if backend_app.config['BACKEND'] == 'embedded':
+        pytest.skip("嵌入式存储由 DuckDB 直接转换类型")
+    file_path = str(tmp_path / 'counts.csv')
+    rows = [[str(i), f"{i}.5"] for i in range(40)]
+    rows[30][0] = 'n/a'
+    write_rows(file_path, ['数量', '采集值x'], rows)
+    headers = read_csv_headers(file_path)
+    column_types = infer_column_types(headers, file_path, sample_rows=10)
+    assert column_types == {'数量': 'BIGINT', '采集值x': 'REAL'}
+    create_table_from_csv(TABLE_PREFIX + 'counts', headers, column_types)
+
+    with pytest.raises(ValueError, match="第 32 行 数量"):
+        copy_csv_data(TABLE_PREFIX + 'counts', headers, file_path, chunk_size=8, column_types=column_types)
+    # 整个文件在一个事务中写入，出错时不留下部分数据
+    assert count_rows(TABLE_PREFIX + 'counts') == 0
@@ -0,0 +1,20 @@
+from metrics import Counter, Gauge, Histogram, Registry
+
+
+def test_const_labels_are_added_to_every_sample():
+    registry = Registry()
+    requests = registry.register(Counter('requests_total', 'Requests.', ('route',)))
+    sessions = registry.register(Gauge('sessions', 'Sessions.'))
+    latency = registry.register(Histogram('latency_seconds', 'Latency.', buckets=(0.1,)))
+    requests.inc(route='/a')
+    sessions.set_function(lambda: 3)
+    latency.observe(0.05)
+
+    assert 'requests_total{route="/a"} 1.0' in registry.render()
+
+    registry.set_const_labels(worker=2)
+    lines = registry.render().splitlines()
+    assert 'requests_total{route="/a",worker="2"} 1.0' in lines
+    assert 'sessions{worker="2"} 3' in lines
+    assert 'latency_seconds_bucket{worker="2",le="0.1"} 1' in lines
+    assert 'latency_seconds_count{worker="2"} 1' in lines
@@ -0,0 +1,49 @@
+from benchmark import generate_sensor_csv
+from conftest import TABLE_PREFIX, count_rows
+from db import copy_csv_data, create_table_from_csv, get_table_data_keyset, infer_column_types
+from ingest import read_csv_headers
+
+DEVICE, TIME = 5, 6     # 设备编号、时间在 benchmark.HEADERS 中的位置
+
+
+def load_table(table_name, file_path):
+    headers = read_csv_headers(file_path)
+    column_types = infer_column_types(headers, file_path)
+    create_table_from_csv(table_name, headers, column_types)
+    copy_csv_data(table_name, headers, file_path, column_types=column_types)
+
+
+def test_keyset_pages_cover_every_row_once(backend_app, tmp_path):
+    file_path = str(tmp_path / 'site.csv')
+    generate_sensor_csv(file_path, devices=4, rows_per_device=30, missing_rate=0.1)
+    load_table(TABLE_PREFIX + 'pages', file_path)
+
+    keys, after = [], (None, None)
+    while True:
+        page = get_table_data_keyset(TABLE_PREFIX + 'pages', 7, *after)
+        if not page:
+            break
+        assert len(page) <= 7
+        keys += [(row[DEVICE], row[TIME]) for row in page]
+        after = keys[-1]
+
+    # 严格递增：相邻页之间没有重复，也没有跳过；时间为空的行不参与键集分页
+    assert keys == sorted(keys) and len(set(keys)) == len(keys)
+    assert len(keys) == count_rows(TABLE_PREFIX + 'pages', "时间 IS NOT NULL")
+
+
+def test_keyset_pages_within_device_and_time_range(backend_app, tmp_path):
+    file_path = str(tmp_path / 'site.csv')
+    generate_sensor_csv(file_path, devices=3, rows_per_device=30, missing_rate=0)
+    load_table(TABLE_PREFIX + 'range', file_path)
+    device = '431281011110020102'
+    time_from, time_to = '2021-08-19 13:00:00', '2021-08-19 15:00:00'
+
+    first = get_table_data_keyset(TABLE_PREFIX + 'range', 8, device=device, time_from=time_from, time_to=time_to)
+    second = get_table_data_keyset(TABLE_PREFIX + 'range', 8, first[-1][DEVICE], first[-1][TIME],
+                                   device=device, time_from=time_from, time_to=time_to)
+    rows = first + second
+    # 13:00 到 15:00（不含）每 10 分钟一条
+    assert len(first) == 8 and len(second) == 4
+    assert {row[DEVICE] for row in rows} == {device}
+    assert len({row[TIME] for row in rows}) == 12
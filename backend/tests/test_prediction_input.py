@@ -0,0 +1,69 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from flask import Flask
+from sqlalchemy import text
+from sqlalchemy.pool import QueuePool
+
+import prediction_input
+from db import db
+from prediction_input import iter_table_windows, resample_readings, _parse_time
+
+POOL_SIZE, MAX_OVERFLOW = 2, 1
+START = datetime(2021, 8, 1)
+STEP = 600
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    app = Flask(__name__)
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'readings.db'}",
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        SQLALCHEMY_ENGINE_OPTIONS={'poolclass': QueuePool, 'pool_size': POOL_SIZE,
+                                   'max_overflow': MAX_OVERFLOW, 'pool_timeout': 1,
+                                   'connect_args': {'detect_types': sqlite3.PARSE_DECLTYPES}})
+    db.init_app(app)
+    # SQLite 的 MIN/MAX 返回字符串，PostgreSQL 返回时间
+    get_time_range = prediction_input.get_time_range
+    monkeypatch.setattr(prediction_input, 'get_time_range',
+                        lambda *args: tuple(map(_parse_time, get_time_range(*args))))
+    with app.app_context():
+        yield app
+
+
+def create_readings(devices, n_steps):
+    """
+    各设备每 10 分钟一条读数，设备之间的时间错开，部分读数缺测。
+    """
+    rng = np.random.default_rng(0)
+    db.session.execute(text("CREATE TABLE readings (设备编号 TEXT, 时间 TIMESTAMP, "
+                            "采集值x REAL, 采集值y REAL, 采集值z REAL)"))
+    rows = []
+    for d, device in enumerate(devices):
+        for k in range(n_steps):
+            x, y, z = rng.random(3).tolist()
+            rows.append({'device': device, 'time': START + timedelta(seconds=k * STEP + d),
+                         'x': x, 'y': None if k % 7 == 3 else y, 'z': z})
+    db.session.execute(text("INSERT INTO readings VALUES (:device, :time, :x, :y, :z)"), rows)
+    db.session.commit()
+    return rows
+
+
+def test_windows_use_one_connection_for_many_devices(app):
+    devices = [f"4312810111100201{d:02d}" for d in range(POOL_SIZE + MAX_OVERFLOW + 17)]
+    rows = create_readings(devices, 60)
+    T, T_prime = 16, 8
+    windows = list(iter_table_windows('readings', devices, T, T_prime))
+    assert len(windows) == (60 - T - T_prime) // T_prime + 1
+    assert windows[0].shape == (T + T_prime, len(devices), 3)
+
+    # 与逐个设备重采样的结果一致
+    first_time = min(row['time'] for row in rows)
+    for d, device in enumerate(devices):
+        readings = [(row['time'], row['x'], row['y'], row['z']) for row in rows if row['device'] == device]
+        expected = np.array(list(resample_readings(readings, first_time, timedelta(seconds=STEP), 60)))
+        for k, window in enumerate(windows):
+            np.testing.assert_allclose(window[:, d], expected[k * T_prime:k * T_prime + T + T_prime])